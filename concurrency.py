@@ -0,0 +1,196 @@
+"""Per-(endpoint, model) concurrency pools with fair queuing across users.
+
+Replaces the single ``asyncio.Semaphore(5)`` each API client used to guard
+all of its traffic.  Every ``(endpoint, model)`` pair — e.g.
+``("/responses", "grok-4…-reasoning")`` or ``("/documents/search", "")`` —
+gets its own :class:`FairSemaphore`, so a handful of slow reasoning streams
+can no longer starve ``/fast`` calls or collection searches.
+
+Each pool allows ``XAI_MAX_CONCURRENT`` requests in flight (default 5, the
+old per-client semaphore), with per-model overrides; request and token
+rates are enforced separately by the model limits below.  Inside a pool
+waiters are grouped per user and served round-robin, so one user firing
+many requests cannot push everyone else to the back of the queue.  The
+user comes from :data:`current_user`, bound for each Telegram update by
+:func:`update_processor.bind_current_user`.
+
+With :meth:`ConcurrencyScheduler.set_model_limits` every slot is first
+admitted by the model's :class:`rate_limiter.ModelRateLimit` (requests and
+tokens per minute), so work queues here rather than hitting a 429.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable
+
+import structlog
+
+from rate_limiter import Admission, ModelRateLimit
+
+logger = structlog.get_logger(__name__)
+
+# User on whose behalf the current task calls the API (None = system/background)
+current_user: ContextVar[int | None] = ContextVar("current_user", default=None)
+
+
+class FairSemaphore:
+    """Counting semaphore whose waiters are served round-robin per user."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._active = 0
+        self._waiters: OrderedDict[int | None, deque[asyncio.Future[None]]] = OrderedDict()
+        self._stats: dict[str, float] = {
+            "acquired": 0,
+            "queued": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    async def acquire(self, user: int | None = None) -> None:
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            self._stats["acquired"] += 1
+            return
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append(future)
+        self._stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just before the cancellation — hand it on
+                self.release()
+            else:
+                self._remove_waiter(user, future)
+            raise
+        waited = time.monotonic() - started
+        self._stats["acquired"] += 1
+        self._stats["wait_total"] += waited
+        self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+
+    def release(self) -> None:
+        self._active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._active < self.limit and self._waiters:
+            user, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                # Other users go first; this user's next request waits its turn
+                self._waiters.move_to_end(user)
+            else:
+                del self._waiters[user]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def _remove_waiter(self, user: int | None, future: asyncio.Future[None]) -> None:
+        queue = self._waiters.get(user)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        if not queue:
+            del self._waiters[user]
+
+    def status(self) -> dict[str, Any]:
+        acquired = int(self._stats["acquired"])
+        queued = int(self._stats["queued"])
+        return {
+            "limit": self.limit,
+            "active": self._active,
+            "waiting": self.waiting,
+            "acquired": acquired,
+            "queued": queued,
+            "avg_wait_ms": round(self._stats["wait_total"] / queued * 1000, 1) if queued else 0.0,
+            "max_wait_ms": round(self._stats["wait_max"] * 1000, 1),
+        }
+
+
+class ConcurrencyScheduler:
+    """Lazily created :class:`FairSemaphore` per ``(endpoint, model)``."""
+
+    def __init__(self, limit: int = 5, model_limits: dict[str, int] | None = None) -> None:
+        self._default_limit = limit
+        self._model_limits = dict(model_limits or {})
+        self._pools: dict[tuple[str, str], FairSemaphore] = {}
+        self._rate_limits: Callable[[str], ModelRateLimit | None] | None = None
+
+    def set_model_limits(self, lookup: Callable[[str], ModelRateLimit | None] | None) -> None:
+        """Admit requests through ``lookup(model)`` (e.g. :meth:`RateLimiter.model_limit`)."""
+        self._rate_limits = lookup
+
+    def configure(self, limit: int, model_limits: dict[str, int] | None = None) -> None:
+        """Set in-flight limits per pool; existing pools are resized in place."""
+        self._default_limit = limit
+        self._model_limits.update(model_limits or {})
+        for (_, model), pool in self._pools.items():
+            pool.limit = self._limit_for(model)
+            pool._wake()
+
+    def _limit_for(self, model: str) -> int:
+        return self._model_limits.get(model, self._default_limit)
+
+    def pool(self, endpoint: str, model: str = "") -> FairSemaphore:
+        key = (endpoint, model)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = FairSemaphore(self._limit_for(model))
+        return pool
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, model: str = "", tokens: int = 0) -> AsyncIterator[Admission]:
+        """Hold one in-flight request slot of the ``(endpoint, model)`` pool.
+
+        Once it has the slot, the request is admitted by the model's rate
+        limit with an estimate of *tokens* input tokens — a request cancelled
+        while queued for the pool never takes a place in the window.  The
+        yielded :class:`Admission` takes the response headers and the
+        reported usage.
+        """
+        limit = self._rate_limits(model) if self._rate_limits and model else None
+        pool = self.pool(endpoint, model)
+        await pool.acquire(current_user.get())
+        try:
+            admission = await limit.admit(tokens) if limit else Admission()
+            yield admission
+        finally:
+            pool.release()
+
+    def status(self) -> list[dict[str, Any]]:
+        """Return per-pool queue metrics for diagnostics."""
+        return [
+            {"endpoint": endpoint, "model": model, **pool.status()}
+            for (endpoint, model), pool in sorted(self._pools.items())
+        ]
+
+
+_scheduler: ConcurrencyScheduler | None = None
+
+
+def get_concurrency_scheduler() -> ConcurrencyScheduler:
+    """Return the process-wide scheduler shared by all API clients."""
+    global _scheduler  # noqa: PLW0603
+    if _scheduler is None:
+        _scheduler = ConcurrencyScheduler()
+    return _scheduler
@@ -9,6 +9,8 @@ Enhanced with:
 
 from __future__ import annotations
 
+from functools import cached_property
+
 from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -89,7 +91,7 @@ class Settings(BaseSettings):
     xai_model_reasoning: str = "grok-4.20-0309-reasoning"
     xai_model_fast: str = "grok-4.20-0309-non-reasoning"
     db_path: str = "gigagrok.db"
-    max_history: int = 20
+    max_history: int = 64  # upper bound on messages; CONTEXT_TOKEN_BUDGET decides how many fit
     max_output_tokens: int = 16000
     default_reasoning_effort: str = "high"  # ignored for Grok 4, kept for compat
     log_level: str = "INFO"
@@ -102,6 +104,7 @@ class Settings(BaseSettings):
     gigagrok_verify_pass: bool = True
     gigagrok_max_output_tokens: int = 16000
     gigagrok_context_messages: int = 5
+    gigagrok_context_tokens: int = 8_000  # estimated history tokens added to /gigagrok
 
     # === Multi-model provider keys (aligned with N.O.C) ===
     deepseek_api_key: str = ""
@@ -115,10 +118,68 @@ class Settings(BaseSettings):
     # === Claude bridge (ask_claude tool) ===
     anthropic_api_key: str = ""
 
+    # === Context budget ===
+    context_token_budget: int = 24_000  # estimated prompt tokens per request: system + history + new turn
+
+    # === Conversation summaries ===
+    summary_enabled: bool = True  # compact older turns into a rolling summary (XAI_MODEL_FAST)
+    summary_keep_recent: int = 20  # newest messages never summarised
+    summary_batch_messages: int = 20  # summarise once this many older messages accumulate
+    summary_max_tokens: int = 1000  # output limit of one summary
+
+    # === Conversation state (Responses API) ===
+    xai_stateful_conversations: bool = False  # chain turns via previous_response_id instead of replaying history
+    xai_response_chain_ttl_hours: float = 24.0  # older chains fall back to full history replay
+
+    # === Tool calls (Responses API) ===
+    tool_max_rounds: int = 3  # follow-up requests with tool outputs per answer
+    tool_timeout_s: float = 120.0  # per tool call; a timeout is reported back to the model
+
     # === Rate limiting & budgets ===
-    rate_limit_rpm: int = 30
+    xai_max_concurrent: int = 5  # in-flight API requests per (endpoint, model) pool
+    rate_limit_rpm: int = 30  # requests per minute per model (the fast model gets twice as many)
+    rate_limit_tpm: int = 1_000_000  # input + output tokens per minute per model (0 = untracked)
     daily_cost_cap_usd: float = 5.0
     daily_request_cap: int = 200
+    daily_token_cap: int = 500_000  # input + output + reasoning tokens per user per UTC day
+
+    # === API retries ===
+    retry_max_attempts: int = 3
+    retry_base_delay_s: float = 1.0  # full-jitter backoff: uniform(0, base * 2**attempt)
+    retry_max_delay_s: float = 30.0
+    retry_deadline_s: float = 300.0  # no new attempt starts after this many seconds
+
+    # === Telegram streaming (edit scheduler) ===
+    telegram_edit_chat_interval: float = 1.0  # min seconds between edits in one chat
+    telegram_edit_global_rate: float = 25.0  # bot-wide edits per second
+    telegram_concurrent_updates: int = 1  # >1 = that many users in parallel (opt-in); one user's stay in order
+
+    # === HTTP connection pool ===
+    http2_enabled: bool = True  # HTTP/2 multiplexing (needs httpx[http2]; falls back to HTTP/1.1)
+    http_max_connections: int = 20
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry_s: float = 120.0  # idle pooled connections are kept this long
+    http_prewarm_connections: int = 2  # connections opened to api.x.ai at startup (0 = off)
+
+    # === Database connections ===
+    db_reader_pool_size: int = 3  # read-only WAL connections for SELECTs (0 = share the writer)
+
+    # === Database write-behind ===
+    db_write_behind_enabled: bool = True  # False = commit every message before replying (crash-safe)
+    db_write_behind_interval_ms: int = 250  # max age of a queued write before a flush
+    db_write_behind_max_rows: int = 100  # flush early once this many exchanges are queued
+
+    # === Response cache (exact-match answers) ===
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 512  # in-memory LRU; older entries stay in SQLite
+    response_cache_ttl_websearch_s: float = 600.0  # 0 = do not cache this command
+    response_cache_ttl_xsearch_s: float = 300.0
+    response_cache_ttl_collectionsearch_s: float = 3600.0
+    response_cache_ttl_fast_s: float = 900.0
+
+    # === Conversation history cache ===
+    history_cache_messages: int = 64  # recent messages kept in memory per user, at least MAX_HISTORY (0 = off)
+    history_cache_max_bytes: int = 8_000_000  # total memory cap, LRU-evicted per user
 
     # === Feature flags ===
     multi_model_enabled: bool = False
@@ -138,9 +199,9 @@ class Settings(BaseSettings):
             raise ValueError("webhook_url must start with http:// or https://")
         return v
 
-    @property
-    def allowed_users(self) -> set[int]:
-        """Zwróć set dozwolonych user IDs."""
+    @cached_property
+    def allowed_users(self) -> frozenset[int]:
+        """Zwróć zbiór dozwolonych user IDs (parsowany raz)."""
         users: set[int] = set()
         if self.allowed_user_ids:
             for uid in self.allowed_user_ids.split(","):
@@ -149,9 +210,9 @@ class Settings(BaseSettings):
                     users.add(int(value))
         if self.admin_user_id:
             users.add(self.admin_user_id)
-        return users
+        return frozenset(users)
 
-    @property
+    @cached_property
     def admin_id(self) -> int:
         """Pierwszy ID z listy ALLOWED_USER_IDS to admin."""
         if self.allowed_user_ids:
@@ -160,6 +221,13 @@ class Settings(BaseSettings):
                 return int(first)
         return self.admin_user_id
 
+    @cached_property
+    def history_cache_size(self) -> int:
+        """Wiadomości trzymane w cache historii — nie mniej niż MAX_HISTORY (0 = wyłączony)."""
+        if self.history_cache_messages <= 0:
+            return 0
+        return max(self.history_cache_messages, self.max_history)
+
     def is_allowed(self, user_id: int) -> bool:
         """Zwróć True jeśli użytkownik ma dostęp do bota."""
         return user_id in self.allowed_users
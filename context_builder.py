@@ -0,0 +1,256 @@
+"""Assemble the model input for a conversational turn.
+
+Two modes:
+
+- **full replay** (default) — system prompt + as much recent history as
+  fits ``CONTEXT_TOKEN_BUDGET`` + the new turn, re-sent on every request,
+- **server-side chain** (``XAI_STATEFUL_CONVERSATIONS=true``) — the last
+  xAI ``response.id`` of the user is stored in ``user_settings`` and the
+  next request sends only the system prompt and the new turn with
+  ``previous_response_id``.  Upload size stays flat however long the chat
+  gets, but xAI bills the whole chain as prompt tokens, so it counts in
+  :attr:`ChatContext.estimated_tokens`.
+
+The chain is dropped — and the next turn falls back to full replay — after
+``/clear``, a system prompt change, any non-chained turn persisted to the
+history (see :meth:`streaming.StreamRenderer.persist`), expiry
+(``XAI_RESPONSE_CHAIN_TTL_HOURS``), once the tokens xAI reported for its
+last turn exceed ``CONTEXT_TOKEN_BUDGET``, or when xAI rejects the stored id.
+
+Messages are always laid out as system prompt, older history (oldest
+first), new turn, and the default system prompt is formatted once per day,
+so consecutive requests share a byte-identical prefix the provider's
+prompt cache can serve at the cached-input rate.
+
+History is budgeted in estimated tokens (:mod:`token_count`), not messages:
+it is filled newest-first until the next message would exceed the budget
+left after the system prompt and the new turn.  ``MAX_HISTORY`` only caps
+how many messages are considered.  Older turns compacted by
+:mod:`summarizer` are replaced by their summary, sent as a second system
+message right after the system prompt.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncGenerator
+
+import httpx
+import structlog
+
+from config import DEFAULT_SYSTEM_PROMPT, settings
+from db import (
+    UserSettings,
+    get_conversation_summary,
+    get_history,
+    get_user_settings,
+    set_response_chain,
+)
+from token_count import message_tokens
+from utils import get_current_date
+
+logger = structlog.get_logger(__name__)
+
+_SUMMARY_HEADER = "Streszczenie wcześniejszej części rozmowy:\n"
+
+
+@dataclass
+class ChatContext:
+    """Messages for one turn plus what is needed to rebuild them."""
+
+    user_id: int
+    query: str
+    messages: list[dict[str, str]]
+    previous_response_id: str | None = None
+    system_addon: str = ""
+    max_history: int | None = None
+    token_budget: int | None = None
+    estimated_tokens: int = 0
+    # Prompt tokens the server-side chain adds on top of ``messages``
+    chain_tokens: int = 0
+    # No stored history and no summary: the turn opens the conversation
+    first_turn: bool = False
+
+
+@lru_cache(maxsize=2)
+def _default_prompt_for(current_date: str) -> str:
+    return DEFAULT_SYSTEM_PROMPT.format(current_date=current_date)
+
+
+def default_system_prompt() -> str:
+    """The default system prompt for today; identical for every request of the day."""
+    return _default_prompt_for(get_current_date())
+
+
+def system_prompt_for(custom_prompt: str | None, addon: str = "") -> str:
+    """System prompt of a turn: the user's custom prompt or the default, then *addon*.
+
+    Per-mode additions go after the base prompt so the shared part stays a
+    cacheable prefix.
+    """
+    return (custom_prompt or default_system_prompt()) + addon
+
+
+def fit_history(history: list[dict[str, Any]], budget_tokens: int) -> list[dict[str, str]]:
+    """Newest-first run of *history* whose estimated tokens fit *budget_tokens*."""
+    kept: list[dict[str, Any]] = []
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if cost > budget_tokens:
+            break
+        budget_tokens -= cost
+        kept.append(message)
+    kept.reverse()
+    # Open the window on a user turn rather than an answer to a dropped question
+    while kept and kept[0]["role"] == "assistant":
+        kept.pop(0)
+    return [{"role": m["role"], "content": m["content"]} for m in kept]
+
+
+async def history_within_budget(
+    user_id: int,
+    budget_tokens: int,
+    *,
+    max_messages: int | None = None,
+    after_id: int | None = None,
+) -> list[dict[str, str]]:
+    """The user's most recent history that fits *budget_tokens* (oldest first).
+
+    Messages with a row id up to *after_id* (already summarised) are skipped.
+    """
+    if budget_tokens <= 0:
+        return []
+    return fit_history(await _unsummarized_history(user_id, max_messages, after_id), budget_tokens)
+
+
+async def _unsummarized_history(
+    user_id: int, max_messages: int | None, after_id: int | None
+) -> list[dict[str, Any]]:
+    limit = max_messages if max_messages is not None else settings.max_history
+    history = await get_history(user_id, limit=limit)
+    if after_id is not None:
+        history = [m for m in history if m.get("id") is None or m["id"] > after_id]
+    return history
+
+
+def chain_usable(user_settings: UserSettings) -> bool:
+    """Whether the stored response chain of the user can be continued."""
+    if not settings.xai_stateful_conversations or not user_settings.last_response_id:
+        return False
+    age = time.time() - float(user_settings.last_response_at or 0.0)
+    return age < settings.xai_response_chain_ttl_hours * 3600
+
+
+async def build_chat_context(
+    user_id: int,
+    query: str,
+    *,
+    system_addon: str = "",
+    max_history: int | None = None,
+    token_budget: int | None = None,
+    use_chain: bool = True,
+) -> ChatContext:
+    """Return the messages for *query*, chained to the previous response if possible.
+
+    *token_budget* (default ``CONTEXT_TOKEN_BUDGET``) bounds the estimated
+    prompt size; *max_history* (default ``MAX_HISTORY``) the message count.
+    """
+    user_settings = await get_user_settings(user_id)
+    system_prompt = system_prompt_for(user_settings.system_prompt, system_addon)
+    messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
+    context = ChatContext(
+        user_id=user_id,
+        query=query,
+        messages=messages,
+        system_addon=system_addon,
+        max_history=max_history,
+        token_budget=token_budget,
+    )
+    turn = {"role": "user", "content": query}
+    budget = token_budget if token_budget is not None else settings.context_token_budget
+
+    chained = use_chain and chain_usable(user_settings)
+    if chained and (user_settings.last_response_tokens or 0) > budget:
+        # xAI bills the whole chain as prompt: restart from summary + budgeted replay
+        logger.info(
+            "response_chain_too_long",
+            user_id=user_id,
+            tokens=user_settings.last_response_tokens,
+            budget=budget,
+        )
+        await set_response_chain(user_id, None)
+        chained = False
+
+    if chained:
+        context.previous_response_id = user_settings.last_response_id
+        # Size of the chain: its last reported usage, else the stored history it holds
+        if user_settings.last_response_tokens is not None:
+            context.chain_tokens = user_settings.last_response_tokens
+        else:
+            history = await _unsummarized_history(user_id, max_history, None)
+            context.chain_tokens = sum(message_tokens(m) for m in history)
+    else:
+        summary = await get_conversation_summary(user_id) if settings.summary_enabled else None
+        if summary is not None:
+            messages.append({"role": "system", "content": _SUMMARY_HEADER + summary.summary})
+        remaining = budget - sum(message_tokens(m) for m in messages) - message_tokens(turn)
+        history = await _unsummarized_history(
+            user_id, max_history, summary.covered_until_id if summary is not None else None
+        )
+        context.first_turn = summary is None and not history
+        if remaining > 0:
+            messages.extend(fit_history(history, remaining))
+    messages.append(turn)
+    context.estimated_tokens = context.chain_tokens + sum(message_tokens(m) for m in messages)
+    return context
+
+
+def _chain_rejected(exc: httpx.HTTPStatusError) -> bool:
+    status = exc.response.status_code
+    return 400 <= status < 500 and status != 429
+
+
+async def stream_chat(
+    grok: Any,
+    context: ChatContext,
+    *,
+    model: str,
+    max_tokens: int,
+    **kwargs: Any,
+) -> AsyncGenerator[tuple[str, Any], None]:
+    """``grok.chat_stream`` for *context*, replaying full history if the chain is rejected."""
+    if settings.xai_stateful_conversations:
+        kwargs["store"] = True
+    if context.previous_response_id:
+        kwargs["previous_response_id"] = context.previous_response_id
+        kwargs["chain_tokens"] = context.chain_tokens
+
+    try:
+        async for event in grok.chat_stream(context.messages, model=model, max_tokens=max_tokens, **kwargs):
+            yield event
+        return
+    except httpx.HTTPStatusError as exc:
+        # A 4xx fails before any event is delivered, so replaying is safe
+        if not context.previous_response_id or not _chain_rejected(exc):
+            raise
+        logger.warning(
+            "response_chain_rejected",
+            user_id=context.user_id,
+            status=exc.response.status_code,
+        )
+
+    await set_response_chain(context.user_id, None)
+    full = await build_chat_context(
+        context.user_id,
+        context.query,
+        system_addon=context.system_addon,
+        max_history=context.max_history,
+        token_budget=context.token_budget,
+        use_chain=False,
+    )
+    kwargs.pop("previous_response_id", None)
+    kwargs.pop("chain_tokens", None)
+    async for event in grok.chat_stream(full.messages, model=model, max_tokens=max_tokens, **kwargs):
+        yield event
@@ -3,13 +3,20 @@
 from __future__ import annotations
 
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
 from datetime import date as date_type, datetime, timezone
-from typing import Any
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
 
 import aiosqlite
 import structlog
 
 from config import settings
+from history_cache import HistoryCache
+from token_count import estimate_tokens
+from write_behind import WriteBehindQueue
 
 logger = structlog.get_logger(__name__)
 
@@ -17,13 +24,27 @@ logger = structlog.get_logger(__name__)
 # Cost constants (xAI pricing as of 2026‑02)
 # ---------------------------------------------------------------------------
 COST_PER_M_INPUT: float = 0.20   # $0.20 per 1M input tokens
+COST_PER_M_CACHED_INPUT: float = 0.05  # $0.05 per 1M input tokens served from the prompt cache
 COST_PER_M_OUTPUT: float = 0.50  # $0.50 per 1M output tokens (reasoning too)
 FTS_SNIPPET_TOKENS: int = 18
 
 
-def calculate_cost(tokens_in: int, tokens_out: int, reasoning_tokens: int) -> float:
-    """Return estimated USD cost for a single request."""
-    input_cost = (tokens_in / 1_000_000) * COST_PER_M_INPUT
+def calculate_cost(
+    tokens_in: int,
+    tokens_out: int,
+    reasoning_tokens: int,
+    cached_tokens: int = 0,
+) -> float:
+    """Return estimated USD cost for a single request.
+
+    *cached_tokens* is the part of *tokens_in* the provider served from its
+    prompt cache and is billed at the cached-input rate.
+    """
+    cached = min(max(cached_tokens, 0), tokens_in)
+    input_cost = (
+        ((tokens_in - cached) / 1_000_000) * COST_PER_M_INPUT
+        + (cached / 1_000_000) * COST_PER_M_CACHED_INPUT
+    )
     output_cost = ((tokens_out + reasoning_tokens) / 1_000_000) * COST_PER_M_OUTPUT
     return round(input_cost + output_cost, 6)
 
@@ -43,6 +64,7 @@ CREATE TABLE IF NOT EXISTS conversations (
     tokens_out INTEGER DEFAULT 0,
     reasoning_tokens INTEGER DEFAULT 0,
     cost_usd REAL DEFAULT 0.0,
+    token_count INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -51,6 +73,9 @@ CREATE TABLE IF NOT EXISTS user_settings (
     system_prompt TEXT,
     reasoning_effort TEXT DEFAULT 'high',
     voice_enabled INTEGER DEFAULT 0,
+    last_response_id TEXT,
+    last_response_at REAL,
+    last_response_tokens INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -64,6 +89,8 @@ CREATE TABLE IF NOT EXISTS usage_stats (
     total_tokens_out INTEGER DEFAULT 0,
     total_reasoning_tokens INTEGER DEFAULT 0,
     total_cost_usd REAL DEFAULT 0.0,
+    total_cached_tokens INTEGER DEFAULT 0,
+    total_cache_hits INTEGER DEFAULT 0,
     UNIQUE(user_id, date)
 );
 
@@ -89,12 +116,41 @@ CREATE TABLE IF NOT EXISTS local_collection_documents (
     FOREIGN KEY(collection_id) REFERENCES local_collections(id) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    user_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered_until_id INTEGER NOT NULL,
+    token_count INTEGER DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    model TEXT,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+
 CREATE INDEX IF NOT EXISTS idx_conv_user_time ON conversations(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at);
 CREATE INDEX IF NOT EXISTS idx_stats_user_date ON usage_stats(user_id, date);
 CREATE INDEX IF NOT EXISTS idx_local_docs_collection ON local_collection_documents(collection_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_dynamic_users_id ON dynamic_users(user_id);
 """
 
+# Columns added after the initial schema: databases created before them get
+# an ALTER TABLE on startup (table, column, definition)
+_COLUMN_MIGRATIONS: tuple[tuple[str, str, str], ...] = (
+    ("user_settings", "last_response_id", "TEXT"),
+    ("user_settings", "last_response_at", "REAL"),
+    ("user_settings", "last_response_tokens", "INTEGER"),
+    ("usage_stats", "total_cached_tokens", "INTEGER DEFAULT 0"),
+    ("usage_stats", "total_cache_hits", "INTEGER DEFAULT 0"),
+    ("conversations", "token_count", "INTEGER"),
+)
+
 _FTS_SCHEMA = """
 CREATE VIRTUAL TABLE IF NOT EXISTS local_collection_documents_fts
 USING fts5(filename, content, content='local_collection_documents', content_rowid='id');
@@ -126,14 +182,103 @@ def _today() -> str:
 
 
 # ---------------------------------------------------------------------------
-# Persistent connection (reused across all DB operations)
+# Conversation history cache (write-through, see history_cache.py)
+# ---------------------------------------------------------------------------
+_history_cache = HistoryCache(
+    max_messages=settings.history_cache_size,
+    max_bytes=settings.history_cache_max_bytes,
+)
+
+
+def get_history_cache_status() -> dict[str, Any]:
+    """Return history cache hit/miss and memory metrics."""
+    return _history_cache.status()
+
+
+# ---------------------------------------------------------------------------
+# Connections: one persistent writer + a small pool of read-only readers
 # ---------------------------------------------------------------------------
 _db: aiosqlite.Connection | None = None
 _db_lock = asyncio.Lock()
+# Serialises write transactions on the single writer connection
+_write_lock = asyncio.Lock()
+
+
+@dataclass
+class _ConnectionStats:
+    """Wait-time accounting for one connection."""
+
+    name: str
+    queries: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.queries += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self) -> dict[str, Any]:
+        avg = self.wait_total / self.queries if self.queries else 0.0
+        return {
+            "name": self.name,
+            "queries": self.queries,
+            "avg_wait_ms": round(avg * 1000, 2),
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+_writer_stats = _ConnectionStats("writer")
+
+
+class _ReaderPool:
+    """Read-only WAL connections handed out one coroutine at a time.
+
+    Each aiosqlite connection runs on its own thread, so SELECTs (including
+    long FTS searches) proceed in parallel with each other and with writes.
+    """
+
+    def __init__(self, connections: list[aiosqlite.Connection]) -> None:
+        self._connections = connections
+        self._idle: asyncio.Queue[int] = asyncio.Queue()
+        self.stats = [_ConnectionStats(f"reader-{idx}") for idx in range(len(connections))]
+        for idx in range(len(connections)):
+            self._idle.put_nowait(idx)
+
+    @classmethod
+    async def open(cls, path: str, size: int) -> _ReaderPool:
+        uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+        connections: list[aiosqlite.Connection] = []
+        for _ in range(size):
+            conn = await aiosqlite.connect(uri, uri=True)
+            conn.row_factory = aiosqlite.Row
+            await conn.execute("PRAGMA query_only=ON")
+            connections.append(conn)
+        return cls(connections)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        started = time.monotonic()
+        idx = await self._idle.get()
+        self.stats[idx].record(time.monotonic() - started)
+        try:
+            yield self._connections[idx]
+        finally:
+            self._idle.put_nowait(idx)
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            try:
+                await conn.close()
+            except Exception:
+                logger.exception("close_reader_failed")
+
+
+_readers: _ReaderPool | None = None
 
 
 async def _get_db() -> aiosqlite.Connection:
-    """Return the shared persistent database connection.
+    """Return the shared persistent writer connection.
 
     The connection is initialised once in :func:`init_db` and reused for every
     subsequent call.  This avoids the overhead of opening a new connection,
@@ -155,40 +300,115 @@ async def _get_db() -> aiosqlite.Connection:
     return _db
 
 
+@asynccontextmanager
+async def _writer() -> AsyncIterator[aiosqlite.Connection]:
+    """Hold the writer connection for one write transaction."""
+    db = await _get_db()
+    started = time.monotonic()
+    async with _write_lock:
+        _writer_stats.record(time.monotonic() - started)
+        yield db
+
+
+@asynccontextmanager
+async def _reader() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a read-only connection; falls back to the writer without a pool."""
+    pool = _readers
+    if pool is None:
+        yield await _get_db()
+        return
+    async with pool.acquire() as conn:
+        yield conn
+
+
+async def _open_readers() -> None:
+    global _readers  # noqa: PLW0603
+    size = settings.db_reader_pool_size
+    if _readers is not None or size <= 0 or settings.db_path == ":memory:":
+        return
+    try:
+        _readers = await _ReaderPool.open(settings.db_path, size)
+    except Exception:
+        logger.exception("reader_pool_open_failed")
+
+
+def get_db_pool_status() -> list[dict[str, Any]]:
+    """Return per-connection query counts and wait times."""
+    stats = [_writer_stats.as_dict()]
+    if _readers is not None:
+        stats.extend(s.as_dict() for s in _readers.stats)
+    return stats
+
+
 async def close_db() -> None:
-    """Close the persistent connection (call at shutdown)."""
-    global _db  # noqa: PLW0603
+    """Drain queued writes and close all connections (call at shutdown)."""
+    global _db, _readers  # noqa: PLW0603
+    await flush_writes()
     async with _db_lock:
+        if _readers is not None:
+            await _readers.close()
+            _readers = None
         if _db is not None:
             try:
                 await _db.close()
             except Exception:
                 logger.exception("close_db_failed")
             _db = None
+        _reset_caches()
+
+
+def _reset_caches() -> None:
+    """Forget all in-memory state derived from the database."""
+    global _dynamic_users, _dynamic_users_epoch  # noqa: PLW0603
+    _history_cache.clear()
+    _user_settings_cache.clear()
+    _summary_cache.clear()
+    _dynamic_users_epoch += 1
+    _dynamic_users = None
 
 
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
 
+async def _migrate_columns(db: aiosqlite.Connection) -> None:
+    """Add columns from :data:`_COLUMN_MIGRATIONS` missing in an existing DB."""
+    existing: dict[str, set[str]] = {}
+    for table, column, definition in _COLUMN_MIGRATIONS:
+        if table not in existing:
+            cursor = await db.execute(f"PRAGMA table_info({table})")
+            existing[table] = {row[1] for row in await cursor.fetchall()}
+        if column not in existing[table]:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            existing[table].add(column)
+            logger.info("db_column_added", table=table, column=column)
+
+
 async def init_db() -> None:
     """Create tables if they don't exist.
 
-    Also initialises the persistent database connection that will be reused
-    by all subsequent database operations until :func:`close_db` is called.
+    Also initialises the persistent writer connection and the read-only
+    reader pool reused by all subsequent operations until :func:`close_db`.
     """
-    db = await _get_db()
-    try:
-        await db.executescript(_SCHEMA)
+    async with _writer() as db:
         try:
-            await db.executescript(_FTS_SCHEMA)
+            await db.executescript(_SCHEMA)
+            await _migrate_columns(db)
+            try:
+                await db.executescript(_FTS_SCHEMA)
+            except Exception:
+                logger.warning("fts5_init_failed_fallback_like_enabled")
+            await db.commit()
+            logger.info("database_initialized", path=settings.db_path)
         except Exception:
-            logger.warning("fts5_init_failed_fallback_like_enabled")
-        await db.commit()
-        logger.info("database_initialized", path=settings.db_path)
+            logger.exception("init_db_failed")
+            raise
+    # Readers open after the schema exists
+    await _open_readers()
+    try:
+        await _load_dynamic_users()
     except Exception:
-        logger.exception("init_db_failed")
-        raise
+        logger.exception("load_dynamic_users_failed")
 
 
 async def save_message(
@@ -203,58 +423,106 @@ async def save_message(
     cost_usd: float = 0.0,
 ) -> None:
     """Persist a single conversation message."""
-    db = await _get_db()
-    try:
-        await db.execute(
-            """
-            INSERT INTO conversations
+    token_count = estimate_tokens(content)
+    async with _writer() as db:
+        try:
+            cursor = await db.execute(
+                """
+                INSERT INTO conversations
+                    (user_id, role, content, reasoning_content, model,
+                     tokens_in, tokens_out, reasoning_tokens, cost_usd, token_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
                 (user_id, role, content, reasoning_content, model,
-                 tokens_in, tokens_out, reasoning_tokens, cost_usd)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, role, content, reasoning_content, model,
-             tokens_in, tokens_out, reasoning_tokens, cost_usd),
-        )
-        await db.commit()
-    except Exception:
-        logger.exception("save_message_failed", user_id=user_id, role=role)
+                 tokens_in, tokens_out, reasoning_tokens, cost_usd, token_count),
+            )
+            await db.commit()
+            _history_cache.append(
+                user_id,
+                {"role": role, "content": content, "tokens": token_count, "id": cursor.lastrowid},
+            )
+        except Exception:
+            _history_cache.invalidate(user_id)
+            logger.exception("save_message_failed", user_id=user_id, role=role)
 
 
-async def get_history(user_id: int, limit: int = 20) -> list[dict[str, str]]:
-    """Return the last *limit* messages for *user_id* (oldest first)."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT role, content FROM (
-                SELECT role, content, created_at
-                FROM conversations
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            ) sub ORDER BY created_at ASC
-            """,
-            (user_id, limit),
-        )
-        rows = await cursor.fetchall()
-        return [{"role": row["role"], "content": row["content"]} for row in rows]
-    except Exception:
-        logger.exception("get_history_failed", user_id=user_id)
-        return []
+async def get_history(user_id: int, limit: int = 20) -> list[dict[str, Any]]:
+    """Return the last *limit* messages for *user_id* (oldest first).
+
+    Each message has ``role``, ``content``, its estimated ``tokens`` and the
+    row ``id`` (``None`` for a message still queued by the write-behind).
+    Served from the in-memory history cache when possible; a miss reads
+    enough rows to fill the user's ring buffer.
+    """
+    cached = _history_cache.get(user_id, limit)
+    if cached is not None:
+        return cached
+
+    await _flush_pending_writes()
+    token = _history_cache.begin_load()
+    fetch_limit = _history_cache.fetch_limit(limit)
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                """
+                SELECT id, role, content, token_count FROM (
+                    SELECT id, role, content, token_count, created_at
+                    FROM conversations
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ) sub ORDER BY created_at ASC, id ASC
+                """,
+                (user_id, fetch_limit),
+            )
+            rows = await cursor.fetchall()
+            history = [
+                {
+                    "id": row["id"],
+                    "role": row["role"],
+                    "content": row["content"],
+                    # Rows saved before the column existed are measured on read
+                    "tokens": (
+                        row["token_count"]
+                        if row["token_count"] is not None
+                        else estimate_tokens(row["content"])
+                    ),
+                }
+                for row in rows
+            ]
+            _history_cache.store(user_id, history, fetch_limit, token)
+            return history[max(len(history) - limit, 0):]
+        except Exception:
+            logger.exception("get_history_failed", user_id=user_id)
+            return []
 
 
 async def clear_history(user_id: int) -> int:
     """Delete all conversation rows for *user_id*. Return count deleted."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            "DELETE FROM conversations WHERE user_id = ?", (user_id,)
-        )
-        await db.commit()
-        return cursor.rowcount  # type: ignore[return-value]
-    except Exception:
-        logger.exception("clear_history_failed", user_id=user_id)
-        return 0
+    global _user_settings_epoch  # noqa: PLW0603
+    await _flush_pending_writes()
+    async with _writer() as db:
+        try:
+            cursor = await db.execute(
+                "DELETE FROM conversations WHERE user_id = ?", (user_id,)
+            )
+            await db.execute("DELETE FROM conversation_summaries WHERE user_id = ?", (user_id,))
+            _summary_cache.pop(user_id, None)
+            # The server-side chain still references the deleted turns
+            await db.execute(
+                "UPDATE user_settings SET last_response_id = NULL, last_response_at = NULL, "
+                "last_response_tokens = NULL WHERE user_id = ?",
+                (user_id,),
+            )
+            await db.commit()
+            _history_cache.reset(user_id)
+            _user_settings_epoch += 1
+            _user_settings_cache.pop(user_id, None)
+            return cursor.rowcount  # type: ignore[return-value]
+        except Exception:
+            _history_cache.invalidate(user_id)
+            logger.exception("clear_history_failed", user_id=user_id)
+            return 0
 
 
 async def update_daily_stats(
@@ -263,87 +531,109 @@ async def update_daily_stats(
     tokens_out: int,
     reasoning_tokens: int,
     cost_usd: float,
+    cached_tokens: int = 0,
+    requests: int = 1,
 ) -> None:
-    """Upsert today's aggregated usage stats."""
+    """Upsert today's aggregated usage stats.
+
+    Background calls made on the user's behalf (summaries) pass
+    ``requests=0``: their tokens and cost count, the request counter not.
+    """
     today = _today()
-    db = await _get_db()
-    try:
-        await db.execute(
-            """
-            INSERT INTO usage_stats
-                (user_id, date, total_requests, total_tokens_in,
-                 total_tokens_out, total_reasoning_tokens, total_cost_usd)
-            VALUES (?, ?, 1, ?, ?, ?, ?)
-            ON CONFLICT(user_id, date) DO UPDATE SET
-                total_requests = total_requests + 1,
-                total_tokens_in = total_tokens_in + excluded.total_tokens_in,
-                total_tokens_out = total_tokens_out + excluded.total_tokens_out,
-                total_reasoning_tokens = total_reasoning_tokens + excluded.total_reasoning_tokens,
-                total_cost_usd = total_cost_usd + excluded.total_cost_usd
-            """,
-            (user_id, today, tokens_in, tokens_out, reasoning_tokens, cost_usd),
-        )
-        await db.commit()
-    except Exception:
-        logger.exception("update_daily_stats_failed", user_id=user_id)
+    async with _writer() as db:
+        try:
+            await db.execute(
+                """
+                INSERT INTO usage_stats
+                    (user_id, date, total_requests, total_tokens_in,
+                     total_tokens_out, total_reasoning_tokens, total_cost_usd,
+                     total_cached_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, date) DO UPDATE SET
+                    total_requests = total_requests + excluded.total_requests,
+                    total_tokens_in = total_tokens_in + excluded.total_tokens_in,
+                    total_tokens_out = total_tokens_out + excluded.total_tokens_out,
+                    total_reasoning_tokens = total_reasoning_tokens + excluded.total_reasoning_tokens,
+                    total_cost_usd = total_cost_usd + excluded.total_cost_usd,
+                    total_cached_tokens = total_cached_tokens + excluded.total_cached_tokens
+                """,
+                (user_id, today, requests, tokens_in, tokens_out, reasoning_tokens, cost_usd, cached_tokens),
+            )
+            await db.commit()
+        except Exception:
+            logger.exception("update_daily_stats_failed", user_id=user_id)
+            return
+    _run_usage_hooks(user_id, tokens_in + tokens_out + reasoning_tokens, cost_usd, requests)
 
 
-async def get_daily_stats(user_id: int, date: str | None = None) -> dict[str, Any]:
-    """Return aggregated stats for *date* (default: today)."""
+async def get_daily_stats(user_id: int, date: str | None = None, *, strict: bool = False) -> dict[str, Any]:
+    """Return aggregated stats for *date* (default: today).
+
+    Errors are logged and yield ``{}``, unless *strict* re-raises them (quota
+    loading must not mistake a failed read for a day without usage).
+    """
     target = date or _today()
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT * FROM usage_stats WHERE user_id = ? AND date = ?",
-            (user_id, target),
-        )
-        row = await cursor.fetchone()
-        if row:
-            return dict(row)
-        return {
-            "user_id": user_id,
-            "date": target,
-            "total_requests": 0,
-            "total_tokens_in": 0,
-            "total_tokens_out": 0,
-            "total_reasoning_tokens": 0,
-            "total_cost_usd": 0.0,
-        }
-    except Exception:
-        logger.exception("get_daily_stats_failed", user_id=user_id)
-        return {}
+    await _flush_pending_writes()
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT * FROM usage_stats WHERE user_id = ? AND date = ?",
+                (user_id, target),
+            )
+            row = await cursor.fetchone()
+            if row:
+                return dict(row)
+            return {
+                "user_id": user_id,
+                "date": target,
+                "total_requests": 0,
+                "total_tokens_in": 0,
+                "total_tokens_out": 0,
+                "total_reasoning_tokens": 0,
+                "total_cost_usd": 0.0,
+                "total_cached_tokens": 0,
+                "total_cache_hits": 0,
+            }
+        except Exception:
+            logger.exception("get_daily_stats_failed", user_id=user_id)
+            if strict:
+                raise
+            return {}
 
 
 async def get_all_time_stats(user_id: int) -> dict[str, Any]:
     """Return all‑time aggregated stats for *user_id*."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT
-                COALESCE(SUM(total_requests), 0)         AS total_requests,
-                COALESCE(SUM(total_tokens_in), 0)        AS total_tokens_in,
-                COALESCE(SUM(total_tokens_out), 0)       AS total_tokens_out,
-                COALESCE(SUM(total_reasoning_tokens), 0) AS total_reasoning_tokens,
-                COALESCE(SUM(total_cost_usd), 0.0)       AS total_cost_usd
-            FROM usage_stats
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        if row:
-            return dict(row)
-        return {
-            "total_requests": 0,
-            "total_tokens_in": 0,
-            "total_tokens_out": 0,
-            "total_reasoning_tokens": 0,
-            "total_cost_usd": 0.0,
-        }
-    except Exception:
-        logger.exception("get_all_time_stats_failed", user_id=user_id)
-        return {}
+    await _flush_pending_writes()
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                """
+                SELECT
+                    COALESCE(SUM(total_requests), 0)         AS total_requests,
+                    COALESCE(SUM(total_tokens_in), 0)        AS total_tokens_in,
+                    COALESCE(SUM(total_tokens_out), 0)       AS total_tokens_out,
+                    COALESCE(SUM(total_reasoning_tokens), 0) AS total_reasoning_tokens,
+                    COALESCE(SUM(total_cost_usd), 0.0)       AS total_cost_usd,
+                    COALESCE(SUM(total_cached_tokens), 0)    AS total_cached_tokens
+                FROM usage_stats
+                WHERE user_id = ?
+                """,
+                (user_id,),
+            )
+            row = await cursor.fetchone()
+            if row:
+                return dict(row)
+            return {
+                "total_requests": 0,
+                "total_tokens_in": 0,
+                "total_tokens_out": 0,
+                "total_reasoning_tokens": 0,
+                "total_cost_usd": 0.0,
+                "total_cached_tokens": 0,
+            }
+        except Exception:
+            logger.exception("get_all_time_stats_failed", user_id=user_id)
+            return {}
 
 
 _ALLOWED_SETTING_COLUMNS: frozenset[str] = frozenset(
@@ -351,25 +641,124 @@ _ALLOWED_SETTING_COLUMNS: frozenset[str] = frozenset(
 )
 
 
+@dataclass(frozen=True)
+class UserSettings:
+    """Snapshot of one ``user_settings`` row (all ``None`` when the row is missing)."""
+
+    user_id: int
+    system_prompt: str | None = None
+    reasoning_effort: str | None = None
+    voice_enabled: Any = None
+    # Server-side conversation chain (``previous_response_id`` mode)
+    last_response_id: str | None = None
+    last_response_at: float | None = None
+    # Prompt + completion tokens xAI reported for the last chained turn
+    last_response_tokens: int | None = None
+
+    def get(self, key: str) -> Any:
+        return getattr(self, key) if key in _ALLOWED_SETTING_COLUMNS else None
+
+
+_SNAPSHOT_COLUMNS: tuple[str, ...] = (
+    "system_prompt",
+    "reasoning_effort",
+    "voice_enabled",
+    "last_response_id",
+    "last_response_at",
+    "last_response_tokens",
+)
+
+_user_settings_cache: dict[int, UserSettings] = {}
+# Bumped on every settings write; a snapshot read before a write is not cached
+_user_settings_epoch = 0
+
+
 async def set_user_setting(user_id: int, key: str, value: str) -> None:
     """Create or update a single user setting."""
+    global _user_settings_epoch  # noqa: PLW0603
     if key not in _ALLOWED_SETTING_COLUMNS:
         logger.warning("set_user_setting_invalid_key", user_id=user_id, key=key)
         return
-    db = await _get_db()
-    try:
-        # Ensure user row exists
-        await db.execute(
-            "INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)",
-            (user_id,),
-        )
-        await db.execute(
-            f"UPDATE user_settings SET {key} = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",  # key validated above
-            (value, user_id),
-        )
-        await db.commit()
-    except Exception:
-        logger.exception("set_user_setting_failed", user_id=user_id, key=key)
+    if key == "system_prompt":
+        await _flush_pending_writes()  # a queued chain must not outlive the reset below
+    async with _writer() as db:
+        try:
+            # Ensure user row exists
+            await db.execute(
+                "INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)",
+                (user_id,),
+            )
+            await db.execute(
+                f"UPDATE user_settings SET {key} = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",  # key validated above
+                (value, user_id),
+            )
+            if key == "system_prompt":
+                # A new system prompt starts a new server-side conversation chain
+                await db.execute(
+                    "UPDATE user_settings SET last_response_id = NULL, last_response_at = NULL, "
+                    "last_response_tokens = NULL WHERE user_id = ?",
+                    (user_id,),
+                )
+            await db.commit()
+        except Exception:
+            logger.exception("set_user_setting_failed", user_id=user_id, key=key)
+        finally:
+            _user_settings_epoch += 1
+            _user_settings_cache.pop(user_id, None)
+
+
+async def get_user_settings(user_id: int) -> UserSettings:
+    """Return all settings of *user_id* in one cached snapshot."""
+    cached = _user_settings_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    # A queued message pair may carry a newer response chain
+    await _flush_pending_writes()
+    epoch = _user_settings_epoch
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT * FROM user_settings WHERE user_id = ?",
+                (user_id,),
+            )
+            row = await cursor.fetchone()
+        except Exception:
+            logger.exception("get_user_settings_failed", user_id=user_id)
+            return UserSettings(user_id)
+
+    values = dict(row) if row else {}
+    snapshot = UserSettings(
+        user_id=user_id,
+        **{key: values.get(key) for key in _SNAPSHOT_COLUMNS},
+    )
+    if epoch == _user_settings_epoch:
+        _user_settings_cache[user_id] = snapshot
+    return snapshot
+
+
+async def set_response_chain(user_id: int, response_id: str | None) -> None:
+    """Store (or with ``None`` reset) the last xAI response id of *user_id*."""
+    global _user_settings_epoch  # noqa: PLW0603
+    # A chain queued with an earlier message pair must not overwrite this one
+    await _flush_pending_writes()
+    async with _writer() as db:
+        try:
+            await db.execute(
+                "INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)",
+                (user_id,),
+            )
+            await db.execute(
+                "UPDATE user_settings SET last_response_id = ?, last_response_at = ?, "
+                "last_response_tokens = NULL WHERE user_id = ?",
+                (response_id, time.time() if response_id else None, user_id),
+            )
+            await db.commit()
+        except Exception:
+            logger.exception("set_response_chain_failed", user_id=user_id)
+        finally:
+            _user_settings_epoch += 1
+            _user_settings_cache.pop(user_id, None)
 
 
 async def get_user_setting(user_id: int, key: str) -> str | None:
@@ -377,75 +766,97 @@ async def get_user_setting(user_id: int, key: str) -> str | None:
     if key not in _ALLOWED_SETTING_COLUMNS:
         logger.warning("get_user_setting_invalid_key", user_id=user_id, key=key)
         return None
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            f"SELECT {key} FROM user_settings WHERE user_id = ?",  # key validated above
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        if row:
-            return row[key]
-        return None
-    except Exception:
-        logger.exception("get_user_setting_failed", user_id=user_id, key=key)
-        return None
+    return (await get_user_settings(user_id)).get(key)
+
+
+# In-memory index of dynamic_users (None = not loaded yet / invalidated)
+_dynamic_users: set[int] | None = None
+# Bumped on every dynamic_users write; an index read before a write is not installed
+_dynamic_users_epoch = 0
+
+
+async def _load_dynamic_users() -> set[int]:
+    global _dynamic_users  # noqa: PLW0603
+    epoch = _dynamic_users_epoch
+    async with _reader() as db:
+        cursor = await db.execute("SELECT user_id FROM dynamic_users")
+        rows = await cursor.fetchall()
+    if epoch != _dynamic_users_epoch:
+        # A grant or revoke committed mid-read; re-read where no write can interleave
+        async with _writer() as db:
+            cursor = await db.execute("SELECT user_id FROM dynamic_users")
+            rows = await cursor.fetchall()
+    _dynamic_users = {int(row["user_id"]) for row in rows}
+    return _dynamic_users
 
 
 async def add_dynamic_user(user_id: int, added_by: int) -> bool:
     """Dodaj użytkownika do dynamicznej listy dostępów."""
-    db = await _get_db()
-    try:
-        await db.execute(
-            "INSERT OR IGNORE INTO dynamic_users (user_id, added_by) VALUES (?, ?)",
-            (user_id, added_by),
-        )
-        await db.commit()
-        return True
-    except Exception:
-        logger.exception("add_dynamic_user_failed", user_id=user_id, added_by=added_by)
-        return False
+    global _dynamic_users, _dynamic_users_epoch  # noqa: PLW0603
+    async with _writer() as db:
+        try:
+            await db.execute(
+                "INSERT OR IGNORE INTO dynamic_users (user_id, added_by) VALUES (?, ?)",
+                (user_id, added_by),
+            )
+            await db.commit()
+            _dynamic_users_epoch += 1
+            if _dynamic_users is not None:
+                _dynamic_users.add(user_id)
+            return True
+        except Exception:
+            _dynamic_users_epoch += 1
+            _dynamic_users = None
+            logger.exception("add_dynamic_user_failed", user_id=user_id, added_by=added_by)
+            return False
 
 
 async def remove_dynamic_user(user_id: int) -> int:
     """Usuń użytkownika z dynamicznej listy dostępów."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute("DELETE FROM dynamic_users WHERE user_id = ?", (user_id,))
-        await db.commit()
-        return cursor.rowcount  # type: ignore[return-value]
-    except Exception:
-        logger.exception("remove_dynamic_user_failed", user_id=user_id)
-        return 0
+    global _dynamic_users, _dynamic_users_epoch  # noqa: PLW0603
+    async with _writer() as db:
+        try:
+            cursor = await db.execute("DELETE FROM dynamic_users WHERE user_id = ?", (user_id,))
+            await db.commit()
+            _dynamic_users_epoch += 1
+            if _dynamic_users is not None:
+                _dynamic_users.discard(user_id)
+            return cursor.rowcount  # type: ignore[return-value]
+        except Exception:
+            _dynamic_users_epoch += 1
+            _dynamic_users = None
+            logger.exception("remove_dynamic_user_failed", user_id=user_id)
+            return 0
 
 
 async def is_dynamic_user_allowed(user_id: int) -> bool:
-    """Sprawdź, czy użytkownik istnieje na dynamicznej liście dostępów."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT 1 FROM dynamic_users WHERE user_id = ? LIMIT 1",
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        return row is not None
-    except Exception:
-        logger.exception("is_dynamic_user_allowed_failed", user_id=user_id)
-        return False
+    """Sprawdź, czy użytkownik istnieje na dynamicznej liście dostępów.
+
+    Odpowiada z indeksu w pamięci (ładowanego w :func:`init_db`); baza jest
+    czytana tylko przy pierwszym użyciu lub po błędzie zapisu.
+    """
+    users = _dynamic_users
+    if users is None:
+        try:
+            users = await _load_dynamic_users()
+        except Exception:
+            logger.exception("is_dynamic_user_allowed_failed", user_id=user_id)
+            return False
+    return user_id in users
 
 
 async def list_dynamic_users() -> list[int]:
     """Zwróć listę użytkowników dodanych dynamicznie."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT user_id FROM dynamic_users ORDER BY added_at ASC, user_id ASC"
-        )
-        rows = await cursor.fetchall()
-        return [int(row["user_id"]) for row in rows]
-    except Exception:
-        logger.exception("list_dynamic_users_failed")
-        return []
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT user_id FROM dynamic_users ORDER BY added_at ASC, user_id ASC"
+            )
+            rows = await cursor.fetchall()
+            return [int(row["user_id"]) for row in rows]
+        except Exception:
+            logger.exception("list_dynamic_users_failed")
+            return []
 
 
 async def get_users_usage_summary(
@@ -456,81 +867,82 @@ async def get_users_usage_summary(
         return {}
 
     placeholders = ",".join("?" for _ in user_ids)
+    await _flush_pending_writes()
     query = (
         "SELECT user_id, COALESCE(SUM(total_requests), 0) AS total_requests, "
         "COALESCE(SUM(total_cost_usd), 0.0) AS total_cost_usd "
         f"FROM usage_stats WHERE user_id IN ({placeholders}) GROUP BY user_id"
     )
 
-    db = await _get_db()
-    try:
-        cursor = await db.execute(query, tuple(user_ids))
-        rows = await cursor.fetchall()
-        result: dict[int, dict[str, int | float]] = {
-            int(user_id): {"total_requests": 0, "total_cost_usd": 0.0}
-            for user_id in user_ids
-        }
-        for row in rows:
-            uid = int(row["user_id"])
-            result[uid] = {
-                "total_requests": int(row["total_requests"]),
-                "total_cost_usd": float(row["total_cost_usd"]),
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(query, tuple(user_ids))
+            rows = await cursor.fetchall()
+            result: dict[int, dict[str, int | float]] = {
+                int(user_id): {"total_requests": 0, "total_cost_usd": 0.0}
+                for user_id in user_ids
+            }
+            for row in rows:
+                uid = int(row["user_id"])
+                result[uid] = {
+                    "total_requests": int(row["total_requests"]),
+                    "total_cost_usd": float(row["total_cost_usd"]),
+                }
+            return result
+        except Exception:
+            logger.exception("get_users_usage_summary_failed", user_ids=user_ids)
+            return {
+                int(user_id): {"total_requests": 0, "total_cost_usd": 0.0}
+                for user_id in user_ids
             }
-        return result
-    except Exception:
-        logger.exception("get_users_usage_summary_failed", user_ids=user_ids)
-        return {
-            int(user_id): {"total_requests": 0, "total_cost_usd": 0.0}
-            for user_id in user_ids
-        }
 
 
 async def create_local_collection(name: str) -> int | None:
     """Create local fallback collection and return collection ID."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            "INSERT INTO local_collections (name) VALUES (?)",
-            (name.strip(),),
-        )
-        await db.commit()
-        row_id = cursor.lastrowid
-        return int(row_id) if row_id is not None else None
-    except Exception:
-        logger.exception("create_local_collection_failed", name=name)
-        return None
+    async with _writer() as db:
+        try:
+            cursor = await db.execute(
+                "INSERT INTO local_collections (name) VALUES (?)",
+                (name.strip(),),
+            )
+            await db.commit()
+            row_id = cursor.lastrowid
+            return int(row_id) if row_id is not None else None
+        except Exception:
+            logger.exception("create_local_collection_failed", name=name)
+            return None
 
 
 async def list_local_collections() -> list[dict[str, Any]]:
     """Return local fallback collections with document counts."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT c.id, c.name, c.created_at, COUNT(d.id) AS document_count
-            FROM local_collections c
-            LEFT JOIN local_collection_documents d ON d.collection_id = c.id
-            GROUP BY c.id, c.name, c.created_at
-            ORDER BY c.created_at DESC, c.id DESC
-            """
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-    except Exception:
-        logger.exception("list_local_collections_failed")
-        return []
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                """
+                SELECT c.id, c.name, c.created_at, COUNT(d.id) AS document_count
+                FROM local_collections c
+                LEFT JOIN local_collection_documents d ON d.collection_id = c.id
+                GROUP BY c.id, c.name, c.created_at
+                ORDER BY c.created_at DESC, c.id DESC
+                """
+            )
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+        except Exception:
+            logger.exception("list_local_collections_failed")
+            return []
 
 
 async def delete_local_collection(collection_id: int) -> int:
     """Delete local fallback collection by ID."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute("DELETE FROM local_collections WHERE id = ?", (collection_id,))
-        await db.commit()
-        return cursor.rowcount  # type: ignore[return-value]
-    except Exception:
-        logger.exception("delete_local_collection_failed", collection_id=collection_id)
-        return 0
+    async with _writer() as db:
+        try:
+            cursor = await db.execute("DELETE FROM local_collections WHERE id = ?", (collection_id,))
+            await db.commit()
+            return cursor.rowcount  # type: ignore[return-value]
+        except Exception:
+            logger.exception("delete_local_collection_failed", collection_id=collection_id)
+            return 0
 
 
 async def add_local_collection_document(
@@ -539,47 +951,47 @@ async def add_local_collection_document(
     content: str,
 ) -> bool:
     """Upsert local fallback document in a collection."""
-    db = await _get_db()
-    try:
-        await db.execute(
-            """
-            INSERT INTO local_collection_documents (collection_id, filename, content)
-            VALUES (?, ?, ?)
-            ON CONFLICT(collection_id, filename) DO UPDATE SET
-                content = excluded.content,
-                created_at = CURRENT_TIMESTAMP
-            """,
-            (collection_id, filename, content),
-        )
-        await db.commit()
-        return True
-    except Exception:
-        logger.exception(
-            "add_local_collection_document_failed",
-            collection_id=collection_id,
-            filename=filename,
-        )
-        return False
+    async with _writer() as db:
+        try:
+            await db.execute(
+                """
+                INSERT INTO local_collection_documents (collection_id, filename, content)
+                VALUES (?, ?, ?)
+                ON CONFLICT(collection_id, filename) DO UPDATE SET
+                    content = excluded.content,
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (collection_id, filename, content),
+            )
+            await db.commit()
+            return True
+        except Exception:
+            logger.exception(
+                "add_local_collection_document_failed",
+                collection_id=collection_id,
+                filename=filename,
+            )
+            return False
 
 
 async def list_local_collection_documents(collection_id: int) -> list[dict[str, Any]]:
     """List local fallback documents in a collection."""
-    db = await _get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT id, filename, created_at
-            FROM local_collection_documents
-            WHERE collection_id = ?
-            ORDER BY created_at DESC, id DESC
-            """,
-            (collection_id,),
-        )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-    except Exception:
-        logger.exception("list_local_collection_documents_failed", collection_id=collection_id)
-        return []
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                """
+                SELECT id, filename, created_at
+                FROM local_collection_documents
+                WHERE collection_id = ?
+                ORDER BY created_at DESC, id DESC
+                """,
+                (collection_id,),
+            )
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+        except Exception:
+            logger.exception("list_local_collection_documents_failed", collection_id=collection_id)
+            return []
 
 
 async def search_local_collection_documents(
@@ -588,50 +1000,441 @@ async def search_local_collection_documents(
     limit: int = 5,
 ) -> list[dict[str, Any]]:
     """Search local fallback documents with FTS5; fallback to LIKE."""
-    db = await _get_db()
-    try:
+    async with _reader() as db:
+        try:
+            try:
+                cursor = await db.execute(
+                    """
+                    SELECT d.id, d.filename, snippet(local_collection_documents_fts, 1, '[', ']', '…', ?) AS snippet
+                    FROM local_collection_documents_fts
+                    JOIN local_collection_documents d ON d.id = local_collection_documents_fts.rowid
+                    WHERE d.collection_id = ? AND local_collection_documents_fts MATCH ?
+                    ORDER BY bm25(local_collection_documents_fts)
+                    LIMIT ?
+                    """,
+                    (FTS_SNIPPET_TOKENS, collection_id, query, limit),
+                )
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+            except Exception:
+                # Escape LIKE special characters to prevent wildcard injection
+                safe_query = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                cursor = await db.execute(
+                    """
+                    SELECT id, filename, substr(content, 1, 220) AS snippet
+                    FROM local_collection_documents
+                    WHERE collection_id = ? AND content LIKE ? ESCAPE '\\'
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                    """,
+                    (collection_id, f"%{safe_query}%", limit),
+                )
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+        except Exception:
+            logger.exception(
+                "search_local_collection_documents_failed",
+                collection_id=collection_id,
+                query=query,
+            )
+            return []
+
+
+# ---------------------------------------------------------------------------
+# Conversation summaries (see summarizer.py)
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class ConversationSummary:
+    """Rolling summary of a user's messages up to ``covered_until_id``."""
+
+    summary: str
+    covered_until_id: int
+    token_count: int = 0
+    updated_at: float = 0.0
+
+
+# user_id -> summary (None = the user has none); read on every chat turn
+_summary_cache: dict[int, ConversationSummary | None] = {}
+
+
+async def get_conversation_summary(user_id: int) -> ConversationSummary | None:
+    """Return the stored summary of *user_id*'s older messages, if any."""
+    if user_id in _summary_cache:
+        return _summary_cache[user_id]
+    async with _reader() as db:
         try:
             cursor = await db.execute(
-                """
-                SELECT d.id, d.filename, snippet(local_collection_documents_fts, 1, '[', ']', '…', ?) AS snippet
-                FROM local_collection_documents_fts
-                JOIN local_collection_documents d ON d.id = local_collection_documents_fts.rowid
-                WHERE d.collection_id = ? AND local_collection_documents_fts MATCH ?
-                ORDER BY bm25(local_collection_documents_fts)
-                LIMIT ?
-                """,
-                (FTS_SNIPPET_TOKENS, collection_id, query, limit),
+                "SELECT summary, covered_until_id, token_count, updated_at "
+                "FROM conversation_summaries WHERE user_id = ?",
+                (user_id,),
             )
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            row = await cursor.fetchone()
         except Exception:
-            # Escape LIKE special characters to prevent wildcard injection
-            safe_query = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            logger.exception("get_conversation_summary_failed", user_id=user_id)
+            return None
+    summary = (
+        ConversationSummary(
+            summary=row["summary"],
+            covered_until_id=int(row["covered_until_id"]),
+            token_count=int(row["token_count"] or 0),
+            updated_at=float(row["updated_at"]),
+        )
+        if row
+        else None
+    )
+    _summary_cache[user_id] = summary
+    return summary
+
+
+async def save_conversation_summary(user_id: int, summary: str, covered_until_id: int) -> bool:
+    """Store *summary* as covering every message of *user_id* up to *covered_until_id*.
+
+    Nothing is stored (returns False) once that message is gone — e.g. the
+    user ran /clear while the summary was being generated.  Ids are
+    AUTOINCREMENT, so a newer conversation can never revive a stale summary.
+    """
+    entry = ConversationSummary(
+        summary=summary,
+        covered_until_id=covered_until_id,
+        token_count=estimate_tokens(summary),
+        updated_at=time.time(),
+    )
+    async with _writer() as db:
+        try:
             cursor = await db.execute(
-                """
-                SELECT id, filename, substr(content, 1, 220) AS snippet
-                FROM local_collection_documents
-                WHERE collection_id = ? AND content LIKE ? ESCAPE '\\'
-                ORDER BY created_at DESC, id DESC
-                LIMIT ?
-                """,
-                (collection_id, f"%{safe_query}%", limit),
+                "INSERT OR REPLACE INTO conversation_summaries "
+                "(user_id, summary, covered_until_id, token_count, updated_at) "
+                "SELECT ?, ?, ?, ?, ? "
+                "WHERE EXISTS (SELECT 1 FROM conversations WHERE user_id = ? AND id = ?)",
+                (
+                    user_id,
+                    entry.summary,
+                    entry.covered_until_id,
+                    entry.token_count,
+                    entry.updated_at,
+                    user_id,
+                    entry.covered_until_id,
+                ),
             )
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
-    except Exception:
-        logger.exception(
-            "search_local_collection_documents_failed",
-            collection_id=collection_id,
-            query=query,
-        )
-        return []
+            await db.commit()
+            if cursor.rowcount == 0:
+                return False
+            _summary_cache[user_id] = entry
+            # Messages queued before their rows got ids are cached without one;
+            # reload so the covered ones can be told apart
+            _history_cache.invalidate(user_id)
+            return True
+        except Exception:
+            _summary_cache.pop(user_id, None)
+            logger.exception("save_conversation_summary_failed", user_id=user_id)
+            return False
+
+
+async def count_messages_after(user_id: int, after_id: int) -> int:
+    """Number of committed messages of *user_id* with a row id above *after_id*.
+
+    Does not wait for the write-behind queue, so pairs still queued are not counted.
+    """
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM conversations WHERE user_id = ? AND id > ?",
+                (user_id, after_id),
+            )
+            return int((await cursor.fetchone())[0])
+        except Exception:
+            logger.exception("count_messages_after_failed", user_id=user_id)
+            return 0
+
+
+async def get_unsummarized_messages(
+    user_id: int,
+    *,
+    after_id: int,
+    keep_recent: int,
+    limit: int,
+) -> list[dict[str, Any]]:
+    """Oldest messages newer than *after_id*, excluding the *keep_recent* newest.
+
+    At most *limit* rows, oldest first, each with ``id``, ``role`` and ``content``.
+    """
+    await _flush_pending_writes()
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM conversations WHERE user_id = ? AND id > ?",
+                (user_id, after_id),
+            )
+            pending = int((await cursor.fetchone())[0]) - keep_recent
+            if pending <= 0:
+                return []
+            cursor = await db.execute(
+                "SELECT id, role, content FROM conversations "
+                "WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?",
+                (user_id, after_id, min(pending, limit)),
+            )
+            return [dict(row) for row in await cursor.fetchall()]
+        except Exception:
+            logger.exception("get_unsummarized_messages_failed", user_id=user_id)
+            return []
+
+
+# ---------------------------------------------------------------------------
+# Response cache (see response_cache.py)
+# ---------------------------------------------------------------------------
+
+async def get_cached_response(cache_key: str) -> dict[str, Any] | None:
+    """Return the ``response_cache`` row for *cache_key* (expired or not)."""
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT command, model, content, created_at, expires_at "
+                "FROM response_cache WHERE cache_key = ?",
+                (cache_key,),
+            )
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+        except Exception:
+            logger.exception("get_cached_response_failed")
+            return None
+
+
+async def put_cached_response(
+    cache_key: str,
+    command: str,
+    model: str,
+    content: str,
+    created_at: float,
+    expires_at: float,
+) -> None:
+    """Upsert a cached answer and drop rows that have expired."""
+    async with _writer() as db:
+        try:
+            await db.execute(
+                "INSERT OR REPLACE INTO response_cache "
+                "(cache_key, command, model, content, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, command, model, content, created_at, expires_at),
+            )
+            await db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (created_at,))
+            await db.commit()
+        except Exception:
+            logger.exception("put_cached_response_failed", command=command)
+
+
+async def delete_cached_responses(command: str | None = None) -> int:
+    """Delete all cached answers, or only those of *command*; return the count."""
+    async with _writer() as db:
+        try:
+            if command is None:
+                cursor = await db.execute("DELETE FROM response_cache")
+            else:
+                cursor = await db.execute("DELETE FROM response_cache WHERE command = ?", (command,))
+            await db.commit()
+            return cursor.rowcount  # type: ignore[return-value]
+        except Exception:
+            logger.exception("delete_cached_responses_failed", command=command)
+            return 0
 
 
 # ---------------------------------------------------------------------------
 # Batch operations (reduce round-trips)
 # ---------------------------------------------------------------------------
 
+@dataclass
+class _MessagePair:
+    """One user/assistant exchange plus its usage, waiting to be written."""
+
+    user_id: int
+    user_content: str
+    assistant_content: str
+    reasoning_content: str | None
+    model: str | None
+    tokens_in: int
+    tokens_out: int
+    reasoning_tokens: int
+    cost_usd: float
+    cached_tokens: int = 0
+    user_tokens: int = 0
+    assistant_tokens: int = 0
+    # Answered from the response cache: counted as a cache hit, not a request
+    cache_hit: bool = False
+    date: str = field(default_factory=_today)
+    created_at: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    )
+    # Move the user's server-side response chain along with this pair
+    set_chain: bool = False
+    response_id: str | None = None
+    response_at: float | None = None
+    response_tokens: int | None = None
+
+
+async def _write_message_pairs(pairs: list[_MessagePair]) -> None:
+    """Insert all *pairs* and their aggregated usage stats in one transaction."""
+    conversation_rows: list[tuple[Any, ...]] = []
+    stats: dict[tuple[int, str], list[Any]] = {}
+    # Last chain update per user in queue order
+    chains: dict[int, tuple[str | None, float | None, int | None]] = {}
+    for pair in pairs:
+        if pair.set_chain:
+            chains[pair.user_id] = (pair.response_id, pair.response_at, pair.response_tokens)
+        conversation_rows.append(
+            (pair.user_id, "user", pair.user_content, None, None, 0, 0, 0, 0.0,
+             pair.user_tokens, pair.created_at)
+        )
+        conversation_rows.append(
+            (pair.user_id, "assistant", pair.assistant_content, pair.reasoning_content,
+             pair.model, pair.tokens_in, pair.tokens_out, pair.reasoning_tokens,
+             pair.cost_usd, pair.assistant_tokens, pair.created_at)
+        )
+        totals = stats.setdefault((pair.user_id, pair.date), [0, 0, 0, 0, 0.0, 0, 0])
+        totals[0] += 0 if pair.cache_hit else 1
+        totals[1] += pair.tokens_in
+        totals[2] += pair.tokens_out
+        totals[3] += pair.reasoning_tokens
+        totals[4] += pair.cost_usd
+        totals[5] += pair.cached_tokens
+        totals[6] += 1 if pair.cache_hit else 0
+
+    async with _writer() as db:
+        try:
+            await db.executemany(
+                """
+                INSERT INTO conversations
+                    (user_id, role, content, reasoning_content, model,
+                     tokens_in, tokens_out, reasoning_tokens, cost_usd, token_count, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                conversation_rows,
+            )
+            await db.executemany(
+                """
+                INSERT INTO usage_stats
+                    (user_id, date, total_requests, total_tokens_in,
+                     total_tokens_out, total_reasoning_tokens, total_cost_usd,
+                     total_cached_tokens, total_cache_hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, date) DO UPDATE SET
+                    total_requests = total_requests + excluded.total_requests,
+                    total_tokens_in = total_tokens_in + excluded.total_tokens_in,
+                    total_tokens_out = total_tokens_out + excluded.total_tokens_out,
+                    total_reasoning_tokens = total_reasoning_tokens + excluded.total_reasoning_tokens,
+                    total_cost_usd = total_cost_usd + excluded.total_cost_usd,
+                    total_cached_tokens = total_cached_tokens + excluded.total_cached_tokens,
+                    total_cache_hits = total_cache_hits + excluded.total_cache_hits
+                """,
+                [(user_id, date, *totals) for (user_id, date), totals in stats.items()],
+            )
+            if chains:
+                await db.executemany(
+                    "INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)",
+                    [(user_id,) for user_id in chains],
+                )
+                await db.executemany(
+                    "UPDATE user_settings SET last_response_id = ?, last_response_at = ?, "
+                    "last_response_tokens = ? WHERE user_id = ?",
+                    [(*chain, user_id) for user_id, chain in chains.items()],
+                )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+
+def _drop_message_pairs(pairs: list[_MessagePair]) -> None:
+    global _user_settings_epoch  # noqa: PLW0603
+    # The caches already hold these messages and chains — make the next read go to the DB
+    for user_id in {pair.user_id for pair in pairs}:
+        _history_cache.invalidate(user_id)
+    for user_id in {pair.user_id for pair in pairs if pair.set_chain}:
+        _user_settings_epoch += 1
+        _user_settings_cache.pop(user_id, None)
+
+
+_write_queue: WriteBehindQueue[_MessagePair] = WriteBehindQueue(
+    _write_message_pairs,
+    interval=settings.db_write_behind_interval_ms / 1000,
+    max_items=settings.db_write_behind_max_rows,
+    on_drop=_drop_message_pairs,
+)
+
+
+async def _flush_pending_writes() -> None:
+    """Make queued writes visible before reading (waits for an in-flight batch too)."""
+    if _write_queue.pending:
+        await _write_queue.flush()
+
+
+async def flush_writes() -> None:
+    """Drain the write-behind queue (shutdown, tests)."""
+    await _write_queue.close()
+
+
+def get_write_queue_status() -> dict[str, Any]:
+    """Return write-behind queue metrics."""
+    return _write_queue.status()
+
+
+# Called with the user_id after every saved exchange (e.g. the summarizer);
+# hooks must be cheap and non-blocking
+_pair_saved_hooks: list[Callable[[int], None]] = []
+
+
+def add_pair_saved_hook(hook: Callable[[int], None]) -> None:
+    """Register *hook* to run after :func:`save_message_pair_and_stats`."""
+    _pair_saved_hooks.append(hook)
+
+
+def remove_pair_saved_hook(hook: Callable[[int], None]) -> None:
+    if hook in _pair_saved_hooks:
+        _pair_saved_hooks.remove(hook)
+
+
+def _run_pair_saved_hooks(user_id: int) -> None:
+    for hook in list(_pair_saved_hooks):
+        try:
+            hook(user_id)
+        except Exception:
+            logger.exception("pair_saved_hook_failed", user_id=user_id)
+
+
+# Called as hook(user_id, tokens, cost_usd, requests) whenever usage is added to
+# today's usage_stats (e.g. the rate limiter's in-memory quotas)
+_usage_hooks: list[Callable[[int, int, float, int], None]] = []
+
+
+def add_usage_hook(hook: Callable[[int, int, float, int], None]) -> None:
+    """Register *hook* to mirror every usage added to ``usage_stats``."""
+    _usage_hooks.append(hook)
+
+
+def remove_usage_hook(hook: Callable[[int, int, float, int], None]) -> None:
+    if hook in _usage_hooks:
+        _usage_hooks.remove(hook)
+
+
+def _run_usage_hooks(user_id: int, tokens: int, cost_usd: float, requests: int) -> None:
+    for hook in list(_usage_hooks):
+        try:
+            hook(user_id, tokens, cost_usd, requests)
+        except Exception:
+            logger.exception("usage_hook_failed", user_id=user_id)
+
+
+def _cache_response_chain(snapshot: UserSettings, pair: _MessagePair) -> None:
+    global _user_settings_epoch  # noqa: PLW0603
+    # Reads that started before this point must not cache the old chain
+    _user_settings_epoch += 1
+    _user_settings_cache[pair.user_id] = replace(
+        snapshot,
+        last_response_id=pair.response_id,
+        last_response_at=pair.response_at,
+        last_response_tokens=pair.response_tokens,
+    )
+
+
 async def save_message_pair_and_stats(
     user_id: int,
     user_content: str,
@@ -642,58 +1445,88 @@ async def save_message_pair_and_stats(
     tokens_out: int = 0,
     reasoning_tokens: int = 0,
     cost_usd: float = 0.0,
-) -> None:
-    """Persist user + assistant messages and update daily stats in one commit.
+    response_id: str | None = None,
+    cached_tokens: int = 0,
+    cache_hit: bool = False,
+) -> bool:
+    """Persist user + assistant messages and update daily stats.
+
+    With ``DB_WRITE_BEHIND_ENABLED`` (default) the pair is queued and written
+    together with other users' pairs in one transaction; the history cache is
+    updated immediately so the next request sees it.  With it disabled the
+    pair is committed before returning (crash-safe mode).  Usage hooks (the
+    in-memory quotas) see the usage as soon as it is queued.
+
+    With ``XAI_STATEFUL_CONVERSATIONS`` the user's response chain is moved to
+    *response_id*, or dropped when the turn was not chained (``None``).  The
+    chain is written in the same transaction as the pair, and the settings
+    snapshot is updated right away.
+
+    A *cache_hit* (answer served from :mod:`response_cache`) is counted in
+    ``total_cache_hits`` instead of ``total_requests``, so it does not use up
+    the daily request quota.
 
-    This replaces three separate calls (save_message × 2 + update_daily_stats)
-    with a single transaction, eliminating two extra connection round-trips.
+    Returns whether the pair was queued or committed; only then has its
+    usage reached the usage hooks.
     """
-    today = _today()
-    db = await _get_db()
+    current: UserSettings | None = None
+    if settings.xai_stateful_conversations:
+        current = await get_user_settings(user_id)
+        if current.last_response_id == response_id:
+            current = None
+
+    pair = _MessagePair(
+        user_id=user_id,
+        user_content=user_content,
+        assistant_content=assistant_content,
+        reasoning_content=reasoning_content,
+        model=model,
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        reasoning_tokens=reasoning_tokens,
+        cost_usd=cost_usd,
+        cached_tokens=cached_tokens,
+        user_tokens=estimate_tokens(user_content),
+        assistant_tokens=estimate_tokens(assistant_content),
+        cache_hit=cache_hit,
+        set_chain=current is not None,
+        response_id=response_id,
+        response_at=time.time() if response_id else None,
+        # The whole chain is billed as the prompt of the next chained turn
+        response_tokens=tokens_in + tokens_out if response_id else None,
+    )
+    messages = (
+        {"role": "user", "content": user_content, "tokens": pair.user_tokens},
+        {"role": "assistant", "content": assistant_content, "tokens": pair.assistant_tokens},
+    )
+    usage = (tokens_in + tokens_out + reasoning_tokens, cost_usd, 0 if cache_hit else 1)
+    if settings.db_write_behind_enabled:
+        _write_queue.put(pair)
+        _history_cache.append(user_id, *messages)
+        if current is not None:
+            _cache_response_chain(current, pair)
+        _run_usage_hooks(user_id, *usage)
+        _run_pair_saved_hooks(user_id)
+        return True
+
     try:
-        await db.execute(
-            """
-            INSERT INTO conversations
-                (user_id, role, content, reasoning_content, model,
-                 tokens_in, tokens_out, reasoning_tokens, cost_usd)
-            VALUES (?, 'user', ?, NULL, NULL, 0, 0, 0, 0.0)
-            """,
-            (user_id, user_content),
-        )
-        await db.execute(
-            """
-            INSERT INTO conversations
-                (user_id, role, content, reasoning_content, model,
-                 tokens_in, tokens_out, reasoning_tokens, cost_usd)
-            VALUES (?, 'assistant', ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, assistant_content, reasoning_content, model,
-             tokens_in, tokens_out, reasoning_tokens, cost_usd),
-        )
-        await db.execute(
-            """
-            INSERT INTO usage_stats
-                (user_id, date, total_requests, total_tokens_in,
-                 total_tokens_out, total_reasoning_tokens, total_cost_usd)
-            VALUES (?, ?, 1, ?, ?, ?, ?)
-            ON CONFLICT(user_id, date) DO UPDATE SET
-                total_requests = total_requests + 1,
-                total_tokens_in = total_tokens_in + excluded.total_tokens_in,
-                total_tokens_out = total_tokens_out + excluded.total_tokens_out,
-                total_reasoning_tokens = total_reasoning_tokens + excluded.total_reasoning_tokens,
-                total_cost_usd = total_cost_usd + excluded.total_cost_usd
-            """,
-            (user_id, today, tokens_in, tokens_out, reasoning_tokens, cost_usd),
-        )
-        await db.commit()
+        await _write_message_pairs([pair])
+        _history_cache.append(user_id, *messages)
+        if current is not None:
+            _cache_response_chain(current, pair)
     except Exception:
+        _history_cache.invalidate(user_id)
         logger.exception("save_message_pair_and_stats_failed", user_id=user_id)
+        return False
+    _run_usage_hooks(user_id, *usage)
+    _run_pair_saved_hooks(user_id)
+    return True
 
 
 async def get_user_stats_combined(user_id: int) -> tuple[dict[str, Any], dict[str, Any]]:
     """Fetch daily + all-time stats in a single connection round-trip."""
     today = _today()
-    db = await _get_db()
+    await _flush_pending_writes()
     empty_daily: dict[str, Any] = {
         "user_id": user_id,
         "date": today,
@@ -702,6 +1535,8 @@ async def get_user_stats_combined(user_id: int) -> tuple[dict[str, Any], dict[st
         "total_tokens_out": 0,
         "total_reasoning_tokens": 0,
         "total_cost_usd": 0.0,
+        "total_cached_tokens": 0,
+        "total_cache_hits": 0,
     }
     empty_alltime: dict[str, Any] = {
         "total_requests": 0,
@@ -709,32 +1544,37 @@ async def get_user_stats_combined(user_id: int) -> tuple[dict[str, Any], dict[st
         "total_tokens_out": 0,
         "total_reasoning_tokens": 0,
         "total_cost_usd": 0.0,
+        "total_cached_tokens": 0,
+        "total_cache_hits": 0,
     }
-    try:
-        cursor = await db.execute(
-            "SELECT * FROM usage_stats WHERE user_id = ? AND date = ?",
-            (user_id, today),
-        )
-        row = await cursor.fetchone()
-        daily = dict(row) if row else empty_daily
-
-        cursor = await db.execute(
-            """
-            SELECT
-                COALESCE(SUM(total_requests), 0)         AS total_requests,
-                COALESCE(SUM(total_tokens_in), 0)        AS total_tokens_in,
-                COALESCE(SUM(total_tokens_out), 0)       AS total_tokens_out,
-                COALESCE(SUM(total_reasoning_tokens), 0) AS total_reasoning_tokens,
-                COALESCE(SUM(total_cost_usd), 0.0)       AS total_cost_usd
-            FROM usage_stats
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        row = await cursor.fetchone()
-        alltime = dict(row) if row else empty_alltime
+    async with _reader() as db:
+        try:
+            cursor = await db.execute(
+                "SELECT * FROM usage_stats WHERE user_id = ? AND date = ?",
+                (user_id, today),
+            )
+            row = await cursor.fetchone()
+            daily = dict(row) if row else empty_daily
 
-        return daily, alltime
-    except Exception:
-        logger.exception("get_user_stats_combined_failed", user_id=user_id)
-        return empty_daily, empty_alltime
+            cursor = await db.execute(
+                """
+                SELECT
+                    COALESCE(SUM(total_requests), 0)         AS total_requests,
+                    COALESCE(SUM(total_tokens_in), 0)        AS total_tokens_in,
+                    COALESCE(SUM(total_tokens_out), 0)       AS total_tokens_out,
+                    COALESCE(SUM(total_reasoning_tokens), 0) AS total_reasoning_tokens,
+                    COALESCE(SUM(total_cost_usd), 0.0)       AS total_cost_usd,
+                    COALESCE(SUM(total_cached_tokens), 0)    AS total_cached_tokens,
+                    COALESCE(SUM(total_cache_hits), 0)       AS total_cache_hits
+                FROM usage_stats
+                WHERE user_id = ?
+                """,
+                (user_id,),
+            )
+            row = await cursor.fetchone()
+            alltime = dict(row) if row else empty_alltime
+
+            return daily, alltime
+        except Exception:
+            logger.exception("get_user_stats_combined_failed", user_id=user_id)
+            return empty_daily, empty_alltime
@@ -0,0 +1,305 @@
+"""Rate-limit-aware scheduler for Telegram ``edit_message_text`` calls.
+
+Streaming previews generate far more edits than Telegram accepts.  Instead of
+every handler editing on its own fixed timer, all preview edits go through a
+single :class:`EditScheduler` that:
+
+- keeps only the latest pending text per message (older edits are merged),
+- enforces a per-chat interval and a bot-wide edits/second budget,
+- backs off on ``RetryAfter`` — the chat is paused for the requested time and
+  the global rate is halved, then recovers additively on successful edits.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any
+
+import structlog
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from config import settings
+
+logger = structlog.get_logger(__name__)
+
+_MIN_GLOBAL_RATE: float = 1.0
+_RATE_RECOVERY_STEP: float = 0.25
+_FINAL_EDIT_ATTEMPTS: int = 3
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    value: Any = exc.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def _message_key(message: Message) -> tuple[int, int]:
+    return (message.chat_id, message.message_id)
+
+
+@dataclass
+class _PendingEdit:
+    message: Message
+    text: str
+    parse_mode: str | None
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class EditScheduler:
+    """Coalescing, budgeted dispatcher for Telegram message edits."""
+
+    def __init__(
+        self,
+        per_chat_interval: float = 1.0,
+        global_rate: float = 25.0,
+        global_burst: int = 30,
+    ) -> None:
+        self._per_chat_interval = per_chat_interval
+        self._max_rate = global_rate
+        self._rate = global_rate
+        self._burst = float(global_burst)
+        self._tokens = float(global_burst)
+        self._last_refill = time.monotonic()
+
+        self._pending: dict[tuple[int, int], _PendingEdit] = {}
+        self._chat_ready_at: dict[int, float] = {}
+        self._in_flight: dict[tuple[int, int], asyncio.Task[None]] = {}
+        # Messages whose final text is being delivered; previews are not re-queued
+        self._finalizing: set[tuple[int, int]] = set()
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task[None] | None = None
+
+        self._stats: dict[str, int] = {
+            "submitted": 0,
+            "merged": 0,
+            "sent": 0,
+            "failed": 0,
+            "retry_after": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def submit(self, message: Message, text: str, parse_mode: str | None = "HTML") -> None:
+        """Queue a preview edit; replaces any not-yet-sent text for *message*."""
+        key = _message_key(message)
+        self._stats["submitted"] += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._stats["merged"] += 1
+            pending.text = text
+            pending.parse_mode = parse_mode
+        else:
+            self._pending[key] = _PendingEdit(message, text, parse_mode)
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def discard(self, message: Message) -> None:
+        """Drop a pending preview edit (e.g. right before the final answer)."""
+        self._pending.pop(_message_key(message), None)
+
+    async def edit_now(
+        self, message: Message, text: str, parse_mode: str | None = "HTML"
+    ) -> bool:
+        """Send a must-deliver edit (final answer / error), honouring budgets.
+
+        Pending previews for the message are dropped and an in-flight preview
+        is awaited first, so it can never overwrite the final text.
+        """
+        key = _message_key(message)
+        self._finalizing.add(key)
+        try:
+            self._pending.pop(key, None)
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                await asyncio.gather(in_flight, return_exceptions=True)
+                # A preview hit by RetryAfter may have been re-queued meanwhile
+                self._pending.pop(key, None)
+            return await self._deliver(message, text, parse_mode)
+        finally:
+            self._finalizing.discard(key)
+            self._forget_idle_chats(time.monotonic())
+
+    async def _deliver(self, message: Message, text: str, parse_mode: str | None) -> bool:
+        for _ in range(_FINAL_EDIT_ATTEMPTS):
+            delay = self._delay_for_chat(message.chat_id, time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._take_global_token()
+            self._chat_ready_at[message.chat_id] = time.monotonic() + self._per_chat_interval
+            try:
+                await message.edit_text(text, parse_mode=parse_mode)
+                self._on_success()
+                return True
+            except RetryAfter as exc:
+                self._on_retry_after(message.chat_id, exc)
+            except BadRequest as exc:
+                if "not modified" in str(exc).lower():
+                    return True
+                self._stats["failed"] += 1
+                logger.warning("telegram_edit_failed", chat_id=message.chat_id, error=str(exc))
+                return False
+            except Exception as exc:
+                self._stats["failed"] += 1
+                logger.warning("telegram_edit_failed", chat_id=message.chat_id, error=str(exc))
+                return False
+        return False
+
+    async def stop(self) -> None:
+        """Cancel the worker and wait for in-flight edits (call at shutdown)."""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+        self._pending.clear()
+
+    def status(self) -> dict[str, Any]:
+        """Return scheduler metrics for diagnostics."""
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "chats_throttled": len(self._chat_ready_at),
+            "global_rate": round(self._rate, 2),
+        }
+
+    # ------------------------------------------------------------------
+    # Budgets
+    # ------------------------------------------------------------------
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._last_refill = now
+
+    def _global_delay(self, now: float) -> float:
+        self._refill(now)
+        if self._tokens >= 1.0:
+            return 0.0
+        return (1.0 - self._tokens) / self._rate
+
+    def _take_global_token(self) -> None:
+        self._refill(time.monotonic())
+        self._tokens -= 1.0
+
+    def _delay_for_chat(self, chat_id: int, now: float) -> float:
+        chat_delay = self._chat_ready_at.get(chat_id, 0.0) - now
+        return max(chat_delay, self._global_delay(now), 0.0)
+
+    def _forget_idle_chats(self, now: float) -> None:
+        """Drop per-chat deadlines that have passed (a missing entry means "ready")."""
+        for chat_id in [c for c, ready_at in self._chat_ready_at.items() if ready_at <= now]:
+            del self._chat_ready_at[chat_id]
+
+    def _on_success(self) -> None:
+        self._stats["sent"] += 1
+        if self._rate < self._max_rate:
+            self._rate = min(self._max_rate, self._rate + _RATE_RECOVERY_STEP)
+
+    def _on_retry_after(self, chat_id: int, exc: RetryAfter) -> None:
+        wait = _retry_after_seconds(exc)
+        self._stats["retry_after"] += 1
+        self._chat_ready_at[chat_id] = time.monotonic() + wait
+        self._rate = max(_MIN_GLOBAL_RATE, self._rate / 2)
+        logger.warning(
+            "telegram_flood_control",
+            chat_id=chat_id,
+            retry_after=wait,
+            global_rate=round(self._rate, 2),
+        )
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _next_ready(self, now: float) -> tuple[tuple[int, int] | None, float]:
+        """Return the oldest dispatchable edit and how long until it is due."""
+        best_key: tuple[int, int] | None = None
+        best: tuple[float, float] | None = None
+        for key, pending in self._pending.items():
+            if key in self._in_flight:
+                continue
+            ready_in = max(self._chat_ready_at.get(key[0], 0.0) - now, 0.0)
+            candidate = (ready_in, pending.queued_at)
+            if best is None or candidate < best:
+                best_key, best = key, candidate
+        if best is None:
+            return None, 0.0
+        return best_key, max(best[0], self._global_delay(now))
+
+    async def _run(self) -> None:
+        while True:
+            key, delay = self._next_ready(time.monotonic())
+            if key is None:
+                now = time.monotonic()
+                self._forget_idle_chats(now)
+                self._wakeup.clear()
+                # Wake up when the next chat deadline passes, to forget it too
+                expires = min(self._chat_ready_at.values(), default=None)
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=None if expires is None else expires - now
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            pending = self._pending.pop(key)
+            self._take_global_token()
+            self._chat_ready_at[key[0]] = time.monotonic() + self._per_chat_interval
+            self._in_flight[key] = asyncio.get_running_loop().create_task(
+                self._send(key, pending)
+            )
+
+    async def _send(self, key: tuple[int, int], pending: _PendingEdit) -> None:
+        try:
+            await pending.message.edit_text(pending.text, parse_mode=pending.parse_mode)
+            self._on_success()
+        except RetryAfter as exc:
+            self._on_retry_after(key[0], exc)
+            # Re-queue unless a newer text has arrived or the final edit took over
+            if key not in self._finalizing:
+                self._pending.setdefault(key, pending)
+        except BadRequest as exc:
+            if "not modified" not in str(exc).lower():
+                self._stats["failed"] += 1
+                logger.warning("telegram_edit_failed", chat_id=key[0], error=str(exc))
+        except Exception as exc:
+            self._stats["failed"] += 1
+            logger.warning("telegram_edit_failed", chat_id=key[0], error=str(exc))
+        finally:
+            self._in_flight.pop(key, None)
+            self._wakeup.set()
+
+
+_scheduler: EditScheduler | None = None
+
+
+def get_edit_scheduler() -> EditScheduler:
+    """Return the process-wide edit scheduler (created on first use)."""
+    global _scheduler  # noqa: PLW0603
+    if _scheduler is None:
+        _scheduler = EditScheduler(
+            per_chat_interval=settings.telegram_edit_chat_interval,
+            global_rate=settings.telegram_edit_global_rate,
+        )
+    return _scheduler
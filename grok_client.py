@@ -3,29 +3,40 @@
 from __future__ import annotations
 
 import asyncio
-import json
 from typing import Any, AsyncGenerator
 
 import httpx
 import structlog
 
-logger = structlog.get_logger(__name__)
+from concurrency import ConcurrencyScheduler, get_concurrency_scheduler
+from http_transport import create_http_client
+from retry_policy import RetryPolicy
+from sse import aiter_sse_json
+from stream_resume import ResumeGuard
+from token_count import input_tokens, usage_tokens
 
-_MAX_RETRIES: int = 3
-_RETRY_DELAYS: tuple[float, ...] = (1.0, 2.0, 4.0)
-_RATE_LIMIT_DELAY: float = 5.0
+logger = structlog.get_logger(__name__)
 
 
 class GrokClient:
     """Async HTTP client for xAI ``/chat/completions`` requests."""
 
-    def __init__(self, api_key: str, base_url: str = "https://api.x.ai/v1") -> None:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.x.ai/v1",
+        http_client: httpx.AsyncClient | None = None,
+        scheduler: ConcurrencyScheduler | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
         self._base_url = base_url.rstrip("/")
-        self._client = httpx.AsyncClient(
-            timeout=httpx.Timeout(connect=15.0, read=120.0, write=30.0, pool=15.0),
-            headers={"Authorization": f"Bearer {api_key}"},
-        )
-        self._semaphore = asyncio.Semaphore(5)
+        # Auth and timeout go on every request so a shared pooled client can be injected
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._timeout = httpx.Timeout(connect=15.0, read=120.0, write=30.0, pool=15.0)
+        self._owns_client = http_client is None
+        self._client = http_client or create_http_client("xai", timeout=self._timeout)
+        self._scheduler = scheduler or get_concurrency_scheduler()
+        self._retry_policy = retry_policy or RetryPolicy()
 
     def _build_chat_body(
         self,
@@ -54,13 +65,6 @@ class GrokClient:
             body.update(search)
         return body
 
-    async def _sleep_before_retry(self, attempt: int, *, reason: str) -> None:
-        if reason == "rate_limit":
-            await asyncio.sleep(_RATE_LIMIT_DELAY)
-            return
-        delay = _RETRY_DELAYS[min(attempt, len(_RETRY_DELAYS) - 1)]
-        await asyncio.sleep(delay)
-
     def _extract_tool_name(self, tool_call: dict[str, Any]) -> str | None:
         """Extract tool name from streaming tool_call deltas."""
         if not isinstance(tool_call, dict):
@@ -95,107 +99,97 @@ class GrokClient:
             search=search,
         )
 
-        last_error: Exception | None = None
-        for attempt in range(_MAX_RETRIES):
-            rate_limited = False
+        retry = self._retry_policy.start()
+        guard = ResumeGuard()
+        estimate = input_tokens(messages)
+        while True:
             try:
-                async with self._semaphore:
+                async with self._scheduler.slot("/chat/completions", model, tokens=estimate) as admission:
                     async with self._client.stream(
                         "POST",
                         f"{self._base_url}/chat/completions",
                         json=body,
+                        headers=self._headers,
+                        timeout=self._timeout,
                     ) as response:
-                        if response.status_code == 429:
-                            await response.aread()
-                            rate_limited = True
-                        elif response.status_code != 200:
+                        admission.observe(response.headers)
+                        if response.status_code != 200:
                             error_body = await response.aread()
                             raise httpx.HTTPStatusError(
                                 f"HTTP {response.status_code}: {error_body.decode(errors='replace')}",
                                 request=response.request,
                                 response=response,
                             )
-                        else:
-                            async for line in response.aiter_lines():
-                                payload_line = line.strip()
-                                if not payload_line.startswith("data: "):
-                                    continue
-                                payload = payload_line[6:]
-                                if payload == "[DONE]":
-                                    break
-                                try:
-                                    chunk = json.loads(payload)
-                                except json.JSONDecodeError:
-                                    logger.warning("stream_json_decode_failed")
-                                    continue
+                        async for chunk in aiter_sse_json(response):
+                            choices = chunk.get("choices")
+                            if not isinstance(choices, list) or not choices:
+                                continue
+                            choice = choices[0]
+                            if not isinstance(choice, dict):
+                                continue
+                            delta = choice.get("delta")
+                            if not isinstance(delta, dict):
+                                continue
 
-                                choices = chunk.get("choices")
-                                if not isinstance(choices, list) or not choices:
-                                    continue
-                                choice = choices[0]
-                                if not isinstance(choice, dict):
-                                    continue
-                                delta = choice.get("delta")
-                                if not isinstance(delta, dict):
-                                    continue
+                            reasoning_chunk = delta.get("reasoning_content")
+                            if isinstance(reasoning_chunk, str) and reasoning_chunk:
+                                for event in guard.feed("reasoning", reasoning_chunk):
+                                    yield event
 
-                                reasoning_chunk = delta.get("reasoning_content")
-                                if isinstance(reasoning_chunk, str) and reasoning_chunk:
-                                    yield ("reasoning", reasoning_chunk)
+                            tool_calls = delta.get("tool_calls")
+                            if isinstance(tool_calls, list):
+                                for tool_call in tool_calls:
+                                    if isinstance(tool_call, dict):
+                                        tool_name = self._extract_tool_name(
+                                            tool_call
+                                        )
+                                        if tool_name:
+                                            yield ("tool_use", tool_name)
 
-                                tool_calls = delta.get("tool_calls")
-                                if isinstance(tool_calls, list):
-                                    for tool_call in tool_calls:
-                                        if isinstance(tool_call, dict):
-                                            tool_name = self._extract_tool_name(
-                                                tool_call
-                                            )
-                                            if tool_name:
-                                                yield ("tool_use", tool_name)
+                            content_chunk = delta.get("content")
+                            if isinstance(content_chunk, str) and content_chunk:
+                                for event in guard.feed("content", content_chunk):
+                                    yield event
 
-                                content_chunk = delta.get("content")
-                                if isinstance(content_chunk, str) and content_chunk:
-                                    yield ("content", content_chunk)
-
-                                usage_raw = chunk.get("usage")
-                                if isinstance(usage_raw, dict):
-                                    details = usage_raw.get("completion_tokens_details")
-                                    completion_details = (
-                                        details if isinstance(details, dict) else {}
-                                    )
-                                    yield (
-                                        "done",
-                                        {
-                                            "prompt_tokens": int(
-                                                usage_raw.get("prompt_tokens", 0) or 0
-                                            ),
-                                            "completion_tokens": int(
-                                                usage_raw.get("completion_tokens", 0)
-                                                or 0
-                                            ),
-                                            "reasoning_tokens": int(
-                                                completion_details.get(
-                                                    "reasoning_tokens", 0
-                                                )
-                                                or 0
-                                            ),
-                                        },
-                                    )
-                            return
-
-                if rate_limited:
-                    logger.warning("grok_rate_limited", attempt=attempt + 1)
-                    await self._sleep_before_retry(attempt, reason="rate_limit")
+                            usage_raw = chunk.get("usage")
+                            if isinstance(usage_raw, dict):
+                                for event in guard.finish():
+                                    yield event
+                                details = usage_raw.get("completion_tokens_details")
+                                completion_details = (
+                                    details if isinstance(details, dict) else {}
+                                )
+                                details = usage_raw.get("prompt_tokens_details")
+                                prompt_details = (
+                                    details if isinstance(details, dict) else {}
+                                )
+                                done_usage = {
+                                    "prompt_tokens": int(usage_raw.get("prompt_tokens", 0) or 0),
+                                    "completion_tokens": int(usage_raw.get("completion_tokens", 0) or 0),
+                                    "reasoning_tokens": int(
+                                        completion_details.get("reasoning_tokens", 0) or 0
+                                    ),
+                                    "cached_tokens": int(prompt_details.get("cached_tokens", 0) or 0),
+                                }
+                                admission.settle(usage_tokens(done_usage))
+                                yield ("done", done_usage)
+                        for event in guard.finish():
+                            yield event
+                        return
             except Exception as exc:
-                last_error = exc
-                logger.warning("grok_stream_retry", attempt=attempt + 1, error=str(exc))
-                if attempt < _MAX_RETRIES - 1:
-                    await self._sleep_before_retry(attempt, reason="error")
-
-        if last_error:
-            logger.error("grok_stream_failed", error=str(last_error))
-            raise last_error
-        raise RuntimeError("xAI API rate limit — wszystkie próby wyczerpane")
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("grok_stream_failed", attempts=retry.attempt + 1, error=str(exc))
+                    raise
+                logger.warning(
+                    "grok_stream_retry",
+                    attempt=retry.attempt,
+                    delay=round(delay, 2),
+                    resumed=guard.has_output,
+                    error=str(exc),
+                )
+                guard.retry()
+                await asyncio.sleep(delay)
 
     async def chat(
         self,
@@ -217,32 +211,33 @@ class GrokClient:
             search=search,
         )
 
-        last_error: Exception | None = None
-        for attempt in range(_MAX_RETRIES):
+        retry = self._retry_policy.start()
+        estimate = input_tokens(messages)
+        while True:
             try:
-                async with self._semaphore:
+                async with self._scheduler.slot("/chat/completions", model, tokens=estimate) as admission:
                     response = await self._client.post(
-                        f"{self._base_url}/chat/completions", json=body
+                        f"{self._base_url}/chat/completions",
+                        json=body,
+                        headers=self._headers,
+                        timeout=self._timeout,
                     )
-                if response.status_code == 429:
-                    logger.warning("grok_rate_limited", attempt=attempt + 1)
-                    await self._sleep_before_retry(attempt, reason="rate_limit")
-                    continue
+                    admission.observe(response.headers)
                 response.raise_for_status()
                 payload = response.json()
                 if not isinstance(payload, dict):
                     raise RuntimeError("Nieprawidłowa odpowiedź API xAI.")
+                usage = payload.get("usage")
+                if isinstance(usage, dict):
+                    admission.settle(usage_tokens(usage))
                 return payload
             except Exception as exc:
-                last_error = exc
-                logger.warning("grok_chat_retry", attempt=attempt + 1, error=str(exc))
-                if attempt < _MAX_RETRIES - 1:
-                    await self._sleep_before_retry(attempt, reason="error")
-
-        if last_error:
-            logger.error("grok_chat_failed", error=str(last_error))
-            raise last_error
-        raise RuntimeError("Unexpected: no response and no error")
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("grok_chat_failed", attempts=retry.attempt + 1, error=str(exc))
+                    raise
+                logger.warning("grok_chat_retry", attempt=retry.attempt, delay=round(delay, 2), error=str(exc))
+                await asyncio.sleep(delay)
 
     async def search_collection(
         self,
@@ -256,20 +251,16 @@ class GrokClient:
             "source": {"collection_ids": [collection_id]},
         }
 
-        last_error: Exception | None = None
-        for attempt in range(_MAX_RETRIES):
+        retry = self._retry_policy.start()
+        while True:
             try:
-                async with self._semaphore:
+                async with self._scheduler.slot("/documents/search"):
                     response = await self._client.post(
-                        f"{self._base_url}/documents/search", json=body
-                    )
-
-                if response.status_code == 429:
-                    logger.warning(
-                        "collection_search_rate_limited", attempt=attempt + 1
+                        f"{self._base_url}/documents/search",
+                        json=body,
+                        headers=self._headers,
+                        timeout=self._timeout,
                     )
-                    await self._sleep_before_retry(attempt, reason="rate_limit")
-                    continue
 
                 response.raise_for_status()
                 data = response.json()
@@ -292,18 +283,16 @@ class GrokClient:
 
                 return results[:max_results]
             except Exception as exc:
-                last_error = exc
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("collection_search_failed", attempts=retry.attempt + 1, error=str(exc))
+                    raise
                 logger.warning(
-                    "collection_search_retry", attempt=attempt + 1, error=str(exc)
+                    "collection_search_retry", attempt=retry.attempt, delay=round(delay, 2), error=str(exc)
                 )
-                if attempt < _MAX_RETRIES - 1:
-                    await self._sleep_before_retry(attempt, reason="error")
-
-        if last_error:
-            logger.error("collection_search_failed", error=str(last_error))
-            raise last_error
-        raise RuntimeError("collection search — wszystkie próby wyczerpane")
+                await asyncio.sleep(delay)
 
     async def close(self) -> None:
-        """Gracefully close the underlying HTTP client."""
-        await self._client.aclose()
+        """Gracefully close the underlying HTTP client (unless it is shared)."""
+        if self._owns_client:
+            await self._client.aclose()
@@ -9,12 +9,36 @@ from typing import Any, AsyncGenerator
 import httpx
 import structlog
 
+from concurrency import ConcurrencyScheduler, get_concurrency_scheduler
+from http_transport import create_http_client
+from retry_policy import RetryableError, RetryPolicy
+from sse import aiter_sse_json
+from stream_resume import ResumeGuard
+from token_count import input_tokens, usage_tokens
+
 logger = structlog.get_logger(__name__)
 
-_MAX_RETRIES = 3
-_RETRY_DELAYS = (1.0, 2.0, 4.0)
 _ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
 _XAI_RESPONSES_URL = "https://api.x.ai/v1/responses"
+# Anthropic SSE ``error`` event types worth another attempt
+_ANTHROPIC_RETRYABLE_ERRORS = frozenset({"overloaded_error", "api_error", "rate_limit_error"})
+
+
+def _parse_usage(raw: Any) -> dict[str, int]:
+    """Normalise Responses API usage to the chat-completions key names."""
+    u = raw if isinstance(raw, dict) else {}
+    input_details = u.get("input_tokens_details")
+    output_details = u.get("output_tokens_details")
+    input_details = input_details if isinstance(input_details, dict) else {}
+    output_details = output_details if isinstance(output_details, dict) else {}
+    return {
+        "prompt_tokens": int(u.get("input_tokens", 0) or 0),
+        "completion_tokens": int(u.get("output_tokens", 0) or 0),
+        "reasoning_tokens": int(
+            u.get("reasoning_tokens") or output_details.get("reasoning_tokens", 0) or 0
+        ),
+        "cached_tokens": int(input_details.get("cached_tokens", 0) or 0),
+    }
 
 
 class GrokResponsesClient:
@@ -26,17 +50,35 @@ class GrokResponsesClient:
         nexus_mcp_url: str = "",
         nexus_auth_token: str = "",
         anthropic_api_key: str = "",
+        http_client: httpx.AsyncClient | None = None,
+        max_tool_rounds: int = 3,
+        tool_timeout: float = 120.0,
+        scheduler: ConcurrencyScheduler | None = None,
+        retry_policy: RetryPolicy | None = None,
     ) -> None:
         self.api_key = api_key
         self.nexus_mcp_url = nexus_mcp_url
         self.nexus_auth_token = nexus_auth_token
         self.anthropic_api_key = anthropic_api_key
-
-        self._client = httpx.AsyncClient(
-            timeout=httpx.Timeout(connect=15.0, read=180.0, write=30.0, pool=15.0),
-            headers={"Authorization": f"Bearer {api_key}"},
+        self.max_tool_rounds = max_tool_rounds
+        self.tool_timeout = tool_timeout
+
+        # Auth and timeout go on every request so a shared pooled client can be injected
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._timeout = httpx.Timeout(connect=15.0, read=180.0, write=30.0, pool=15.0)
+        self._owns_client = http_client is None
+        self._client = http_client or create_http_client("xai", timeout=self._timeout)
+        # Persistent pool for the ask_claude bridge (no TCP+TLS setup per call)
+        self._anthropic: httpx.AsyncClient | None = (
+            create_http_client(
+                "anthropic",
+                timeout=httpx.Timeout(connect=15.0, read=60.0, write=30.0, pool=15.0),
+            )
+            if anthropic_api_key
+            else None
         )
-        self._semaphore = asyncio.Semaphore(5)
+        self._scheduler = scheduler or get_concurrency_scheduler()
+        self._retry_policy = retry_policy or RetryPolicy()
 
     # ------------------------------------------------------------------
     # Tools definition
@@ -82,15 +124,21 @@ class GrokResponsesClient:
     # Claude bridge
     # ------------------------------------------------------------------
 
-    async def _execute_ask_claude(self, prompt: str) -> str:
-        """Call Anthropic claude-sonnet-4-20250514 and return text response."""
-        if not self.anthropic_api_key:
-            return "[ask_claude] ANTHROPIC_API_KEY not configured."
+    async def _stream_ask_claude(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Stream text deltas from Anthropic claude-sonnet-4-20250514.
+
+        Retries only until the first delta arrives — after that a retry would
+        duplicate output the caller has already surfaced.
+        """
+        if self._anthropic is None:
+            yield "[ask_claude] ANTHROPIC_API_KEY not configured."
+            return
 
         payload = {
             "model": "claude-sonnet-4-20250514",
             "max_tokens": 4096,
             "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
         }
         headers = {
             "x-api-key": self.anthropic_api_key,
@@ -98,21 +146,52 @@ class GrokResponsesClient:
             "content-type": "application/json",
         }
 
-        last_error: Exception | None = None
-        for attempt in range(_MAX_RETRIES):
+        retry = self._retry_policy.start()
+        while True:
+            started = False
             try:
-                async with httpx.AsyncClient(timeout=httpx.Timeout(120.0)) as ac:
-                    resp = await ac.post(_ANTHROPIC_API_URL, json=payload, headers=headers)
-                resp.raise_for_status()
-                data = resp.json()
-                return data["content"][0]["text"]
+                async with self._anthropic.stream(
+                    "POST", _ANTHROPIC_API_URL, json=payload, headers=headers
+                ) as resp:
+                    if resp.status_code != 200:
+                        err = await resp.aread()
+                        raise httpx.HTTPStatusError(
+                            f"HTTP {resp.status_code}: {err.decode(errors='replace')}",
+                            request=resp.request,
+                            response=resp,
+                        )
+                    async for event in aiter_sse_json(resp):
+                        etype = event.get("type", "")
+                        if etype == "content_block_delta":
+                            delta = event.get("delta", {})
+                            if delta.get("type") == "text_delta" and delta.get("text"):
+                                started = True
+                                yield delta["text"]
+                        elif etype == "error":
+                            error = event.get("error", {})
+                            message = error.get("message", "stream error")
+                            if error.get("type") in _ANTHROPIC_RETRYABLE_ERRORS:
+                                raise RetryableError(message)
+                            raise RuntimeError(message)
+                        elif etype == "message_stop":
+                            break
+                return
             except Exception as exc:
-                last_error = exc
-                logger.warning("ask_claude_retry", attempt=attempt + 1, error=str(exc))
-                if attempt < _MAX_RETRIES - 1:
-                    await asyncio.sleep(_RETRY_DELAYS[attempt])
+                if started:
+                    logger.warning("ask_claude_stream_interrupted", error=str(exc))
+                    yield f"\n[ask_claude] Stream interrupted: {exc}"
+                    return
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("ask_claude_failed", attempts=retry.attempt + 1, error=str(exc))
+                    yield f"[ask_claude] Error after {retry.attempt + 1} attempt(s): {exc}"
+                    return
+                logger.warning("ask_claude_retry", attempt=retry.attempt, delay=round(delay, 2), error=str(exc))
+                await asyncio.sleep(delay)
 
-        return f"[ask_claude] Error after {_MAX_RETRIES} retries: {last_error}"
+    async def _execute_ask_claude(self, prompt: str) -> str:
+        """Call Anthropic claude-sonnet-4-20250514 and return the full text response."""
+        return "".join([delta async for delta in self._stream_ask_claude(prompt)])
 
     # ------------------------------------------------------------------
     # Internal helpers
@@ -173,146 +252,241 @@ class GrokResponsesClient:
         reasoning_effort: str | None = None,  # kept for API compat, ignored for Grok 4
         tools: list | None = None,  # kept for compat, use nexus_mcp_url instead
         search: dict | None = None,
+        previous_response_id: str | None = None,
+        store: bool | None = None,
+        chain_tokens: int = 0,
     ) -> AsyncGenerator[tuple[str, Any], None]:
         """Yield (event_type, data) from Responses API SSE stream.
 
-        event_type values: 'reasoning', 'content', 'tool_call', 'done'
+        With *previous_response_id* the server continues that stored
+        conversation, so *messages* only needs the system prompt and the new
+        turn.  *store* asks xAI to keep the response for later chaining, and
+        *chain_tokens* (the chain's estimated size) is added to the rate-limit
+        admission estimate.
+
+        event_type values: 'reasoning', 'content', 'tool_call',
+        'tool_progress' (``{"name", "delta"}`` partial tool output),
+        'restart' (``{"content": n, "reasoning": m}`` characters to drop after
+        a retried round diverged from already-delivered text),
+        'response' (``{"id"}`` of the final stored response), 'done'
+
+        Function calls requested by the model are executed concurrently and
+        their outputs sent back in a single follow-up request, for up to
+        ``max_tool_rounds`` rounds.  ``done`` carries usage summed over rounds.
         """
         body = self._build_payload(
             messages, model, max_tokens, stream=True, include_tools=True
         )
+        if previous_response_id:
+            body["previous_response_id"] = previous_response_id
+        if store is not None:
+            body["store"] = store
+        usage: dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "reasoning_tokens": 0,
+            "cached_tokens": 0,
+        }
+        response_id = ""
 
-        pending_tool_calls: dict[str, dict[str, Any]] = {}
-        completed_tool_calls: list[dict[str, Any]] = []
-        usage: dict[str, int] = {}
-        function_call_output_items: list[dict[str, Any]] = []
+        for round_no in range(self.max_tool_rounds + 1):
+            tool_calls: list[dict[str, Any]] = []
+            async for evt, dat in self._stream_round(body, tool_calls, usage, chain_tokens):
+                if evt == "response":
+                    response_id = dat["id"]
+                    continue
+                yield evt, dat
+
+            if not tool_calls:
+                break
+            if round_no == self.max_tool_rounds:
+                logger.warning("responses_tool_rounds_exhausted", rounds=round_no, pending=len(tool_calls))
+                break
+
+            outputs: list[str] = []
+            async for evt, dat in self._run_tool_calls(tool_calls, outputs):
+                yield evt, dat
+
+            # Follow-up: the same input plus every call and its output, in order
+            for tc, output in zip(tool_calls, outputs):
+                body["input"].append({
+                    "type": "function_call",
+                    "call_id": tc["call_id"],
+                    "name": tc["name"],
+                    "arguments": tc["arguments"],
+                })
+                body["input"].append({
+                    "type": "function_call_output",
+                    "call_id": tc["call_id"],
+                    "output": output,
+                })
 
-        last_error: Exception | None = None
+        if response_id:
+            yield "response", {"id": response_id}
+        yield "done", usage
 
-        for attempt in range(_MAX_RETRIES):
-            rate_limited = False
+    async def _stream_round(
+        self,
+        body: dict[str, Any],
+        tool_calls: list[dict[str, Any]],
+        usage: dict[str, int],
+        chain_tokens: int = 0,
+    ) -> AsyncGenerator[tuple[str, Any], None]:
+        """Stream one Responses request, collecting function calls into *tool_calls*."""
+        pending_tool_calls: dict[str, dict[str, Any]] = {}
+        retry = self._retry_policy.start()
+        guard = ResumeGuard()
+        estimate = chain_tokens + input_tokens(body.get("input"))
+
+        while True:
+            calls_before = len(tool_calls)
             try:
-                async with self._semaphore:
+                async with self._scheduler.slot("/responses", body["model"], tokens=estimate) as admission:
                     async with self._client.stream(
-                        "POST", _XAI_RESPONSES_URL, json=body
+                        "POST",
+                        _XAI_RESPONSES_URL,
+                        json=body,
+                        headers=self._headers,
+                        timeout=self._timeout,
                     ) as response:
-                        if response.status_code == 429:
-                            await response.aread()
-                            rate_limited = True
-                        elif response.status_code != 200:
+                        admission.observe(response.headers)
+                        if response.status_code != 200:
                             err = await response.aread()
                             raise httpx.HTTPStatusError(
                                 f"HTTP {response.status_code}: {err.decode(errors='replace')}",
                                 request=response.request,
                                 response=response,
                             )
-                        else:
-                            async for line in response.aiter_lines():
-                                line = line.strip()
-                                if not line or not line.startswith("data:"):
-                                    continue
-                                data_str = line[5:].strip()
-                                if data_str == "[DONE]":
-                                    break
-                                try:
-                                    chunk = json.loads(data_str)
-                                except json.JSONDecodeError:
-                                    continue
-
-                                ctype = chunk.get("type", "")
-
-                                if ctype == "response.output_text.delta":
-                                    yield "content", chunk.get("delta", "")
-
-                                elif ctype == "response.reasoning_summary_text.delta":
-                                    yield "reasoning", chunk.get("delta", "")
-
-                                elif ctype == "response.output_item.added":
-                                    item = chunk.get("item", {})
-                                    if item.get("type") == "function_call":
-                                        item_id = item.get("id", "")
-                                        pending_tool_calls[item_id] = {
-                                            "id": item_id,
-                                            "call_id": item.get("call_id", item_id),
-                                            "name": item.get("name", ""),
-                                            "arguments": "",
-                                        }
-
-                                elif ctype == "response.function_call_arguments.delta":
-                                    item_id = chunk.get("item_id", "")
-                                    if item_id in pending_tool_calls:
-                                        pending_tool_calls[item_id]["arguments"] += chunk.get("delta", "")
-
-                                elif ctype == "response.function_call_arguments.done":
-                                    item_id = chunk.get("item_id", "")
-                                    if item_id in pending_tool_calls:
-                                        tc = pending_tool_calls[item_id]
-                                        tc["arguments"] = chunk.get("arguments", tc["arguments"])
-                                        completed_tool_calls.append(tc)
-                                        yield "tool_call", {"name": tc["name"]}
-
-                                elif ctype == "response.done":
-                                    resp_data = chunk.get("response", {})
-                                    u = resp_data.get("usage", {})
-                                    usage = {
-                                        "prompt_tokens": u.get("input_tokens", 0),
-                                        "completion_tokens": u.get("output_tokens", 0),
-                                        "reasoning_tokens": u.get("reasoning_tokens", 0),
+                        async for chunk in aiter_sse_json(response):
+                            ctype = chunk.get("type", "")
+
+                            if ctype == "response.output_text.delta":
+                                for event in guard.feed("content", chunk.get("delta", "")):
+                                    yield event
+
+                            elif ctype == "response.reasoning_summary_text.delta":
+                                for event in guard.feed("reasoning", chunk.get("delta", "")):
+                                    yield event
+
+                            elif ctype == "response.output_item.added":
+                                item = chunk.get("item", {})
+                                if item.get("type") == "function_call":
+                                    item_id = item.get("id", "")
+                                    pending_tool_calls[item_id] = {
+                                        "id": item_id,
+                                        "call_id": item.get("call_id", item_id),
+                                        "name": item.get("name", ""),
+                                        "arguments": "",
                                     }
 
-                            # ---- handle ask_claude tool calls ----
-                            for tc in completed_tool_calls:
-                                if tc["name"] == "ask_claude":
-                                    try:
-                                        args = json.loads(tc["arguments"] or "{}")
-                                    except json.JSONDecodeError:
-                                        args = {}
-                                    prompt_text = args.get("prompt", "")
-                                    logger.info("ask_claude_called", prompt_len=len(prompt_text))
-                                    claude_result = await self._execute_ask_claude(prompt_text)
-
-                                    # Build follow-up with tool result
-                                    followup_messages = list(messages) + [
-                                        {
-                                            "role": "assistant",
-                                            "content": "",
-                                            "tool_calls": [{
-                                                "id": tc["call_id"],
-                                                "type": "function",
-                                                "function": {
-                                                    "name": tc["name"],
-                                                    "arguments": tc["arguments"],
-                                                },
-                                            }],
-                                        },
-                                        {
-                                            "role": "tool",
-                                            "call_id": tc["call_id"],
-                                            "content": claude_result,
-                                        },
-                                    ]
-                                    async for evt, dat in self.chat_stream(
-                                        followup_messages, model, max_tokens
-                                    ):
-                                        yield evt, dat
-                                    return
-
-                            yield "done", usage
-                            return
-
-                if rate_limited:
-                    logger.warning("responses_rate_limited", attempt=attempt + 1)
-                    await asyncio.sleep(5.0 if attempt == 0 else _RETRY_DELAYS[attempt])
+                            elif ctype == "response.function_call_arguments.delta":
+                                item_id = chunk.get("item_id", "")
+                                if item_id in pending_tool_calls:
+                                    pending_tool_calls[item_id]["arguments"] += chunk.get("delta", "")
+
+                            elif ctype == "response.function_call_arguments.done":
+                                item_id = chunk.get("item_id", "")
+                                if item_id in pending_tool_calls:
+                                    tc = pending_tool_calls.pop(item_id)
+                                    tc["arguments"] = chunk.get("arguments", tc["arguments"])
+                                    tool_calls.append(tc)
+                                    yield "tool_call", {"name": tc["name"]}
+
+                            elif ctype == "response.done":
+                                resp_data = chunk.get("response", {})
+                                if resp_data.get("id"):
+                                    yield "response", {"id": resp_data["id"]}
+                                round_usage = _parse_usage(resp_data.get("usage"))
+                                for key, value in round_usage.items():
+                                    usage[key] += value
+                                admission.settle(usage_tokens(round_usage))
+                        for event in guard.finish():
+                            yield event
+                        return
+
+            except Exception as exc:
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("responses_stream_failed", attempts=retry.attempt + 1, error=str(exc))
+                    raise
+                logger.warning(
+                    "responses_stream_retry",
+                    attempt=retry.attempt,
+                    delay=round(delay, 2),
+                    resumed=guard.has_output,
+                    error=str(exc),
+                )
+                # The retry regenerates this round from scratch
+                del tool_calls[calls_before:]
+                pending_tool_calls.clear()
+                guard.retry()
+                await asyncio.sleep(delay)
+
+    # ------------------------------------------------------------------
+    # Tool execution
+    # ------------------------------------------------------------------
+
+    async def _run_tool_calls(
+        self,
+        tool_calls: list[dict[str, Any]],
+        outputs: list[str],
+    ) -> AsyncGenerator[tuple[str, Any], None]:
+        """Run *tool_calls* concurrently, yielding their progress events.
+
+        Results are appended to *outputs* in call order once all have finished
+        (each one bounded by ``tool_timeout``).
+        """
+        progress: asyncio.Queue[tuple[str, Any] | None] = asyncio.Queue()
 
+        async def run_one(tc: dict[str, Any]) -> str:
+            try:
+                return await asyncio.wait_for(
+                    self._execute_tool(tc, progress), timeout=self.tool_timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning("tool_call_timeout", tool=tc["name"], timeout=self.tool_timeout)
+                return f"[{tc['name']}] Timeout after {self.tool_timeout:.0f}s"
             except Exception as exc:
-                last_error = exc
-                logger.warning("responses_stream_retry", attempt=attempt + 1, error=str(exc))
-                if attempt < _MAX_RETRIES - 1:
-                    await asyncio.sleep(_RETRY_DELAYS[attempt])
+                logger.exception("tool_call_failed", tool=tc["name"])
+                return f"[{tc['name']}] Error: {exc}"
 
-        err = last_error or RuntimeError("xAI Responses API — all retries exhausted")
-        logger.error("responses_stream_failed", error=str(err))
-        raise err
+        async def run_all() -> list[str]:
+            try:
+                return await asyncio.gather(*(run_one(tc) for tc in tool_calls))
+            finally:
+                progress.put_nowait(None)
+
+        task = asyncio.create_task(run_all())
+        try:
+            while (event := await progress.get()) is not None:
+                yield event
+            outputs.extend(await task)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _execute_tool(
+        self,
+        tc: dict[str, Any],
+        progress: asyncio.Queue[tuple[str, Any] | None],
+    ) -> str:
+        """Execute one function call and return its output string."""
+        try:
+            args = json.loads(tc["arguments"] or "{}")
+        except json.JSONDecodeError:
+            args = {}
+
+        if tc["name"] == "ask_claude":
+            prompt_text = args.get("prompt", "")
+            logger.info("ask_claude_called", prompt_len=len(prompt_text))
+            parts: list[str] = []
+            async for delta in self._stream_ask_claude(prompt_text):
+                parts.append(delta)
+                progress.put_nowait(("tool_progress", {"name": tc["name"], "delta": delta}))
+            return "".join(parts)
+
+        logger.warning("unknown_tool_call", tool=tc["name"])
+        return f"[{tc['name']}] Unknown tool"
 
     # ------------------------------------------------------------------
     # Non-streaming (fallback / simple queries)
@@ -332,14 +506,18 @@ class GrokResponsesClient:
             messages, model, max_tokens, stream=False, include_tools=False
         )
 
-        last_error: Exception | None = None
-        for attempt in range(_MAX_RETRIES):
+        retry = self._retry_policy.start()
+        estimate = input_tokens(body.get("input"))
+        while True:
             try:
-                async with self._semaphore:
-                    resp = await self._client.post(_XAI_RESPONSES_URL, json=body)
-                if resp.status_code == 429:
-                    await asyncio.sleep(_RETRY_DELAYS[min(attempt, 2)])
-                    continue
+                async with self._scheduler.slot("/responses", model, tokens=estimate) as admission:
+                    resp = await self._client.post(
+                        _XAI_RESPONSES_URL,
+                        json=body,
+                        headers=self._headers,
+                        timeout=self._timeout,
+                    )
+                    admission.observe(resp.headers)
                 resp.raise_for_status()
                 data = resp.json()
                 text = ""
@@ -348,22 +526,19 @@ class GrokResponsesClient:
                         for part in item.get("content", []):
                             if part.get("type") == "output_text":
                                 text += part.get("text", "")
-                u = data.get("usage", {})
-                return {
-                    "content": text,
-                    "usage": {
-                        "prompt_tokens": u.get("input_tokens", 0),
-                        "completion_tokens": u.get("output_tokens", 0),
-                        "reasoning_tokens": u.get("reasoning_tokens", 0),
-                    },
-                }
+                usage = _parse_usage(data.get("usage"))
+                admission.settle(usage_tokens(usage))
+                return {"content": text, "usage": usage}
             except Exception as exc:
-                last_error = exc
-                logger.warning("responses_chat_retry", attempt=attempt + 1, error=str(exc))
-                if attempt < _MAX_RETRIES - 1:
-                    await asyncio.sleep(_RETRY_DELAYS[attempt])
-
-        raise last_error or RuntimeError("Unexpected: no response")
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    logger.error("responses_chat_failed", attempts=retry.attempt + 1, error=str(exc))
+                    raise
+                logger.warning("responses_chat_retry", attempt=retry.attempt, delay=round(delay, 2), error=str(exc))
+                await asyncio.sleep(delay)
 
     async def close(self) -> None:
-        await self._client.aclose()
+        if self._anthropic is not None:
+            await self._anthropic.aclose()
+        if self._owns_client:
+            await self._client.aclose()
@@ -14,6 +14,7 @@ from db import (
     list_dynamic_users,
     remove_dynamic_user,
 )
+from response_cache import get_response_cache
 from utils import check_access
 
 logger = structlog.get_logger(__name__)
@@ -146,3 +147,48 @@ async def removeuser_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         f"✅ Usunięto użytkownika <code>{target_user_id}</code>.",
         parse_mode="HTML",
     )
+
+
+_CACHEABLE_COMMANDS: tuple[str, ...] = ("websearch", "xsearch", "collectionsearch", "fast")
+
+
+async def cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /cache [purge [command]] - response cache status / purge (admin only)."""
+    if not update.effective_user or not update.message:
+        return
+    if not await check_access(update, settings):
+        return
+
+    admin_user_id = update.effective_user.id
+    if not settings.is_admin(admin_user_id):
+        await update.message.reply_text("⛔ Ta komenda jest tylko dla admina.")
+        return
+
+    cache = get_response_cache()
+    args = [arg.strip().lower().lstrip("/") for arg in (context.args or [])]
+    if not args:
+        status = cache.status()
+        ttls = ", ".join(f"/{cmd} {int(cache.ttl_for(cmd))}s" for cmd in _CACHEABLE_COMMANDS)
+        await update.message.reply_text(
+            "♻️ <b>Cache odpowiedzi</b>\n"
+            f"Wpisy w pamięci: {status['entries']}/{status['max_entries']}\n"
+            f"Trafienia: {status['hits'] + status['db_hits']} "
+            f"(z bazy: {status['db_hits']}), chybienia: {status['misses']} "
+            f"— {status['hit_rate']:.0%}\n"
+            f"TTL: {ttls}\n\n"
+            "Użycie: /cache purge [komenda]",
+            parse_mode="HTML",
+        )
+        return
+
+    if args[0] != "purge" or (len(args) > 1 and args[1] not in _CACHEABLE_COMMANDS):
+        await update.message.reply_text(
+            "Użycie: /cache purge [" + "|".join(_CACHEABLE_COMMANDS) + "]"
+        )
+        return
+
+    command = args[1] if len(args) > 1 else None
+    removed = await cache.purge(command)
+    logger.info("response_cache_purge_command", admin_user_id=admin_user_id, command=command, removed=removed)
+    scope = f"/{command}" if command else "wszystkich komend"
+    await update.message.reply_text(f"🧹 Wyczyszczono cache {scope}: {removed} wpisów.")
@@ -4,28 +4,17 @@ from __future__ import annotations
 
 import time
 import structlog
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import ContextTypes
 
-from config import DEFAULT_SYSTEM_PROMPT, settings
-from db import (
-    calculate_cost,
-    get_history,
-    get_user_setting,
-    save_message_pair_and_stats,
-)
+from config import settings
+from context_builder import ChatContext, build_chat_context, stream_chat
 from fallback import DegradationLevel, FallbackManager
 from grok_responses_client import GrokResponsesClient
 from model_router import ModelRouter, classify_query, complexity_to_profile
-from rate_limiter import RateLimiter
-from utils import (
-    check_access,
-    escape_html,
-    format_footer,
-    get_current_date,
-    markdown_to_telegram_html,
-    split_message,
-)
+from rate_limiter import RateLimiter, Reservation
+from streaming import StreamRenderer
+from utils import check_access, escape_html, format_footer
 
 logger = structlog.get_logger(__name__)
 _PENDING_FILE_KEY = "pending_workspace_file_context"
@@ -74,89 +63,71 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             _, selected_model = result
             logger.info("model_selected", model=selected_model)
 
-    # --- Rate limiter: check quota before calling API ---
+    # 2-4. System prompt + history (or server-side chain) + new turn
+    chat_context = await build_chat_context(user_id, query)
+
+    # --- Fallback: truncate context if in degraded mode ---
+    if fallback_mgr:
+        chat_context.messages = fallback_mgr.truncate_for_degradation(chat_context.messages)
+
+    # --- Rate limiter: hold the worst case before calling the API ---
+    reservation: Reservation | None = None
     if limiter:
-        ok, reason = await limiter.check_and_acquire(user_id, selected_model)
-        if not ok:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            selected_model,
+            prompt_tokens=chat_context.estimated_tokens,
+            max_tokens=settings.max_output_tokens,
+        )
+        if reservation is None:
             await update.message.reply_text(
                 f"⏳ {escape_html(reason)}", parse_mode="HTML",
             )
             return
 
-    # 2. History
-    history = await get_history(user_id, limit=settings.max_history)
-
-    # 3. System prompt
-    custom_prompt = await get_user_setting(user_id, "system_prompt")
-    system_prompt = custom_prompt or DEFAULT_SYSTEM_PROMPT.format(
-        current_date=get_current_date()
-    )
-
-    # 4. Build messages
-    messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": query})
-
-    # --- Fallback: truncate context if in degraded mode ---
-    if fallback_mgr:
-        messages = fallback_mgr.truncate_for_degradation(messages)
-
+    try:
+        await _answer(
+            update.message, user_id, raw_query, chat_context, selected_model, fallback_mgr,
+            limiter, reservation,
+        )
+    finally:
+        if limiter:
+            limiter.release(reservation)
+
+
+async def _answer(
+    message: Message,
+    user_id: int,
+    raw_query: str,
+    chat_context: ChatContext,
+    selected_model: str,
+    fallback_mgr: FallbackManager | None,
+    limiter: RateLimiter | None,
+    reservation: Reservation | None,
+) -> None:
+    """Stream the answer for *chat_context* and settle *reservation* once it is persisted."""
     # 5. Placeholder
-    sent = await update.message.reply_text("🧠 <i>Grok myśli...</i>", parse_mode="HTML")
+    sent = await message.reply_text("🧠 <i>Grok myśli...</i>", parse_mode="HTML")
+    renderer = StreamRenderer(
+        sent,
+        message,
+        name="chat",
+        reasoning_status="🧠 <i>Grok myśli... ({chars} znaków reasoning)</i>",
+        tool_status=lambda tool: f"🧠 <i>Grok używa narzędzia: {escape_html(tool)}...</i>",
+    )
 
     # 6. Stream — NOTE: no reasoning_effort (Grok 4 /v1/responses rejects it → HTTP 400)
     start_time = time.time()
-    full_content = ""
-    full_reasoning = ""
-    usage: dict[str, int] = {}
-    last_edit = 0.0
 
     try:
-        async for event_type, data in _grok.chat_stream(
-            messages,
-            model=selected_model,
-            max_tokens=settings.max_output_tokens,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += data
-                now = time.time()
-                if now - last_edit > 2.0:
-                    try:
-                        await sent.edit_text(
-                            f"🧠 <i>Grok myśli... ({len(full_reasoning)} znaków reasoning)</i>",
-                            parse_mode="HTML",
-                        )
-                    except Exception:
-                        pass
-                    last_edit = now
-
-            elif event_type == "content":
-                full_content += data
-                now = time.time()
-                if now - last_edit > 1.5:
-                    display = escape_html(full_content[:3800])
-                    if len(full_content) > 3800:
-                        display += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await sent.edit_text(display, parse_mode="HTML")
-                    except Exception:
-                        pass
-                    last_edit = now
-
-            elif event_type == "tool_call":
-                tool_name = data.get("name", "tool") if isinstance(data, dict) else str(data)
-                try:
-                    await sent.edit_text(
-                        f"🧠 <i>Grok używa narzędzia: {escape_html(tool_name)}...</i>",
-                        parse_mode="HTML",
-                    )
-                except Exception:
-                    pass
-
-            elif event_type == "done":
-                usage = data
-
+        result = await renderer.consume(
+            stream_chat(
+                _grok,
+                chat_context,
+                model=selected_model,
+                max_tokens=settings.max_output_tokens,
+            )
+        )
     except Exception as exc:
         logger.error("grok_api_error", error=str(exc), model=selected_model)
 
@@ -167,11 +138,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
             # If all models down → minimal response
             if fallback_mgr.level == DegradationLevel.MINIMAL:
-                result = fallback_mgr.get_minimal_response(raw_query)
-                await sent.edit_text(result.content, parse_mode="HTML")
+                minimal = fallback_mgr.get_minimal_response(raw_query)
+                await renderer.fail(minimal.content)
                 return
 
-        await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
+        await renderer.fail(f"❌ Błąd API: {escape_html(str(exc))}")
         return
 
     # --- Success: record in circuit breaker ---
@@ -181,10 +152,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # 7. Footer
     elapsed = time.time() - start_time
-    tokens_in = usage.get("prompt_tokens", 0)
-    tokens_out = usage.get("completion_tokens", 0)
-    reasoning_tokens = usage.get("reasoning_tokens", 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
+    tokens_in = result.tokens_in
+    tokens_out = result.tokens_out
+    reasoning_tokens = result.reasoning_tokens
+    cost = result.cost
 
     footer = format_footer(
         selected_model,
@@ -195,38 +166,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         elapsed,
     )
 
-    # --- Rate limiter: record actual usage ---
-    if limiter:
-        total_tokens = tokens_in + tokens_out + reasoning_tokens
-        limiter.record_usage(user_id, total_tokens, cost)
-
     # 8. Final message (split if needed)
-    final_text = f"{markdown_to_telegram_html(full_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
-
-    try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
-
-    for part in parts[1:]:
-        try:
-            await update.message.reply_text(part, parse_mode="HTML")
-        except Exception:
-            logger.exception("send_part_failed")
+    await renderer.finish(footer)
 
     # 9. Persist
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=raw_query,
-        assistant_content=full_content,
-        reasoning_content=full_reasoning,
-        model=selected_model,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
+    saved = await renderer.persist(user_id, user_content=raw_query, model=selected_model, chained=True)
+    if limiter and reservation:
+        limiter.commit_after_save(reservation, saved, result.total_tokens, cost)
 
     logger.info(
         "message_complete",
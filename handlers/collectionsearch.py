@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import json
 import time
 from typing import Any
 
@@ -11,7 +12,8 @@ from telegram.ext import ContextTypes
 
 from config import settings
 from grok_client import GrokClient
-from utils import check_access, escape_html, markdown_to_telegram_html, split_message
+from response_cache import get_response_cache, make_cache_key
+from utils import check_access, escape_html, markdown_to_telegram_html, split_html_message
 
 logger = structlog.get_logger(__name__)
 
@@ -64,20 +66,31 @@ async def collectionsearch_command(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("❌ Brak skonfigurowanej kolekcji (XAI_COLLECTION_ID).")
         return
 
-    grok: GrokClient | None = context.application.bot_data.get("grok_client")
+    # /documents/search lives on the chat-completions client, not the Responses one
+    grok: GrokClient | None = context.application.bot_data.get("grok_documents_client")
     if grok is None:
         await update.message.reply_text("❌ Klient Grok nie został zainicjalizowany.")
         return
 
     sent = await update.message.reply_text("📚 Szukam w kolekcji…")
     start_time = time.time()
+    cache = get_response_cache()
+    cache_key = make_cache_key("collectionsearch", collection_id, query)
 
     try:
-        results = await grok.search_collection(
-            collection_id=collection_id,
-            query=query,
-            max_results=10,
-        )
+        cached = await cache.get("collectionsearch", cache_key)
+        if cached is not None:
+            results: list[dict[str, Any]] = json.loads(cached.content)
+        else:
+            results = await grok.search_collection(
+                collection_id=collection_id,
+                query=query,
+                max_results=10,
+            )
+            if results:
+                await cache.put(
+                    "collectionsearch", cache_key, json.dumps(results, ensure_ascii=False), collection_id
+                )
     except Exception as exc:
         logger.error("collectionsearch_api_error", user_id=user_id, error=str(exc))
         await sent.edit_text(
@@ -88,10 +101,11 @@ async def collectionsearch_command(update: Update, context: ContextTypes.DEFAULT
 
     elapsed = time.time() - start_time
     body = _format_results(results, query)
-    footer = f"\n\n<code>📚 kolekcja | ⏱ {elapsed:.1f}s | wyników: {len(results)}</code>"
+    cache_flag = " | ♻️ z cache" if cached is not None else ""
+    footer = f"\n\n<code>📚 kolekcja | ⏱ {elapsed:.1f}s | wyników: {len(results)}{cache_flag}</code>"
     final_text = f"{markdown_to_telegram_html(body)}{footer}"
 
-    parts = split_message(final_text, max_length=4000)
+    parts = split_html_message(final_text, max_length=4000)
     try:
         await sent.edit_text(parts[0], parse_mode="HTML")
     except Exception:
@@ -107,5 +121,6 @@ async def collectionsearch_command(update: Update, context: ContextTypes.DEFAULT
         user_id=user_id,
         query=query,
         results_count=len(results),
+        cached=cached is not None,
         elapsed=round(elapsed, 2),
     )
@@ -3,29 +3,28 @@
 from __future__ import annotations
 
 import time
+from typing import Any
+
 import structlog
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import DEFAULT_SYSTEM_PROMPT, PERSONALITY_PROFILES, settings
+from config import PERSONALITY_PROFILES, settings
+from context_builder import build_chat_context, default_system_prompt, stream_chat
 from db import (
-    calculate_cost,
     clear_history,
-    get_history,
-    get_user_setting,
+    get_user_settings,
     get_user_stats_combined,
-    save_message_pair_and_stats,
     set_user_setting,
 )
 from grok_client import GrokClient
+from rate_limiter import RateLimiter, Reservation
+from streaming import StreamRenderer
 from utils import (
     check_access,
     escape_html,
     format_footer,
     format_number,
-    get_current_date,
-    markdown_to_telegram_html,
-    split_message,
 )
 
 logger = structlog.get_logger(__name__)
@@ -60,6 +59,15 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text("❌ Nie udało się wyczyścić historii.")
 
 
+def _cache_hit_rate(stats: dict[str, Any]) -> str:
+    """Share of input tokens served from the provider's prompt cache."""
+    tokens_in = int(stats.get("total_tokens_in", 0) or 0)
+    cached = int(stats.get("total_cached_tokens", 0) or 0)
+    if not tokens_in:
+        return "—"
+    return f"{cached / tokens_in:.0%} ({format_number(cached)})"
+
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /stats — show usage statistics."""
     if not update.effective_user or not update.message:
@@ -79,6 +87,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             f"  Tokeny IN: <b>{format_number(today.get('total_tokens_in', 0))}</b>",
             f"  Tokeny OUT: <b>{format_number(today.get('total_tokens_out', 0))}</b>",
             f"  Reasoning: <b>{format_number(today.get('total_reasoning_tokens', 0))}</b>",
+            f"  Cache promptu: <b>{_cache_hit_rate(today)}</b>",
+            f"  Odpowiedzi z cache: <b>{today.get('total_cache_hits', 0) or 0}</b>",
             f"  Koszt: <b>${today.get('total_cost_usd', 0.0):.4f}</b>",
             "",
             "🌍 <b>Ogółem:</b>",
@@ -86,6 +96,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             f"  Tokeny IN: <b>{format_number(alltime.get('total_tokens_in', 0))}</b>",
             f"  Tokeny OUT: <b>{format_number(alltime.get('total_tokens_out', 0))}</b>",
             f"  Reasoning: <b>{format_number(alltime.get('total_reasoning_tokens', 0))}</b>",
+            f"  Cache promptu: <b>{_cache_hit_rate(alltime)}</b>",
+            f"  Odpowiedzi z cache: <b>{alltime.get('total_cache_hits', 0) or 0}</b>",
             f"  Koszt: <b>${alltime.get('total_cost_usd', 0.0):.4f}</b>",
         ]
         await update.message.reply_text("\n".join(lines), parse_mode="HTML")
@@ -112,7 +124,7 @@ async def system_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         if not args_text:
-            current = await get_user_setting(user_id, "system_prompt")
+            current = (await get_user_settings(user_id)).system_prompt
             if current:
                 display = escape_html(current[:2000])
                 await update.message.reply_text(
@@ -169,115 +181,75 @@ async def think_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     logger.info("think_command", user_id=user_id, query_len=len(query))
-    sent = await update.message.reply_text(
-        "🧠 <i>Myślę głęboko...</i>", parse_mode="HTML"
-    )
-    start_time = time.time()
+    chat_context = await build_chat_context(user_id, query, system_addon=_THINK_SYSTEM_ADDON)
+
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_reasoning,
+            prompt_tokens=chat_context.estimated_tokens,
+            max_tokens=settings.max_output_tokens,
+        )
+        if reservation is None:
+            await update.message.reply_text(f"⏳ {escape_html(reason)}", parse_mode="HTML")
+            return
 
     try:
-        history = await get_history(user_id, limit=settings.max_history)
-        custom_prompt = await get_user_setting(user_id, "system_prompt")
-        base_prompt = custom_prompt or DEFAULT_SYSTEM_PROMPT.format(
-            current_date=get_current_date()
+        sent = await update.message.reply_text(
+            "🧠 <i>Myślę głęboko...</i>", parse_mode="HTML"
         )
-        system_prompt = base_prompt + _THINK_SYSTEM_ADDON
-
-        messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
-        for msg in history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        messages.append({"role": "user", "content": query})
-
-        full_content = ""
-        full_reasoning = ""
-        usage: dict[str, int] = {}
-        last_edit = 0.0
-
-        async for event_type, data in grok.chat_stream(
-            messages=messages,
-            model=settings.xai_model_reasoning,
-            max_tokens=settings.max_output_tokens,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += str(data)
-                now = time.time()
-                if now - last_edit > 2.0:
-                    try:
-                        await sent.edit_text(
-                            f"🧠 <i>Myślę głęboko... ({len(full_reasoning)} znaków reasoning)</i>",
-                            parse_mode="HTML",
-                        )
-                    except Exception:
-                        pass
-                    last_edit = now
-            elif event_type == "content":
-                full_content += str(data)
-                now = time.time()
-                if now - last_edit > 1.5:
-                    display = markdown_to_telegram_html(full_content[:3800])
-                    if len(full_content) > 3800:
-                        display += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await sent.edit_text(display, parse_mode="HTML")
-                    except Exception:
-                        pass
-                    last_edit = now
-            elif event_type == "done":
-                usage = data if isinstance(data, dict) else {}
-
-    except Exception as exc:
-        logger.error("think_command_api_error", user_id=user_id, error=str(exc))
-        await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
-        return
-
-    elapsed = time.time() - start_time
-    tokens_in = int(usage.get("prompt_tokens", 0) or 0)
-    tokens_out = int(usage.get("completion_tokens", 0) or 0)
-    reasoning_tokens = int(usage.get("reasoning_tokens", 0) or 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-
-    footer = format_footer(
-        settings.xai_model_reasoning,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-    )
-
-    final_text = f"{markdown_to_telegram_html(full_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
+        renderer = StreamRenderer(
+            sent,
+            update.message,
+            name="think",
+            reasoning_status="🧠 <i>Myślę głęboko... ({chars} znaków reasoning)</i>",
+        )
+        start_time = time.time()
 
-    try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
-    for part in parts[1:]:
         try:
-            await update.message.reply_text(part, parse_mode="HTML")
-        except Exception:
-            logger.exception("think_command_send_part_failed", user_id=user_id)
-
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=query,
-        assistant_content=full_content,
-        reasoning_content=full_reasoning,
-        model=settings.xai_model_reasoning,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
-
-    logger.info(
-        "think_command_complete",
-        user_id=user_id,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost=cost,
-        elapsed=round(elapsed, 2),
-    )
+            result = await renderer.consume(
+                stream_chat(
+                    grok,
+                    chat_context,
+                    model=settings.xai_model_reasoning,
+                    max_tokens=settings.max_output_tokens,
+                )
+            )
+        except Exception as exc:
+            logger.error("think_command_api_error", user_id=user_id, error=str(exc))
+            await renderer.fail(f"❌ Błąd API: {escape_html(str(exc))}")
+            return
+
+        elapsed = time.time() - start_time
+        footer = format_footer(
+            settings.xai_model_reasoning,
+            result.tokens_in,
+            result.tokens_out,
+            result.reasoning_tokens,
+            result.cost,
+            elapsed,
+        )
+        await renderer.finish(footer)
+        saved = await renderer.persist(
+            user_id, user_content=query, model=settings.xai_model_reasoning, chained=True
+        )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, result.total_tokens, result.cost)
+
+        logger.info(
+            "think_command_complete",
+            user_id=user_id,
+            tokens_in=result.tokens_in,
+            tokens_out=result.tokens_out,
+            reasoning_tokens=result.reasoning_tokens,
+            cost=result.cost,
+            elapsed=round(elapsed, 2),
+        )
+    finally:
+        if limiter:
+            limiter.release(reservation)
 
 
 async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -323,11 +295,7 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
 
-        full_prompt = (
-            DEFAULT_SYSTEM_PROMPT.format(current_date=get_current_date())
-            + "\n\n"
-            + profile_prompt
-        )
+        full_prompt = default_system_prompt() + "\n\n" + profile_prompt
         await set_user_setting(user_id, "system_prompt", full_prompt)
         await update.message.reply_text(
             f"✅ Aktywowano profil: <b>{escape_html(args_text)}</b>",
@@ -10,18 +10,14 @@ from telegram import Message, Update
 from telegram.ext import ContextTypes
 
 from config import settings
-from db import calculate_cost, get_history, save_message_pair_and_stats
+from context_builder import history_within_budget
 from file_utils import image_to_base64
 from grok_client import GrokClient
+from rate_limiter import RateLimiter, Reservation
+from streaming import StreamRenderer
+from token_count import message_tokens
 from tools import build_stage2_tools
-from utils import (
-    check_access,
-    escape_html,
-    format_gigagrok_footer,
-    get_current_date,
-    markdown_to_telegram_html,
-    split_message,
-)
+from utils import check_access, escape_html, format_gigagrok_footer, get_current_date
 
 logger = structlog.get_logger(__name__)
 
@@ -129,125 +125,100 @@ async def gigagrok_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     user_content = await _build_user_message_content(context, reply, prompt)
 
     # Include recent conversation context
-    history = await get_history(user_id, limit=settings.gigagrok_context_messages)
+    history = await history_within_budget(
+        user_id,
+        settings.gigagrok_context_tokens,
+        max_messages=settings.gigagrok_context_messages,
+    )
     messages: list[dict[str, Any]] = [{"role": "system", "content": system_prompt}]
     for msg in history:
         messages.append({"role": msg["role"], "content": msg["content"]})
     messages.append({"role": "user", "content": user_content})
 
-    sent = await update.message.reply_text(
-        "🚀 <b>GIGAGROK MODE</b>\n🔄 Przetwarzam…",
-        parse_mode="HTML",
-    )
-    start_time = time.time()
-    full_content = ""
-    full_reasoning = ""
-    usage: dict[str, int] = {}
-    used_tools: list[str] = []
-    last_edit = 0.0
-
-    try:
-        async for event_type, data in grok.chat_stream(
-            messages=messages,
-            model=settings.xai_model_reasoning,
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_reasoning,
+            prompt_tokens=sum(message_tokens(m) for m in messages),
             max_tokens=settings.gigagrok_max_output_tokens,
-            tools=tools if tools else None,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += str(data)
-            elif event_type == "tool_use":
-                tool_name = str(data)
-                if tool_name and tool_name not in used_tools:
-                    used_tools.append(tool_name)
-                status_text = _TOOL_STATUS.get(tool_name, f"🛠 Używam: {tool_name}")
-                try:
-                    await sent.edit_text(
-                        f"🚀 <b>GIGAGROK MODE</b>\n{escape_html(status_text)}",
-                        parse_mode="HTML",
-                    )
-                except Exception:
-                    pass
-            elif event_type == "content":
-                full_content += str(data)
-                now = time.time()
-                if now - last_edit > 1.5:
-                    display = markdown_to_telegram_html(full_content[:3800])
-                    if len(full_content) > 3800:
-                        display += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await sent.edit_text(display, parse_mode="HTML")
-                    except Exception:
-                        pass
-                    last_edit = now
-            elif event_type == "done":
-                usage = data if isinstance(data, dict) else {}
-    except Exception as exc:
-        logger.error("gigagrok_command_api_error", user_id=user_id, error=str(exc))
-        await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
-        return
+        )
+        if reservation is None:
+            await update.message.reply_text(f"⏳ {escape_html(reason)}", parse_mode="HTML")
+            return
 
-    # Update status to final
     try:
-        await sent.edit_text(
-            "🚀 <b>GIGAGROK MODE</b>\n✅ Final…",
+        sent = await update.message.reply_text(
+            "🚀 <b>GIGAGROK MODE</b>\n🔄 Przetwarzam…",
             parse_mode="HTML",
         )
-    except Exception:
-        pass
-
-    elapsed = time.time() - start_time
-    tokens_in = int(usage.get("prompt_tokens", 0) or 0)
-    tokens_out = int(usage.get("completion_tokens", 0) or 0)
-    reasoning_tokens = int(usage.get("reasoning_tokens", 0) or 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-    footer = format_gigagrok_footer(
-        settings.xai_model_reasoning,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-        used_tools,
-    )
-    final_text = f"{markdown_to_telegram_html(full_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
+        renderer = StreamRenderer(
+            sent,
+            update.message,
+            name="gigagrok",
+            tool_status=lambda tool: (
+                "🚀 <b>GIGAGROK MODE</b>\n"
+                + escape_html(_TOOL_STATUS.get(tool, f"🛠 Używam: {tool}"))
+            ),
+        )
+        start_time = time.time()
 
-    try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
-    for part in parts[1:]:
         try:
-            await update.message.reply_text(part, parse_mode="HTML")
-        except Exception:
-            logger.exception("gigagrok_send_part_failed", user_id=user_id)
-
-    # Save text content to history (extract from multimodal if needed)
-    text_to_save = prompt
-    if isinstance(user_content, list):
-        for item in user_content:
-            if isinstance(item, dict) and item.get("type") == "text":
-                text_to_save = item.get("text", prompt)
-                break
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=text_to_save,
-        assistant_content=full_content,
-        reasoning_content=full_reasoning,
-        model=settings.xai_model_reasoning,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
+            result = await renderer.consume(
+                grok.chat_stream(
+                    messages=messages,
+                    model=settings.xai_model_reasoning,
+                    max_tokens=settings.gigagrok_max_output_tokens,
+                    tools=tools if tools else None,
+                )
+            )
+        except Exception as exc:
+            logger.error("gigagrok_command_api_error", user_id=user_id, error=str(exc))
+            await renderer.fail(f"❌ Błąd API: {escape_html(str(exc))}")
+            return
+
+        # Update status to final
+        await renderer.set_status("🚀 <b>GIGAGROK MODE</b>\n✅ Final…")
+
+        elapsed = time.time() - start_time
+        footer = format_gigagrok_footer(
+            settings.xai_model_reasoning,
+            result.tokens_in,
+            result.tokens_out,
+            result.reasoning_tokens,
+            result.cost,
+            elapsed,
+            result.tools_used,
+        )
+        await renderer.finish(footer)
+
+        # Save text content to history (extract from multimodal if needed)
+        text_to_save = prompt
+        if isinstance(user_content, list):
+            for item in user_content:
+                if isinstance(item, dict) and item.get("type") == "text":
+                    text_to_save = item.get("text", prompt)
+                    break
+        saved = await renderer.persist(
+            user_id,
+            user_content=text_to_save,
+            model=settings.xai_model_reasoning,
+        )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, result.total_tokens, result.cost)
+
+        logger.info(
+            "gigagrok_command_complete",
+            user_id=user_id,
+            tokens_in=result.tokens_in,
+            tokens_out=result.tokens_out,
+            reasoning_tokens=result.reasoning_tokens,
+            tools_used=result.tools_used,
+            cost=result.cost,
+            elapsed=round(elapsed, 2),
+        )
 
-    logger.info(
-        "gigagrok_command_complete",
-        user_id=user_id,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        tools_used=used_tools,
-        cost=cost,
-        elapsed=round(elapsed, 2),
-    )
+    finally:
+        if limiter:
+            limiter.release(reservation)
\ No newline at end of file
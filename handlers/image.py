@@ -10,10 +10,12 @@ from telegram import Message, Update
 from telegram.ext import ContextTypes
 
 from config import settings
-from db import calculate_cost, save_message_pair_and_stats
 from file_utils import image_to_base64
 from grok_client import GrokClient
-from utils import check_access, escape_html, format_footer, split_message
+from rate_limiter import RateLimiter, Reservation
+from streaming import StreamRenderer
+from token_count import message_tokens
+from utils import check_access, escape_html, format_footer
 
 logger = structlog.get_logger(__name__)
 
@@ -49,13 +51,6 @@ async def analyze_image_bytes(
         )
         return
 
-    sent = await update.message.reply_text("🖼 <i>Analizuję obraz...</i>", parse_mode="HTML")
-    start_time = time.time()
-    full_content = ""
-    full_reasoning = ""
-    usage: dict[str, int] = {}
-    last_edit = 0.0
-
     messages: list[dict[str, Any]] = [
         {
             "role": "user",
@@ -69,71 +64,58 @@ async def analyze_image_bytes(
         }
     ]
 
-    try:
-        async for event_type, data in grok.chat_stream(
-            messages=messages,
-            model=settings.xai_model_reasoning,
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_reasoning,
+            prompt_tokens=sum(message_tokens(m) for m in messages),
             max_tokens=settings.max_output_tokens,
-            reasoning_effort=settings.default_reasoning_effort,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += str(data)
-            elif event_type == "content":
-                full_content += str(data)
-                now = time.time()
-                if now - last_edit > 1.5:
-                    display = escape_html(full_content[:3800])
-                    if len(full_content) > 3800:
-                        display += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await sent.edit_text(display, parse_mode="HTML")
-                    except Exception:
-                        pass
-                    last_edit = now
-            elif event_type == "done":
-                usage = data if isinstance(data, dict) else {}
-    except Exception as exc:
-        logger.error("image_analysis_failed", user_id=user_id, error=str(exc))
-        await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
-        return
-
-    elapsed = time.time() - start_time
-    tokens_in = usage.get("prompt_tokens", 0)
-    tokens_out = usage.get("completion_tokens", 0)
-    reasoning_tokens = usage.get("reasoning_tokens", 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-    footer = format_footer(
-        settings.xai_model_reasoning,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-    )
-    final_text = f"{escape_html(full_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
+        )
+        if reservation is None:
+            await update.message.reply_text(f"⏳ {escape_html(reason)}", parse_mode="HTML")
+            return
 
     try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
-    for part in parts[1:]:
+        sent = await update.message.reply_text("🖼 <i>Analizuję obraz...</i>", parse_mode="HTML")
+        renderer = StreamRenderer(sent, update.message, name="image")
+        start_time = time.time()
+
         try:
-            await update.message.reply_text(part, parse_mode="HTML")
-        except Exception:
-            logger.exception("image_send_part_failed", user_id=user_id)
-
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=f"[{source_label}] {prompt}",
-        assistant_content=full_content,
-        reasoning_content=full_reasoning,
-        model=settings.xai_model_reasoning,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
+            result = await renderer.consume(
+                grok.chat_stream(
+                    messages=messages,
+                    model=settings.xai_model_reasoning,
+                    max_tokens=settings.max_output_tokens,
+                    reasoning_effort=settings.default_reasoning_effort,
+                )
+            )
+        except Exception as exc:
+            logger.error("image_analysis_failed", user_id=user_id, error=str(exc))
+            await renderer.fail(f"❌ Błąd API: {escape_html(str(exc))}")
+            return
+
+        elapsed = time.time() - start_time
+        footer = format_footer(
+            settings.xai_model_reasoning,
+            result.tokens_in,
+            result.tokens_out,
+            result.reasoning_tokens,
+            result.cost,
+            elapsed,
+        )
+        await renderer.finish(footer)
+        saved = await renderer.persist(
+            user_id,
+            user_content=f"[{source_label}] {prompt}",
+            model=settings.xai_model_reasoning,
+        )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, result.total_tokens, result.cost)
+    finally:
+        if limiter:
+            limiter.release(reservation)
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
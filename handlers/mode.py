@@ -9,10 +9,13 @@ import structlog
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import DEFAULT_SYSTEM_PROMPT, settings
-from db import calculate_cost, get_history, get_user_setting, save_message_pair_and_stats
+from config import settings
+from context_builder import build_chat_context
+from db import calculate_cost, save_message_pair_and_stats
 from grok_client import GrokClient
-from utils import check_access, escape_html, format_footer, get_current_date, markdown_to_telegram_html, split_message
+from rate_limiter import RateLimiter, Reservation
+from response_cache import CachedResponse, get_response_cache, make_cache_key
+from utils import check_access, escape_html, format_footer, markdown_to_telegram_html, split_html_message
 
 logger = structlog.get_logger(__name__)
 
@@ -36,81 +39,112 @@ async def fast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     logger.info("fast_command", user_id=user_id, query_len=len(query))
-    sent = await update.message.reply_text("⚡ <i>Generuję szybką odpowiedź...</i>", parse_mode="HTML")
-    start_time = time.time()
-
-    try:
-        history = await get_history(user_id, limit=settings.max_history)
-        custom_prompt = await get_user_setting(user_id, "system_prompt")
-        system_prompt = custom_prompt or DEFAULT_SYSTEM_PROMPT.format(
-            current_date=get_current_date()
+    cache = get_response_cache()
+    cached: CachedResponse | None = None
+
+    # Non-streaming /responses call without store — always the full history
+    chat_context = await build_chat_context(user_id, query, use_chain=False)
+    # Only a first turn can repeat: with history (or its summary) behind
+    # the prompt — even if none of it fit — the answer is the user's own.
+    # The system prompt stays in the key.
+    cache_key: str | None = None
+    if chat_context.first_turn:
+        cache_key = make_cache_key(
+            "fast", settings.xai_model_fast, query, context=chat_context.messages[0]["content"]
         )
-
-        messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
-        for msg in history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        messages.append({"role": "user", "content": query})
-
-        response: dict[str, Any] = await grok.chat(
-            messages=messages,
-            model=settings.xai_model_fast,
+        cached = await cache.get("fast", cache_key)
+
+    # A cached answer costs nothing, so only a call to the API holds budget
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter and cached is None:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_fast,
+            prompt_tokens=chat_context.estimated_tokens,
             max_tokens=settings.max_output_tokens,
         )
-    except Exception as exc:
-        logger.error("fast_command_api_error", user_id=user_id, error=str(exc))
-        await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
-        return
-
-    choices = response.get("choices", [])
-    message = choices[0].get("message", {}) if choices else {}
-    content = message.get("content") or "❌ Brak odpowiedzi z modelu."
-    usage = response.get("usage", {})
-
-    tokens_in = int(usage.get("prompt_tokens", 0) or 0)
-    tokens_out = int(usage.get("completion_tokens", 0) or 0)
-    reasoning_tokens = 0
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-    elapsed = time.time() - start_time
-
-    footer = format_footer(
-        settings.xai_model_fast,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-    )
-
-    final_text = f"{markdown_to_telegram_html(content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
+        if reservation is None:
+            await update.message.reply_text(f"⏳ {escape_html(reason)}", parse_mode="HTML")
+            return
 
     try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
+        sent = await update.message.reply_text("⚡ <i>Generuję szybką odpowiedź...</i>", parse_mode="HTML")
+        start_time = time.time()
+
+        if cached is not None:
+            response: dict[str, Any] = {"content": cached.content, "usage": {}}
+        else:
+            try:
+                response = await grok.chat(
+                    messages=chat_context.messages,
+                    model=settings.xai_model_fast,
+                    max_tokens=settings.max_output_tokens,
+                )
+            except Exception as exc:
+                logger.error("fast_command_api_error", user_id=user_id, error=str(exc))
+                await sent.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
+                return
+
+        content = response.get("content") or "❌ Brak odpowiedzi z modelu."
+        usage = response.get("usage", {})
+
+        tokens_in = int(usage.get("prompt_tokens", 0) or 0)
+        tokens_out = int(usage.get("completion_tokens", 0) or 0)
+        reasoning_tokens = int(usage.get("reasoning_tokens", 0) or 0)
+        cached_tokens = int(usage.get("cached_tokens", 0) or 0)
+        cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens, cached_tokens)
+        elapsed = time.time() - start_time
+        if cache_key is not None and cached is None and response.get("content"):
+            await cache.put("fast", cache_key, content, settings.xai_model_fast)
+
+        footer = format_footer(
+            settings.xai_model_fast,
+            tokens_in,
+            tokens_out,
+            reasoning_tokens,
+            cost,
+            elapsed,
+            cached=cached is not None,
+        )
+
+        final_text = f"{markdown_to_telegram_html(content)}\n\n<code>{escape_html(footer)}</code>"
+        parts = split_html_message(final_text, max_length=4000)
 
-    for part in parts[1:]:
         try:
-            await update.message.reply_text(part, parse_mode="HTML")
+            await sent.edit_text(parts[0], parse_mode="HTML")
         except Exception:
-            logger.exception("fast_command_send_part_failed", user_id=user_id)
-
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=query,
-        assistant_content=content,
-        model=settings.xai_model_fast,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
-
-    logger.info(
-        "fast_command_complete",
-        user_id=user_id,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        cost=cost,
-        elapsed=round(elapsed, 2),
-    )
+            pass
+
+        for part in parts[1:]:
+            try:
+                await update.message.reply_text(part, parse_mode="HTML")
+            except Exception:
+                logger.exception("fast_command_send_part_failed", user_id=user_id)
+
+        saved = await save_message_pair_and_stats(
+            user_id,
+            user_content=query,
+            assistant_content=content,
+            model=settings.xai_model_fast,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+            reasoning_tokens=reasoning_tokens,
+            cost_usd=cost,
+            cached_tokens=cached_tokens,
+            cache_hit=cached is not None,
+        )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, tokens_in + tokens_out + reasoning_tokens, cost)
+
+        logger.info(
+            "fast_command_complete",
+            user_id=user_id,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+            cost=cost,
+            elapsed=round(elapsed, 2),
+        )
+    finally:
+        if limiter:
+            limiter.release(reservation)
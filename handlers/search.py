@@ -8,15 +8,12 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from config import settings
-from db import calculate_cost, save_message_pair_and_stats
 from grok_client import GrokClient
-from utils import (
-    check_access,
-    escape_html,
-    format_footer,
-    markdown_to_telegram_html,
-    split_message,
-)
+from rate_limiter import RateLimiter, Reservation
+from response_cache import get_response_cache, make_cache_key
+from streaming import StreamRenderer
+from token_count import message_tokens
+from utils import check_access, escape_html, format_footer
 
 logger = structlog.get_logger(__name__)
 
@@ -108,144 +105,125 @@ async def _run_search_command(
         )
         return
 
+    renderer = StreamRenderer(
+        sent,
+        update.message,
+        name=command_name,
+        tool_status=lambda tool: (
+            f"{status_text}\n\n🛠 Używam narzędzia: <code>{escape_html(tool)}</code>"
+        ),
+    )
     start_time = time.time()
-    full_content = ""
-    full_reasoning = ""
-    usage: dict[str, int] = {}
-    last_edit = 0.0
-
-    messages: list[dict[str, str]] = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": query},
-    ]
 
-    try:
-        async for event_type, data in grok.chat_stream(
-            messages=messages,
-            model=settings.xai_model_reasoning,
-            max_tokens=settings.max_output_tokens,
-            reasoning_effort="medium",
-            tools=tools,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += str(data)
-            elif event_type == "tool_use":
-                try:
-                    await sent.edit_text(
-                        f"{status_text}\n\n🛠 Używam narzędzia: <code>{escape_html(str(data))}</code>",
-                        parse_mode="HTML",
-                    )
-                except Exception as exc:
-                    logger.warning(
-                        "search_tool_status_edit_failed",
-                        command=command_name,
-                        user_id=user_id,
-                        error=str(exc),
-                    )
-            elif event_type == "content":
-                full_content += str(data)
-                now = time.time()
-                if now - last_edit > 1.5:
-                    display = escape_html(full_content[:3800])
-                    if len(full_content) > 3800:
-                        display += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await sent.edit_text(display, parse_mode="HTML")
-                    except Exception as exc:
-                        logger.warning(
-                            "search_stream_edit_failed",
-                            command=command_name,
-                            user_id=user_id,
-                            error=str(exc),
-                        )
-                    last_edit = now
-            elif event_type == "done":
-                usage = data if isinstance(data, dict) else {}
-    except Exception as exc:
-        logger.error(
-            "search_api_error", command=command_name, user_id=user_id, error=str(exc)
+    # The system prompt is derived from the query, so the query is the whole input
+    cache = get_response_cache()
+    cache_command = command_name.removesuffix("_command")
+    cache_key = make_cache_key(cache_command, settings.xai_model_reasoning, query, tools)
+    cached = await cache.get(cache_command, cache_key)
+    if cached is not None:
+        renderer.result.content = cached.content
+        await renderer.finish(
+            format_footer(
+                settings.xai_model_reasoning, 0, 0, 0, 0.0, time.time() - start_time, cached=True
+            )
         )
         try:
-            await sent.edit_text(
-                "❌ Nie udało się wykonać wyszukiwania. Spróbuj ponownie za chwilę."
+            await renderer.persist(
+                user_id, user_content=query, model=settings.xai_model_reasoning, cache_hit=True
             )
-        except Exception as send_exc:
-            logger.warning(
-                "search_error_edit_failed",
+        except Exception as exc:
+            logger.error(
+                "search_persist_failed",
                 command=command_name,
                 user_id=user_id,
-                error=str(send_exc),
+                error=str(exc),
             )
+        logger.info("search_cache_hit", command=command_name, user_id=user_id, age=round(cached.age))
         return
 
-    elapsed = time.time() - start_time
-    tokens_in = int(usage.get("prompt_tokens", 0) or 0)
-    tokens_out = int(usage.get("completion_tokens", 0) or 0)
-    reasoning_tokens = int(usage.get("reasoning_tokens", 0) or 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-
-    footer = format_footer(
-        settings.xai_model_reasoning,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-    )
-    safe_content = (
-        full_content
-        or "Nie udało się znaleźć wystarczających danych dla tego zapytania."
-    )
-    final_text = f"{markdown_to_telegram_html(safe_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
+    messages: list[dict[str, str]] = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": query},
+    ]
+
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_reasoning,
+            prompt_tokens=sum(message_tokens(m) for m in messages),
+            max_tokens=settings.max_output_tokens,
+        )
+        if reservation is None:
+            await renderer.fail(f"⏳ {escape_html(reason)}")
+            return
 
     try:
-        await sent.edit_text(parts[0], parse_mode="HTML")
-    except Exception as exc:
-        logger.warning(
-            "search_final_edit_failed",
-            command=command_name,
-            user_id=user_id,
-            error=str(exc),
+        try:
+            result = await renderer.consume(
+                grok.chat_stream(
+                    messages=messages,
+                    model=settings.xai_model_reasoning,
+                    max_tokens=settings.max_output_tokens,
+                    reasoning_effort="medium",
+                    tools=tools,
+                )
+            )
+        except Exception as exc:
+            logger.error(
+                "search_api_error", command=command_name, user_id=user_id, error=str(exc)
+            )
+            await renderer.fail(
+                "❌ Nie udało się wykonać wyszukiwania. Spróbuj ponownie za chwilę."
+            )
+            return
+
+        elapsed = time.time() - start_time
+        footer = format_footer(
+            settings.xai_model_reasoning,
+            result.tokens_in,
+            result.tokens_out,
+            result.reasoning_tokens,
+            result.cost,
+            elapsed,
         )
-    for part in parts[1:]:
+        safe_content = (
+            result.content
+            or "Nie udało się znaleźć wystarczających danych dla tego zapytania."
+        )
+        await renderer.finish(footer, empty_text=safe_content)
+        if result.content:
+            await cache.put(cache_command, cache_key, result.content, settings.xai_model_reasoning)
+
+        saved = False
         try:
-            await update.message.reply_text(part, parse_mode="HTML")
+            saved = await renderer.persist(
+                user_id,
+                user_content=query,
+                model=settings.xai_model_reasoning,
+                assistant_content=safe_content,
+            )
         except Exception as exc:
-            logger.exception(
-                "search_send_part_failed",
+            logger.error(
+                "search_persist_failed",
                 command=command_name,
                 user_id=user_id,
                 error=str(exc),
             )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, result.total_tokens, result.cost)
 
-    try:
-        await save_message_pair_and_stats(
-            user_id,
-            user_content=query,
-            assistant_content=safe_content,
-            reasoning_content=full_reasoning,
-            model=settings.xai_model_reasoning,
-            tokens_in=tokens_in,
-            tokens_out=tokens_out,
-            reasoning_tokens=reasoning_tokens,
-            cost_usd=cost,
-        )
-    except Exception as exc:
-        logger.error(
-            "search_persist_failed",
+        logger.info(
+            "search_complete",
             command=command_name,
             user_id=user_id,
-            error=str(exc),
+            tokens_in=result.tokens_in,
+            tokens_out=result.tokens_out,
+            reasoning_tokens=result.reasoning_tokens,
+            cost=result.cost,
+            elapsed=round(elapsed, 2),
         )
-
-    logger.info(
-        "search_complete",
-        command=command_name,
-        user_id=user_id,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost=cost,
-        elapsed=round(elapsed, 2),
-    )
+    finally:
+        if limiter:
+            limiter.release(reservation)
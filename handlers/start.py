@@ -50,7 +50,8 @@ _HELP_ADMIN_SECTION = (
     "👑 <b>Admin:</b>\n"
     "/users → lista dozwolonych użytkowników\n"
     "/adduser &lt;id&gt; → dodaj użytkownika\n"
-    "/removeuser &lt;id&gt; → usuń użytkownika"
+    "/removeuser &lt;id&gt; → usuń użytkownika\n"
+    "/cache [purge [komenda]] → cache odpowiedzi"
 )
 
 _HELP_KEYBOARD = InlineKeyboardMarkup(
@@ -6,10 +6,16 @@ import structlog
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from concurrency import get_concurrency_scheduler
 from config import settings
+from db import get_db_pool_status, get_history_cache_status, get_write_queue_status
+from edit_scheduler import get_edit_scheduler
 from fallback import FallbackManager
+from http_transport import get_http_pool_status
 from model_router import ModelRouter
 from rate_limiter import RateLimiter
+from response_cache import get_response_cache
+from update_processor import PerUserUpdateProcessor
 from utils import check_access, escape_html
 
 logger = structlog.get_logger(__name__)
@@ -54,6 +60,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # --- Rate Limiter ---
     limiter: RateLimiter | None = context.bot_data.get("rate_limiter")
     if limiter:
+        await limiter.load_user_quota(user_id)
         remaining = limiter.get_user_remaining(user_id)
         lines.append("<b>⏱️ Your Quota</b>")
         lines.append(f"  Requests: {remaining['requests']} left")
@@ -61,6 +68,107 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         lines.append(f"  Budget: ${remaining['cost_usd']:.2f} left")
         lines.append("")
 
+        models = limiter.status()["models"]
+        if models:
+            lines.append("<b>📏 Model Limits (60 s window)</b>")
+            for name, window in models.items():
+                tpm = f"{window['tpm']:,}" if window["tpm"] else "∞"
+                lines.append(
+                    f"  <code>{escape_html(name)}</code>: {window['requests_in_window']}/{window['rpm']} req | "
+                    f"{window['tokens_in_window']:,}/{tpm} tok | delayed {window['delayed']}"
+                )
+            lines.append("")
+
+    # --- Telegram edit scheduler ---
+    edits = get_edit_scheduler().status()
+    lines.append("<b>✏️ Telegram Edits</b>")
+    lines.append(f"  Sent: {edits['sent']} | merged: {edits['merged']} | failed: {edits['failed']}")
+    lines.append(f"  Pending: {edits['pending']} | flood waits: {edits['retry_after']}")
+    lines.append(f"  Rate: {edits['global_rate']}/s")
+    lines.append("")
+
+    # --- Update processing ---
+    processor = context.application.update_processor
+    if isinstance(processor, PerUserUpdateProcessor):
+        updates = processor.status()
+        lines.append("<b>📥 Updates</b>")
+        lines.append(f"  Processed: {updates['processed']} | parallel: {updates['max_concurrent']}")
+        lines.append(
+            f"  Active users: {updates['active_users']} | queued behind own: {updates['queued_behind_user']}"
+        )
+        lines.append("")
+
+    # --- History cache ---
+    cache = get_history_cache_status()
+    lines.append("<b>🗂️ History Cache</b>")
+    lines.append(f"  Hits: {cache['hits']} | misses: {cache['misses']} ({cache['hit_rate']:.0%})")
+    lines.append(f"  Users: {cache['users']} | {cache['bytes'] / 1024:.0f} KB | evicted: {cache['evictions']}")
+    lines.append("")
+
+    # --- Conversation summaries ---
+    summarizer = context.application.bot_data.get("summarizer")
+    if summarizer is not None:
+        summaries = summarizer.status()
+        lines.append("<b>🧾 Summaries</b>")
+        lines.append(
+            f"  Written: {summaries['summaries']} | checks: {summaries['runs']} | "
+            f"failed: {summaries['failures']} | running: {summaries['running']}"
+        )
+        lines.append("")
+
+    # --- Response cache ---
+    responses = get_response_cache().status()
+    lines.append("<b>♻️ Response Cache</b>")
+    if settings.response_cache_enabled:
+        hits = responses["hits"] + responses["db_hits"]
+        lines.append(f"  Hits: {hits} (db: {responses['db_hits']}) | misses: {responses['misses']} ({responses['hit_rate']:.0%})")
+        lines.append(f"  Entries: {responses['entries']}/{responses['max_entries']} | stored: {responses['stores']}")
+    else:
+        lines.append("  Disabled")
+    lines.append("")
+
+    # --- DB write-behind ---
+    writes = get_write_queue_status()
+    lines.append("<b>💾 DB Writes</b>")
+    if settings.db_write_behind_enabled:
+        lines.append(f"  Batches: {writes['batches']} | rows: {writes['rows']} | pending: {writes['pending']}")
+        lines.append(f"  Failures: {writes['failures']} | dropped: {writes['dropped']}")
+    else:
+        lines.append("  Synchronous (write-behind off)")
+    lines.append("")
+
+    # --- DB connections ---
+    lines.append("<b>🔌 DB Connections</b>")
+    for conn in get_db_pool_status():
+        lines.append(
+            f"  {conn['name']}: {conn['queries']} q | wait avg {conn['avg_wait_ms']} ms, "
+            f"max {conn['max_wait_ms']} ms"
+        )
+    lines.append("")
+
+    # --- API concurrency pools ---
+    pools = get_concurrency_scheduler().status()
+    if pools:
+        lines.append("<b>🚦 API Queues</b>")
+        for pool in pools:
+            label = f"{pool['endpoint']} {pool['model']}".strip()
+            lines.append(
+                f"  <code>{escape_html(label)}</code>: {pool['active']}/{pool['limit']} active | "
+                f"waiting {pool['waiting']} | wait avg {pool['avg_wait_ms']} ms, max {pool['max_wait_ms']} ms"
+            )
+        lines.append("")
+
+    # --- HTTP connections ---
+    lines.append("<b>🌐 HTTP Connections</b>")
+    for pool in get_http_pool_status():
+        proto = "h2" if pool["http2"] else "h1.1"
+        lines.append(
+            f"  {pool['name']} ({proto}): {pool['requests']} req | {pool['connections']} new conn | "
+            f"reuse {pool['reuse_rate']:.0%} | open {pool['open']}"
+        )
+        lines.append(f"    Connect avg {pool['avg_connect_ms']} ms, max {pool['max_connect_ms']} ms")
+    lines.append("")
+
     # --- Config ---
     lines.append("<b>⚙️ Config</b>")
     lines.append(f"  Mode: <code>{settings.run_mode}</code>")
@@ -15,16 +15,13 @@ from pydub import AudioSegment
 from telegram import InputFile, Update
 from telegram.ext import ContextTypes
 
-from config import DEFAULT_SYSTEM_PROMPT, settings
-from db import (
-    calculate_cost,
-    get_history,
-    get_user_setting,
-    save_message_pair_and_stats,
-    set_user_setting,
-)
+from config import settings
+from context_builder import build_chat_context, stream_chat
+from db import get_user_settings, set_user_setting
 from grok_client import GrokClient
-from utils import check_access, escape_html, format_footer, get_current_date, markdown_to_telegram_html, split_message
+from rate_limiter import RateLimiter, Reservation
+from streaming import StreamRenderer
+from utils import check_access, escape_html, format_footer
 
 logger = structlog.get_logger(__name__)
 
@@ -95,8 +92,7 @@ async def voice_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     user_id = update.effective_user.id
-    current = await get_user_setting(user_id, "voice_enabled")
-    enabled = _is_enabled(current)
+    enabled = _is_enabled((await get_user_settings(user_id)).voice_enabled)
     new_value = "0" if enabled else "1"
     await set_user_setting(user_id, "voice_enabled", new_value)
 
@@ -154,104 +150,83 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text("❌ Nie udało się wykonać transkrypcji.")
         return
 
-    status = await update.message.reply_text(
-        f"🎤 <b>Transkrypcja:</b> {escape_html(transcript)}\n\n🧠 <i>Grok myśli...</i>",
-        parse_mode="HTML",
-    )
-
-    history = await get_history(user_id, limit=settings.max_history)
-    custom_prompt = await get_user_setting(user_id, "system_prompt")
-    system_prompt = custom_prompt or DEFAULT_SYSTEM_PROMPT.format(
-        current_date=get_current_date()
-    )
-    messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    messages.append({"role": "user", "content": transcript})
-
-    start_time = time.time()
-    full_content = ""
-    full_reasoning = ""
-    usage: dict[str, int] = {}
-    last_edit = 0.0
+    user_settings = await get_user_settings(user_id)
+    chat_context = await build_chat_context(user_id, transcript)
 
-    try:
-        async for event_type, data in grok.chat_stream(
-            messages=messages,
-            model=settings.xai_model_reasoning,
+    limiter: RateLimiter | None = context.application.bot_data.get("rate_limiter")
+    reservation: Reservation | None = None
+    if limiter:
+        reservation, reason = await limiter.reserve(
+            user_id,
+            settings.xai_model_reasoning,
+            prompt_tokens=chat_context.estimated_tokens,
             max_tokens=settings.max_output_tokens,
-            reasoning_effort=settings.default_reasoning_effort,
-        ):
-            if event_type == "reasoning":
-                full_reasoning += str(data)
-            elif event_type == "content":
-                full_content += str(data)
-                now = time.time()
-                if now - last_edit > 1.5:
-                    header = f"🎤 <b>Transkrypcja:</b> {escape_html(transcript[:200])}\n\n"
-                    body_text = escape_html(full_content[:3600])
-                    if len(full_content) > 3600:
-                        body_text += "\n\n<i>... (kontynuacja)</i>"
-                    try:
-                        await status.edit_text(header + body_text, parse_mode="HTML")
-                    except Exception:
-                        pass
-                    last_edit = now
-            elif event_type == "done":
-                usage = data if isinstance(data, dict) else {}
-    except Exception as exc:
-        logger.error("voice_grok_failed", user_id=user_id, error=str(exc))
-        await status.edit_text(f"❌ Błąd API: {escape_html(str(exc))}", parse_mode="HTML")
-        return
+        )
+        if reservation is None:
+            await update.message.reply_text(
+                f"🎤 <b>Transkrypcja:</b> {escape_html(transcript)}\n\n⏳ {escape_html(reason)}",
+                parse_mode="HTML",
+            )
+            return
 
-    elapsed = time.time() - start_time
-    tokens_in = usage.get("prompt_tokens", 0)
-    tokens_out = usage.get("completion_tokens", 0)
-    reasoning_tokens = usage.get("reasoning_tokens", 0)
-    cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens)
-    footer = format_footer(
-        settings.xai_model_reasoning,
-        tokens_in,
-        tokens_out,
-        reasoning_tokens,
-        cost,
-        elapsed,
-    )
-
-    transcript_header = f"🎤 <b>Transkrypcja:</b> {escape_html(transcript[:200])}\n\n"
-    final_text = f"{transcript_header}{markdown_to_telegram_html(full_content)}\n\n<code>{escape_html(footer)}</code>"
-    parts = split_message(final_text, max_length=4000)
     try:
-        await status.edit_text(parts[0], parse_mode="HTML")
-    except Exception:
-        pass
-    for part in parts[1:]:
-        try:
-            await update.message.reply_text(part, parse_mode="HTML")
-        except Exception:
-            logger.exception("voice_send_part_failed", user_id=user_id)
+        status = await update.message.reply_text(
+            f"🎤 <b>Transkrypcja:</b> {escape_html(transcript)}\n\n🧠 <i>Grok myśli...</i>",
+            parse_mode="HTML",
+        )
+        renderer = StreamRenderer(
+            status,
+            update.message,
+            name="voice",
+            header=f"🎤 <b>Transkrypcja:</b> {escape_html(transcript[:200])}\n\n",
+            preview_limit=3600,
+        )
+        start_time = time.time()
 
-    voice_enabled = _is_enabled(await get_user_setting(user_id, "voice_enabled"))
-    if voice_enabled and full_content.strip():
         try:
-            voice_bytes = await asyncio.to_thread(_text_to_ogg_opus, full_content)
-            voice_buffer = BytesIO(voice_bytes)
-            voice_buffer.name = "response.ogg"
-            await update.message.reply_voice(voice=InputFile(voice_buffer))
-        except Exception as exc:
-            logger.error("voice_tts_failed", user_id=user_id, error=str(exc))
-            await update.message.reply_text(
-                "⚠️ Nie udało się wygenerować odpowiedzi głosowej (sprawdź ffmpeg)."
+            result = await renderer.consume(
+                stream_chat(
+                    grok,
+                    chat_context,
+                    model=settings.xai_model_reasoning,
+                    max_tokens=settings.max_output_tokens,
+                    reasoning_effort=settings.default_reasoning_effort,
+                )
             )
-
-    await save_message_pair_and_stats(
-        user_id,
-        user_content=transcript,
-        assistant_content=full_content,
-        reasoning_content=full_reasoning,
-        model=settings.xai_model_reasoning,
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        reasoning_tokens=reasoning_tokens,
-        cost_usd=cost,
-    )
+        except Exception as exc:
+            logger.error("voice_grok_failed", user_id=user_id, error=str(exc))
+            await renderer.fail(f"❌ Błąd API: {escape_html(str(exc))}")
+            return
+
+        elapsed = time.time() - start_time
+        footer = format_footer(
+            settings.xai_model_reasoning,
+            result.tokens_in,
+            result.tokens_out,
+            result.reasoning_tokens,
+            result.cost,
+            elapsed,
+        )
+        await renderer.finish(footer)
+
+        voice_enabled = _is_enabled(user_settings.voice_enabled)
+        if voice_enabled and result.content.strip():
+            try:
+                voice_bytes = await asyncio.to_thread(_text_to_ogg_opus, result.content)
+                voice_buffer = BytesIO(voice_bytes)
+                voice_buffer.name = "response.ogg"
+                await update.message.reply_voice(voice=InputFile(voice_buffer))
+            except Exception as exc:
+                logger.error("voice_tts_failed", user_id=user_id, error=str(exc))
+                await update.message.reply_text(
+                    "⚠️ Nie udało się wygenerować odpowiedzi głosowej (sprawdź ffmpeg)."
+                )
+
+        saved = await renderer.persist(
+            user_id, user_content=transcript, model=settings.xai_model_reasoning, chained=True
+        )
+        if limiter and reservation:
+            limiter.commit_after_save(reservation, saved, result.total_tokens, result.cost)
+    finally:
+        if limiter:
+            limiter.release(reservation)
@@ -0,0 +1,175 @@
+"""In-memory LRU cache of recent conversation history per user.
+
+Sits in front of :func:`db.get_history`.  Each cached user holds a ring
+buffer (``deque(maxlen=...)``) of their most recent messages; the DB layer
+appends to it write-through after every successful insert and resets it on
+``clear_history``, so the common "read history → answer → save pair" cycle
+never hits SQLite for the read.  Users are evicted least-recently-used once
+the estimated memory footprint exceeds the configured cap.
+"""
+
+from __future__ import annotations
+
+import sys
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# Rough per-message overhead of the dict, two str objects and the token count on CPython
+_MESSAGE_OVERHEAD: int = sys.getsizeof({}) + 2 * sys.getsizeof("") + sys.getsizeof(0)
+
+
+def _message_size(message: dict[str, Any]) -> int:
+    return _MESSAGE_OVERHEAD + len(message["role"]) + len(message["content"])
+
+
+def _copy(message: dict[str, Any]) -> dict[str, Any]:
+    cached = {"role": message["role"], "content": message["content"]}
+    for key in ("tokens", "id"):
+        if key in message:
+            cached[key] = message[key]
+    return cached
+
+
+@dataclass
+class _UserHistory:
+    messages: deque[dict[str, Any]]
+    # True when the buffer holds the user's *entire* history (nothing older in the DB)
+    complete: bool
+    size: int = field(default=0)
+
+
+class HistoryCache:
+    """Bounded per-user history ring buffers with global LRU eviction."""
+
+    def __init__(self, max_messages: int = 64, max_bytes: int = 8_000_000) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._users: OrderedDict[int, _UserHistory] = OrderedDict()
+        self._bytes = 0
+        # Bumped on every write; a DB load started before a write is not cached
+        self._epoch = 0
+        self._stats: dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_messages > 0 and self.max_bytes > 0
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def get(self, user_id: int, limit: int) -> list[dict[str, Any]] | None:
+        """Return the last *limit* messages (oldest first) or ``None`` on a miss."""
+        entry = self._users.get(user_id)
+        if entry is None or (len(entry.messages) < limit and not entry.complete):
+            self._stats["misses"] += 1
+            return None
+        self._users.move_to_end(user_id)
+        self._stats["hits"] += 1
+        messages = entry.messages
+        start = max(len(messages) - limit, 0)
+        return [dict(messages[i]) for i in range(start, len(messages))]
+
+    def begin_load(self) -> int:
+        """Return a token to pass to :meth:`store` after reading from the DB."""
+        return self._epoch
+
+    def fetch_limit(self, limit: int) -> int:
+        """How many rows to read from the DB on a miss for a *limit* request."""
+        return max(limit, self.max_messages)
+
+    def store(
+        self,
+        user_id: int,
+        rows: list[dict[str, Any]],
+        fetched: int,
+        token: int,
+    ) -> None:
+        """Cache *rows* read from the DB with ``LIMIT fetched``."""
+        if not self.enabled or token != self._epoch:
+            return
+        complete = len(rows) < fetched
+        messages: deque[dict[str, Any]] = deque(maxlen=self.max_messages)
+        for row in rows[-self.max_messages:]:
+            messages.append(_copy(row))
+        if len(rows) > self.max_messages:
+            complete = False
+        self._put(user_id, _UserHistory(messages, complete))
+
+    # ------------------------------------------------------------------
+    # Write-through
+    # ------------------------------------------------------------------
+
+    def append(self, user_id: int, *messages: dict[str, Any]) -> None:
+        """Append freshly persisted messages to a cached user (no-op if not cached)."""
+        self._epoch += 1
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        for message in messages:
+            if len(entry.messages) == entry.messages.maxlen:
+                dropped = entry.messages[0]
+                entry.size -= _message_size(dropped)
+                self._bytes -= _message_size(dropped)
+                entry.complete = False
+            cached = _copy(message)
+            entry.messages.append(cached)
+            entry.size += _message_size(cached)
+            self._bytes += _message_size(cached)
+        self._users.move_to_end(user_id)
+        self._evict()
+
+    def reset(self, user_id: int) -> None:
+        """Mark *user_id* as having an empty history (after ``clear_history``)."""
+        self._epoch += 1
+        if not self.enabled:
+            return
+        self._put(user_id, _UserHistory(deque(maxlen=self.max_messages), complete=True))
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop *user_id* from the cache (e.g. after a failed write)."""
+        self._epoch += 1
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._users.clear()
+        self._bytes = 0
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _put(self, user_id: int, entry: _UserHistory) -> None:
+        entry.size = sum(_message_size(m) for m in entry.messages)
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry.size > self.max_bytes:
+            return
+        self._users[user_id] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._users:
+            _, entry = self._users.popitem(last=False)
+            self._bytes -= entry.size
+            self._stats["evictions"] += 1
+
+    def status(self) -> dict[str, Any]:
+        """Return cache metrics for diagnostics."""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "users": len(self._users),
+            "bytes": self._bytes,
+        }
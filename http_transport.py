@@ -0,0 +1,193 @@
+"""Shared HTTP client factory with explicit pool limits and connection stats.
+
+Every outbound client (xAI, Groq, GitHub…) is built through
+:func:`create_http_client` so they share one set of pool settings: HTTP/2
+multiplexing when the optional ``h2`` package is installed, explicit
+``max_connections``/keep-alive limits and a pre-warm helper that opens
+connections at startup.  With HTTP/2 a long-running stream no longer pins a
+whole TCP+TLS connection — concurrent requests to ``api.x.ai`` share one.
+
+Each transport counts requests and newly opened connections (via the
+``httpcore`` trace extension) so connection reuse is visible in ``/status``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+import structlog
+
+from config import settings
+
+logger = structlog.get_logger(__name__)
+
+
+def h2_available() -> bool:
+    """Return ``True`` when the ``h2`` package (``httpx[http2]``) is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+# ---------------------------------------------------------------------------
+# Connection statistics
+# ---------------------------------------------------------------------------
+@dataclass
+class _TransportStats:
+    requests: int = 0
+    connections: int = 0
+    connect_failures: int = 0
+    http2_requests: int = 0
+    connect_total: float = 0.0
+    connect_max: float = 0.0
+
+    def record_connect(self, elapsed: float) -> None:
+        self.connections += 1
+        self.connect_total += elapsed
+        self.connect_max = max(self.connect_max, elapsed)
+
+
+class _TracingTransport(httpx.AsyncBaseTransport):
+    """Wrap an :class:`httpx.AsyncHTTPTransport` and count connection reuse."""
+
+    def __init__(self, name: str, transport: httpx.AsyncHTTPTransport, http2: bool) -> None:
+        self.name = name
+        self.http2 = http2
+        self._transport = transport
+        self.stats = _TransportStats()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.requests += 1
+        if "trace" not in request.extensions:
+            request.extensions["trace"] = self._make_trace(tls=request.url.scheme == "https")
+        return await self._transport.handle_async_request(request)
+
+    def _make_trace(self, *, tls: bool) -> Any:
+        # One closure per request; the connection is ready after TLS (or TCP for plain HTTP)
+        ready_event = "connection.start_tls.complete" if tls else "connection.connect_tcp.complete"
+        stats = self.stats
+        started = 0.0
+
+        async def trace(event_name: str, info: dict[str, Any]) -> None:
+            nonlocal started
+            if event_name == "connection.connect_tcp.started":
+                started = time.monotonic()
+            elif event_name == ready_event:
+                stats.record_connect(time.monotonic() - started)
+            elif event_name in ("connection.connect_tcp.failed", "connection.start_tls.failed"):
+                stats.connect_failures += 1
+            elif event_name == "http2.send_request_headers.started":
+                stats.http2_requests += 1
+
+        return trace
+
+    def open_connections(self) -> int:
+        pool = getattr(self._transport, "_pool", None)
+        return len(getattr(pool, "connections", ()))
+
+    def status(self) -> dict[str, Any]:
+        s = self.stats
+        reused = max(s.requests - s.connections - s.connect_failures, 0)
+        return {
+            "name": self.name,
+            "http2": self.http2,
+            "requests": s.requests,
+            "connections": s.connections,
+            "reused": reused,
+            "reuse_rate": round(reused / s.requests, 3) if s.requests else 0.0,
+            "http2_requests": s.http2_requests,
+            "open": self.open_connections(),
+            "avg_connect_ms": round(s.connect_total / s.connections * 1000, 1) if s.connections else 0.0,
+            "max_connect_ms": round(s.connect_max * 1000, 1),
+        }
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# Keyed by client so two clients with the same name keep separate stats;
+# entries go away with their client
+_transports: weakref.WeakKeyDictionary[httpx.AsyncClient, _TracingTransport] = weakref.WeakKeyDictionary()
+
+
+def get_http_pool_status() -> list[dict[str, Any]]:
+    """Return per-client connection reuse metrics for diagnostics."""
+    return [transport.status() for transport in _transports.values()]
+
+
+# ---------------------------------------------------------------------------
+# Factory
+# ---------------------------------------------------------------------------
+def create_http_client(
+    name: str,
+    *,
+    timeout: httpx.Timeout | float = 120.0,
+    headers: dict[str, str] | None = None,
+    http2: bool | None = None,
+    max_connections: int | None = None,
+    max_keepalive_connections: int | None = None,
+    keepalive_expiry: float | None = None,
+) -> httpx.AsyncClient:
+    """Build an :class:`httpx.AsyncClient` with the shared pool configuration.
+
+    Unset arguments fall back to the ``HTTP_*`` settings.  HTTP/2 is only
+    enabled when requested *and* ``h2`` is importable.
+    """
+    if http2 is None:
+        http2 = settings.http2_enabled
+    if http2 and not h2_available():
+        logger.info("http2_unavailable", client=name, hint="pip install 'httpx[http2]'")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections if max_connections is not None else settings.http_max_connections,
+        max_keepalive_connections=(
+            max_keepalive_connections
+            if max_keepalive_connections is not None
+            else settings.http_max_keepalive_connections
+        ),
+        keepalive_expiry=keepalive_expiry if keepalive_expiry is not None else settings.http_keepalive_expiry_s,
+    )
+    transport = _TracingTransport(
+        name,
+        httpx.AsyncHTTPTransport(http2=http2, limits=limits),
+        http2,
+    )
+    client = httpx.AsyncClient(transport=transport, timeout=timeout, headers=headers)
+    _transports[client] = transport
+    return client
+
+
+async def prewarm(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    connections: int = 1,
+    timeout: float = 10.0,
+) -> int:
+    """Open up to *connections* pooled connections to *url* ahead of traffic.
+
+    Sends concurrent ``HEAD`` requests; any HTTP status counts as success since
+    only the TCP+TLS handshake matters.  Over HTTP/2 one connection carries
+    every stream, so a single request is sent.  Returns how many completed.
+    """
+    transport = getattr(client, "_transport", None)
+    if isinstance(transport, _TracingTransport) and transport.http2:
+        connections = 1
+
+    async def _head() -> bool:
+        try:
+            await client.head(url, timeout=timeout)
+            return True
+        except httpx.HTTPError as exc:
+            logger.warning("http_prewarm_failed", url=url, error=str(exc))
+            return False
+
+    results = await asyncio.gather(*(_head() for _ in range(max(connections, 1))))
+    warmed = sum(results)
+    logger.info("http_prewarmed", url=url, requested=connections, ok=warmed)
+    return warmed
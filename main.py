@@ -9,16 +9,38 @@ import traceback
 import httpx
 import structlog
 from telegram import Update
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
 
+from concurrency import get_concurrency_scheduler
 from config import settings
-from db import close_db, init_db
+from db import (
+    add_pair_saved_hook,
+    add_usage_hook,
+    close_db,
+    init_db,
+    remove_pair_saved_hook,
+    remove_usage_hook,
+)
+from edit_scheduler import get_edit_scheduler
 from fallback import FallbackManager
+from grok_client import GrokClient
 from grok_responses_client import GrokResponsesClient
 from healthcheck import start_healthcheck_server
+from http_transport import create_http_client, prewarm
 from model_router import ModelProvider, ModelRouter, Profile, default_xai_config
 from rate_limiter import RateLimiter
-from handlers.admin import adduser_command, removeuser_command, users_command
+from retry_policy import RetryPolicy
+from summarizer import ConversationSummarizer, create_summarizer
+from update_processor import PerUserUpdateProcessor, bind_current_user
+from handlers.admin import adduser_command, cache_command, removeuser_command, users_command
 from handlers.chat import handle_message, init_grok_client
 from handlers.collection import collection_command
 from handlers.collectionsearch import collectionsearch_command
@@ -63,25 +85,59 @@ async def post_init(application: Application) -> None:  # type: ignore[type-arg]
     """Called after the Application is initialised."""
     await init_db()
 
+    # --- Per-(endpoint, model) API concurrency pools ---
+    get_concurrency_scheduler().configure(settings.xai_max_concurrent)
+
+    # --- Shared HTTP clients (pooled, HTTP/2 when available) ---
+    xai_http = create_http_client("xai", timeout=httpx.Timeout(connect=15.0, read=180.0, write=30.0, pool=15.0))
+    application.bot_data["xai_http_client"] = xai_http
+    application.bot_data["http_client"] = create_http_client("generic", timeout=httpx.Timeout(120.0))
+    if settings.http_prewarm_connections > 0:
+        await prewarm(xai_http, "https://api.x.ai/v1", connections=settings.http_prewarm_connections)
+
+    retry_policy = RetryPolicy(
+        max_attempts=settings.retry_max_attempts,
+        base_delay=settings.retry_base_delay_s,
+        max_delay=settings.retry_max_delay_s,
+        deadline=settings.retry_deadline_s,
+    )
     grok = GrokResponsesClient(
         api_key=settings.xai_api_key,
         nexus_mcp_url=settings.nexus_mcp_url,
         nexus_auth_token=settings.nexus_auth_token,
         anthropic_api_key=settings.anthropic_api_key,
+        http_client=xai_http,
+        max_tool_rounds=settings.tool_max_rounds,
+        tool_timeout=settings.tool_timeout_s,
+        retry_policy=retry_policy,
     )
     init_grok_client(grok)
     application.bot_data["grok_client"] = grok
-    application.bot_data["http_client"] = httpx.AsyncClient(timeout=httpx.Timeout(120.0))
+    # /documents/search (collection search) — shares the pooled xAI connection
+    application.bot_data["grok_documents_client"] = GrokClient(
+        api_key=settings.xai_api_key,
+        base_url=settings.xai_base_url,
+        http_client=xai_http,
+        retry_policy=retry_policy,
+    )
+
+    # --- Rolling conversation summaries (background, after each saved exchange) ---
+    if settings.summary_enabled:
+        summarizer = create_summarizer(grok)
+        add_pair_saved_hook(summarizer.schedule)
+        application.bot_data["summarizer"] = summarizer
 
     # --- Multi-model router (aligned with N.O.C Provider Factory) ---
     router = ModelRouter()
     router.register(default_xai_config(settings.xai_api_key))
     application.bot_data["model_router"] = router
 
-    # --- Rate limiter ---
-    limiter = RateLimiter()
-    limiter.add_model_limit(settings.xai_model_reasoning, settings.rate_limit_rpm)
-    limiter.add_model_limit(settings.xai_model_fast, settings.rate_limit_rpm * 2)
+    # --- Rate limiter (daily quotas follow every usage saved to usage_stats) ---
+    # Every model gets RPM + TPM windows; API requests queue on them in the scheduler
+    limiter = RateLimiter(model_rpm=settings.rate_limit_rpm, model_tpm=settings.rate_limit_tpm)
+    limiter.add_model_limit(settings.xai_model_fast, settings.rate_limit_rpm * 2, settings.rate_limit_tpm)
+    get_concurrency_scheduler().set_model_limits(limiter.model_limit)
+    add_usage_hook(limiter.record_usage)
     application.bot_data["rate_limiter"] = limiter
 
     # --- Fallback manager ---
@@ -101,12 +157,22 @@ async def post_init(application: Application) -> None:  # type: ignore[type-arg]
 
 async def post_shutdown(application: Application) -> None:  # type: ignore[type-arg]
     """Called when the Application shuts down."""
+    await get_edit_scheduler().stop()
+    summarizer: ConversationSummarizer | None = application.bot_data.get("summarizer")
+    if summarizer:
+        remove_pair_saved_hook(summarizer.schedule)
+        await summarizer.close()
+    limiter: RateLimiter | None = application.bot_data.get("rate_limiter")
+    if limiter:
+        remove_usage_hook(limiter.record_usage)
+        get_concurrency_scheduler().set_model_limits(None)
     grok: GrokResponsesClient | None = application.bot_data.get("grok_client")
     if grok:
         await grok.close()
-    http_client: httpx.AsyncClient | None = application.bot_data.get("http_client")
-    if http_client:
-        await http_client.aclose()
+    for key in ("http_client", "xai_http_client"):
+        http_client: httpx.AsyncClient | None = application.bot_data.get(key)
+        if http_client:
+            await http_client.aclose()
     await close_db()
     logger.info("bot_shutdown")
 
@@ -149,11 +215,19 @@ def main() -> None:
         .token(settings.telegram_bot_token)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
+        .concurrent_updates(
+            PerUserUpdateProcessor(settings.telegram_concurrent_updates)
+            if settings.telegram_concurrent_updates > 1
+            else False
+        )
         .build()
     )
 
     app.add_error_handler(error_handler)
 
+    # Runs before every other handler (same task): fair queuing key for API calls
+    app.add_handler(TypeHandler(Update, bind_current_user), group=-1)
+
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("fast", fast_command))
@@ -169,6 +243,7 @@ def main() -> None:
     app.add_handler(CommandHandler("users", users_command))
     app.add_handler(CommandHandler("adduser", adduser_command))
     app.add_handler(CommandHandler("removeuser", removeuser_command))
+    app.add_handler(CommandHandler("cache", cache_command))
     app.add_handler(CommandHandler("collection", collection_command))
     app.add_handler(CommandHandler("collectionsearch", collectionsearch_command))
     app.add_handler(CommandHandler("gigagrok", gigagrok_command))
@@ -52,13 +52,27 @@ class QueryComplexity(str, Enum):
 
 @dataclass
 class ModelPricing:
-    """Per-1M-token pricing in USD."""
+    """Per-1M-token pricing in USD.
+
+    ``cached_input`` applies to the prompt tokens served from the provider's
+    prefix cache (a subset of ``input_tokens``); ``None`` = no discount.
+    """
     input: float = 0.0
     output: float = 0.0
+    cached_input: float | None = None
 
-    def calculate(self, input_tokens: int, output_tokens: int, reasoning_tokens: int = 0) -> float:
+    def calculate(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        reasoning_tokens: int = 0,
+        cached_tokens: int = 0,
+    ) -> float:
+        cached = min(max(cached_tokens, 0), input_tokens)
+        cached_rate = self.input if self.cached_input is None else self.cached_input
         return round(
-            (input_tokens / 1_000_000) * self.input
+            ((input_tokens - cached) / 1_000_000) * self.input
+            + (cached / 1_000_000) * cached_rate
             + ((output_tokens + reasoning_tokens) / 1_000_000) * self.output,
             6,
         )
@@ -82,9 +96,16 @@ class ProviderConfig:
     def model_for_profile(self, profile: Profile) -> str:
         return self.profile_models.get(profile, next(iter(self.profile_models.values())))
 
-    def cost(self, model: str, input_tokens: int, output_tokens: int, reasoning_tokens: int = 0) -> float:
+    def cost(
+        self,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        reasoning_tokens: int = 0,
+        cached_tokens: int = 0,
+    ) -> float:
         p = self.pricing.get(model, ModelPricing())
-        return p.calculate(input_tokens, output_tokens, reasoning_tokens)
+        return p.calculate(input_tokens, output_tokens, reasoning_tokens, cached_tokens)
 
 
 @dataclass
@@ -134,9 +155,9 @@ def default_xai_config(api_key: str) -> ProviderConfig:
             Profile.DEEP: "grok-4.20-0309-reasoning",
         },
         pricing={
-            "grok-4.20-0309-reasoning": ModelPricing(input=2.0, output=10.0),
-            "grok-4.20-0309-non-reasoning": ModelPricing(input=2.0, output=10.0),
-            "grok-4-1-fast-reasoning": ModelPricing(input=0.20, output=0.50),
+            "grok-4.20-0309-reasoning": ModelPricing(input=2.0, output=10.0, cached_input=0.50),
+            "grok-4.20-0309-non-reasoning": ModelPricing(input=2.0, output=10.0, cached_input=0.50),
+            "grok-4-1-fast-reasoning": ModelPricing(input=0.20, output=0.50, cached_input=0.05),
         },
         capabilities=frozenset({"reasoning", "tools", "search", "vision", "mcp"}),
         max_context=2_000_000,
@@ -1,55 +1,353 @@
-"""Token-bucket rate limiter and per-user quota management."""
+"""Token-bucket rate limiter and per-user quota management.
+
+Daily quotas (``DAILY_REQUEST_CAP``, ``DAILY_TOKEN_CAP``,
+``DAILY_COST_CAP_USD``) survive restarts: a user's quota is loaded from
+today's ``usage_stats`` row on their first request, then kept in memory and
+updated by :func:`db.add_usage_hook` whenever usage is saved — one query
+per user per process, none per request.  At most ``max_users`` quotas are
+kept; the least recently used are dropped and reloaded on demand.
+
+Concurrent requests are bounded by reservations: :meth:`RateLimiter.reserve`
+holds a pessimistic estimate (prompt + ``max_tokens``) against the quota
+until the request is settled with :meth:`RateLimiter.commit` — after its
+actual usage from the ``done`` event was saved, or charged directly when
+the save failed — or handed back with
+:meth:`RateLimiter.release` when the stream failed or was cancelled.
+
+Per-model provider limits — requests and tokens per minute — are tracked by
+:class:`ModelRateLimit` over a sliding 60 s window.  The API clients admit
+every HTTP request through it (via :meth:`concurrency.ConcurrencyScheduler.slot`)
+and wait for the exact moment the window has room instead of sending the
+request into a 429 and a retry sleep.  The window learns from live usage
+(the admitted input estimate is settled to the reported usage) and from the
+provider's ``x-ratelimit-remaining-*`` / ``x-ratelimit-reset-*`` headers.
+"""
 
 from __future__ import annotations
 
 import asyncio
 import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Awaitable, Callable, Mapping
 
 import structlog
 
+from config import settings
+from db import calculate_cost, get_daily_stats
+from retry_policy import parse_duration
+
 logger = structlog.get_logger(__name__)
 
 
+@dataclass
+class _Waiter:
+    tokens: float
+    future: asyncio.Future[bool]
+
+
 @dataclass
 class TokenBucket:
-    """Classic token-bucket rate limiter."""
+    """Classic token-bucket rate limiter with a FIFO queue of waiters.
+
+    :meth:`wait_and_acquire` does not poll: a waiter parks on a future and a
+    single timer is armed for the exact moment the head of the queue can be
+    served.  Waiters are served strictly in arrival order, so a large
+    (weighted) acquire is not starved by a stream of small ones, and
+    :meth:`acquire` never jumps the queue.  The bucket is only touched from
+    the event loop and never awaits while updating its state, so it needs no
+    lock.
+    """
 
     capacity: int
     refill_rate: float  # tokens per second
     _tokens: float = field(init=False)
     _last_refill: float = field(init=False)
-    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    _waiters: deque[_Waiter] = field(default_factory=deque, init=False, repr=False)
+    _queued_tokens: float = field(default=0.0, init=False, repr=False)
+    _timer: asyncio.TimerHandle | None = field(default=None, init=False, repr=False)
 
     def __post_init__(self) -> None:
         self._tokens = float(self.capacity)
         self._last_refill = time.monotonic()
 
-    async def acquire(self, tokens: int = 1) -> bool:
-        async with self._lock:
-            now = time.monotonic()
-            elapsed = now - self._last_refill
-            self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_rate)
-            self._last_refill = now
-            if self._tokens >= tokens:
-                self._tokens -= tokens
-                return True
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.refill_rate)
+        self._last_refill = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take *tokens* now if available and nobody is queued ahead."""
+        self._refill()
+        if self._waiters or self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1) -> bool:
+        """Non-blocking :meth:`try_acquire`."""
+        return self.try_acquire(tokens)
+
+    def time_until(self, tokens: float = 1) -> float:
+        """Seconds until *tokens* would be available, ignoring queued waiters."""
+        self._refill()
+        deficit = tokens - self._tokens
+        if deficit <= 0:
+            return 0.0
+        if self.refill_rate <= 0:
+            return float("inf")
+        return deficit / self.refill_rate
+
+    async def wait_and_acquire(self, tokens: float = 1, timeout: float = 30.0) -> bool:
+        """Block until *tokens* are granted (FIFO) or *timeout* elapses.
+
+        Returns ``False`` immediately when the request cannot be served in
+        time even if every waiter ahead gets its tokens on schedule, or when
+        it exceeds the bucket's capacity.  Cancelling the caller removes it
+        from the queue; tokens granted to a cancelled waiter are returned.
+        """
+        if tokens > self.capacity:
+            return False
+        if self.try_acquire(tokens):
+            return True
+        if self.time_until(self._queued_tokens + tokens) > timeout:
             return False
 
-    async def wait_and_acquire(self, tokens: int = 1, timeout: float = 30.0) -> bool:
-        """Block until tokens are available or timeout."""
-        deadline = time.monotonic() + timeout
-        while time.monotonic() < deadline:
-            if await self.acquire(tokens):
-                return True
-            await asyncio.sleep(0.1)
-        return False
+        waiter = _Waiter(tokens, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._queued_tokens += tokens
+        self._wake()
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            return False
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter.future.done() and not waiter.future.cancelled():
+            # Granted in the same loop iteration as the timeout/cancellation
+            self._tokens = min(self.capacity, self._tokens + waiter.tokens)
+        else:
+            waiter.future.cancel()
+            self._queued_tokens -= waiter.tokens
+        self._wake()
+
+    def _wake(self) -> None:
+        """Grant tokens to waiters at the head of the queue; re-arm the timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            head = self._waiters[0]
+            if head.future.done():  # timed out or cancelled
+                self._waiters.popleft()
+                continue
+            if head.tokens > self._tokens:
+                break
+            self._waiters.popleft()
+            self._tokens -= head.tokens
+            self._queued_tokens -= head.tokens
+            head.future.set_result(True)
+        if self._waiters:
+            delay = self.time_until(self._waiters[0].tokens)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._wake()
 
     @property
     def available(self) -> float:
+        self._refill()
         return self._tokens
 
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.future.done())
+
+
+@dataclass
+class Admission:
+    """One request admitted by a :class:`ModelRateLimit` (no-op without a limit)."""
+
+    at: float = 0.0
+    tokens: int = 0
+    limit: ModelRateLimit | None = field(default=None, repr=False)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Feed the response's rate-limit headers back into the limit."""
+        if self.limit is not None:
+            self.limit.observe(headers)
+
+    def settle(self, tokens: int) -> None:
+        """Replace the admitted estimate with the request's reported usage."""
+        if self.limit is not None:
+            self.limit.settle(self, tokens)
+
+
+class ModelRateLimit:
+    """Requests/min and tokens/min budget of one model over a sliding window.
+
+    A sliding-window log: every admitted request is recorded with its
+    (estimated, later settled) tokens, and a request is admitted once both
+    the request count and the token sum of the last *window* seconds leave
+    room for it.  Waiters are admitted in FIFO order and sleep exactly until
+    the oldest blocking entry leaves the window — there is no polling.
+
+    The provider's own view wins when it is stricter: after a response with
+    ``x-ratelimit-remaining-requests: 0`` (or too few remaining tokens) no
+    request is admitted until the matching ``x-ratelimit-reset-*``.
+    """
+
+    def __init__(self, rpm: int, tpm: int | None = None, window: float = 60.0, model: str = "") -> None:
+        self.model = model
+        self.rpm = max(1, rpm)
+        self.tpm = tpm if tpm and tpm > 0 else None
+        self.window = window
+        self._log: deque[Admission] = deque()
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+        # Input tokens of the requests inside admit() that are not admitted yet
+        self._waiting: list[int] = []
+        # kind ("requests"/"tokens") -> (remaining, valid until) as reported by the provider
+        self._server: dict[str, tuple[float, float]] = {}
+        self._stats: dict[str, float] = {"admitted": 0, "delayed": 0, "wait_total": 0.0}
+
+    def _prune(self, now: float) -> None:
+        horizon = now - self.window
+        while self._log and self._log[0].at <= horizon:
+            self._tokens -= self._log.popleft().tokens
+
+    def delay(self, tokens: int = 0) -> float:
+        """Seconds until a request of *tokens* input tokens would be admitted."""
+        now = time.monotonic()
+        self._prune(now)
+        return self._delay_in(self._log, self._tokens, self._server, now, tokens)
+
+    def queue_delay(self, tokens: int = 0) -> float:
+        """Like :meth:`delay`, but behind the requests already waiting in :meth:`admit`.
+
+        The waiters are admitted (in order) on a copy of the window first.
+        """
+        now = time.monotonic()
+        self._prune(now)
+        log = deque(self._log)
+        used = self._tokens
+        server = dict(self._server)
+        at = now
+        for need in (*self._waiting, tokens):
+            at += self._delay_in(log, used, server, at, need)
+            while log and log[0].at <= at - self.window:
+                used -= log.popleft().tokens
+            log.append(Admission(at=at, tokens=need))
+            used += need
+            for kind, amount in (("requests", 1), ("tokens", need)):
+                if kind in server:
+                    remaining, valid_until = server[kind]
+                    server[kind] = (remaining - amount, valid_until)
+        return at - now
+
+    def _delay_in(
+        self,
+        log: deque[Admission],
+        used: int,
+        server: dict[str, tuple[float, float]],
+        now: float,
+        tokens: int,
+    ) -> float:
+        # *log* is pruned to the window ending at *now* and holds *used* tokens
+        until = now
+        excess = len(log) - self.rpm + 1
+        if excess > 0:
+            until = max(until, log[excess - 1].at + self.window)
+        if self.tpm is not None and used + tokens > self.tpm:
+            # A request above the whole budget waits for an empty window
+            needed = min(used + tokens - self.tpm, used)
+            freed = 0
+            for entry in log:
+                freed += entry.tokens
+                if freed >= needed:
+                    until = max(until, entry.at + self.window)
+                    break
+        for kind, need in (("requests", 1), ("tokens", tokens)):
+            remaining, valid_until = server.get(kind, (0.0, 0.0))
+            if valid_until > now and remaining < max(need, 1):
+                until = max(until, valid_until)
+        return until - now
+
+    async def admit(self, tokens: int = 0) -> Admission:
+        """Wait (FIFO) until the window has room, then record the request."""
+        self._waiting.append(tokens)
+        try:
+            async with self._lock:
+                return await self._admit_locked(tokens)
+        finally:
+            self._waiting.remove(tokens)
+
+    async def _admit_locked(self, tokens: int) -> Admission:
+        started = time.monotonic()
+        delay = self.delay(tokens)
+        if delay > 0:
+            self._stats["delayed"] += 1
+            logger.info("model_rate_limit_wait", model=self.model, delay=round(delay, 2), tokens=tokens)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay(tokens)
+        admission = Admission(at=time.monotonic(), tokens=tokens, limit=self)
+        self._log.append(admission)
+        self._tokens += tokens
+        self._consume_server("requests", 1)
+        self._consume_server("tokens", tokens)
+        self._stats["admitted"] += 1
+        self._stats["wait_total"] += admission.at - started
+        return admission
+
+    def settle(self, admission: Admission, tokens: int) -> None:
+        extra = tokens - admission.tokens
+        now = time.monotonic()
+        self._prune(now)
+        if admission.at > now - self.window:  # still in the log
+            self._tokens += extra
+        admission.tokens = tokens
+        self._consume_server("tokens", extra)
+
+    def _consume_server(self, kind: str, amount: float) -> None:
+        if kind in self._server:
+            remaining, valid_until = self._server[kind]
+            self._server[kind] = (remaining - amount, valid_until)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Adopt the provider's ``x-ratelimit-remaining-*`` for its reset period."""
+        now = time.monotonic()
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                value = float(remaining)
+            except ValueError:
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}") or "")
+            self._server[kind] = (value, now + (reset if reset is not None else self.window))
+
+    def status(self) -> dict[str, Any]:
+        self._prune(time.monotonic())
+        admitted = int(self._stats["admitted"])
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_in_window": len(self._log),
+            "tokens_in_window": self._tokens,
+            "waiting": len(self._waiting),
+            "admitted": admitted,
+            "delayed": int(self._stats["delayed"]),
+            "avg_wait_ms": round(self._stats["wait_total"] / admitted * 1000, 1) if admitted else 0.0,
+        }
+
 
 @dataclass
 class UserQuota:
@@ -63,6 +361,17 @@ class UserQuota:
     used_tokens: int = 0
     used_cost_usd: float = 0.0
     reset_at: float = field(default_factory=lambda: 0.0)
+    loaded: bool = False  # usage so far today read from usage_stats
+
+    # Held by in-flight requests (see RateLimiter.reserve); not reset at midnight
+    reserved_requests: int = 0
+    reserved_tokens: int = 0
+    reserved_cost_usd: float = 0.0
+
+    # Every usage ever consumed (never reset); lets a load add what arrived while it read
+    consumed_requests: int = 0
+    consumed_tokens: int = 0
+    consumed_cost_usd: float = 0.0
 
     def _check_reset(self) -> None:
         now = time.time()
@@ -80,41 +389,124 @@ class UserQuota:
     def check(self, estimated_tokens: int = 0, estimated_cost: float = 0.0) -> tuple[bool, str]:
         """Check if user has remaining quota."""
         self._check_reset()
-        if self.used_requests >= self.daily_requests:
+        if self.used_requests + self.reserved_requests >= self.daily_requests:
             return False, "Dzienny limit zapytań wyczerpany"
-        if self.used_tokens + estimated_tokens > self.daily_tokens:
+        if self.used_tokens + self.reserved_tokens + estimated_tokens > self.daily_tokens:
             return False, "Dzienny limit tokenów wyczerpany"
-        if self.used_cost_usd + estimated_cost > self.daily_cost_usd:
+        if self.used_cost_usd + self.reserved_cost_usd + estimated_cost > self.daily_cost_usd:
             return False, "Dzienny limit kosztów wyczerpany"
         return True, ""
 
-    def consume(self, tokens: int, cost: float) -> None:
+    def hold(self, tokens: int, cost: float) -> None:
+        self.reserved_requests += 1
+        self.reserved_tokens += tokens
+        self.reserved_cost_usd += cost
+
+    def unhold(self, tokens: int, cost: float) -> None:
+        self.reserved_requests = max(0, self.reserved_requests - 1)
+        self.reserved_tokens = max(0, self.reserved_tokens - tokens)
+        self.reserved_cost_usd = max(0.0, self.reserved_cost_usd - cost)
+
+    def consume(self, tokens: int, cost: float, requests: int = 1) -> None:
         self._check_reset()
-        self.used_requests += 1
+        self.used_requests += requests
         self.used_tokens += tokens
         self.used_cost_usd += cost
+        self.consumed_requests += requests
+        self.consumed_tokens += tokens
+        self.consumed_cost_usd += cost
+
+    def consumed(self) -> tuple[int, int, float]:
+        return self.consumed_requests, self.consumed_tokens, self.consumed_cost_usd
+
+    def load(self, stats: dict[str, Any], consumed_before: tuple[int, int, float] | None = None) -> None:
+        """Replace the usage with today's ``usage_stats`` row (:func:`db.get_daily_stats`).
+
+        Usage consumed after *consumed_before* (taken before the row was read)
+        may be missing from the row and is added on top of it.
+        """
+        self._check_reset()
+        self.used_requests = int(stats.get("total_requests") or 0)
+        self.used_tokens = int(
+            (stats.get("total_tokens_in") or 0)
+            + (stats.get("total_tokens_out") or 0)
+            + (stats.get("total_reasoning_tokens") or 0)
+        )
+        self.used_cost_usd = float(stats.get("total_cost_usd") or 0.0)
+        if consumed_before is not None:
+            requests, tokens, cost = consumed_before
+            self.used_requests += self.consumed_requests - requests
+            self.used_tokens += self.consumed_tokens - tokens
+            self.used_cost_usd += self.consumed_cost_usd - cost
+        self.loaded = True
 
     def remaining(self) -> dict[str, Any]:
         self._check_reset()
         return {
-            "requests": max(0, self.daily_requests - self.used_requests),
-            "tokens": max(0, self.daily_tokens - self.used_tokens),
-            "cost_usd": round(max(0.0, self.daily_cost_usd - self.used_cost_usd), 4),
+            "requests": max(0, self.daily_requests - self.used_requests - self.reserved_requests),
+            "tokens": max(0, self.daily_tokens - self.used_tokens - self.reserved_tokens),
+            "cost_usd": round(
+                max(0.0, self.daily_cost_usd - self.used_cost_usd - self.reserved_cost_usd), 4
+            ),
         }
 
 
+@dataclass
+class Reservation:
+    """Budget held for one in-flight request until it is committed or released."""
+
+    user_id: int
+    model: str
+    tokens: int
+    cost_usd: float
+    settled: bool = False
+
+
+async def _load_daily_usage(user_id: int) -> dict[str, Any]:
+    return await get_daily_stats(user_id, strict=True)
+
+
 class RateLimiter:
     """Manages rate limits for multiple models and user quotas."""
 
-    def __init__(self) -> None:
-        self._model_buckets: dict[str, TokenBucket] = {}
-        self._user_quotas: dict[int, UserQuota] = {}
+    def __init__(
+        self,
+        *,
+        daily_requests: int | None = None,
+        daily_tokens: int | None = None,
+        daily_cost_usd: float | None = None,
+        max_users: int = 10_000,
+        load_usage: Callable[[int], Awaitable[dict[str, Any]]] | None = None,
+        model_rpm: int | None = None,
+        model_tpm: int | None = None,
+        max_model_wait: float = 30.0,
+    ) -> None:
+        self._model_limits: dict[str, ModelRateLimit] = {}
+        # Limits of models not registered with add_model_limit (None = unlimited)
+        self.model_rpm = model_rpm
+        self.model_tpm = model_tpm
+        # Requests that would queue longer than this for their model are refused up front
+        self.max_model_wait = max_model_wait
+        self._user_quotas: OrderedDict[int, UserQuota] = OrderedDict()
         self._global_bucket = TokenBucket(capacity=120, refill_rate=2.0)
-
-    def add_model_limit(self, model_name: str, rpm: int) -> None:
-        self._model_buckets[model_name] = TokenBucket(
-            capacity=rpm, refill_rate=rpm / 60.0
-        )
+        self.daily_requests = daily_requests if daily_requests is not None else settings.daily_request_cap
+        self.daily_tokens = daily_tokens if daily_tokens is not None else settings.daily_token_cap
+        self.daily_cost_usd = daily_cost_usd if daily_cost_usd is not None else settings.daily_cost_cap_usd
+        self.max_users = max_users
+        # Today's usage_stats row of a user; must raise (not return {}) on errors
+        self._load_usage = load_usage or _load_daily_usage
+
+    def add_model_limit(self, model_name: str, rpm: int, tpm: int | None = None) -> None:
+        self._model_limits[model_name] = ModelRateLimit(rpm, tpm, model=model_name)
+
+    def model_limit(self, model_name: str) -> ModelRateLimit | None:
+        """The model's limit; created from the defaults for unregistered models."""
+        limit = self._model_limits.get(model_name)
+        if limit is None and model_name and self.model_rpm:
+            limit = self._model_limits[model_name] = ModelRateLimit(
+                self.model_rpm, self.model_tpm, model=model_name
+            )
+        return limit
 
     def set_user_quota(
         self,
@@ -123,16 +515,59 @@ class RateLimiter:
         daily_tokens: int = 500_000,
         daily_cost_usd: float = 5.0,
     ) -> None:
-        self._user_quotas[user_id] = UserQuota(
-            daily_requests=daily_requests,
-            daily_tokens=daily_tokens,
-            daily_cost_usd=daily_cost_usd,
-        )
+        quota = self._get_user_quota(user_id)
+        quota.daily_requests = daily_requests
+        quota.daily_tokens = daily_tokens
+        quota.daily_cost_usd = daily_cost_usd
 
     def _get_user_quota(self, user_id: int) -> UserQuota:
-        if user_id not in self._user_quotas:
-            self._user_quotas[user_id] = UserQuota()
-        return self._user_quotas[user_id]
+        quota = self._user_quotas.get(user_id)
+        if quota is None:
+            quota = UserQuota(
+                daily_requests=self.daily_requests,
+                daily_tokens=self.daily_tokens,
+                daily_cost_usd=self.daily_cost_usd,
+            )
+            self._user_quotas[user_id] = quota
+            self._evict()
+        else:
+            self._user_quotas.move_to_end(user_id)
+        return quota
+
+    def _evict(self) -> None:
+        excess = len(self._user_quotas) - self.max_users
+        if excess <= 0:
+            return
+        # Quotas holding reservations stay until they are settled; the newest is in use
+        newest = next(reversed(self._user_quotas))
+        victims: list[int] = []
+        for user_id, quota in self._user_quotas.items():
+            if len(victims) == excess:
+                break
+            if user_id != newest and not quota.reserved_requests:
+                victims.append(user_id)
+        for user_id in victims:
+            del self._user_quotas[user_id]
+
+    async def load_user_quota(self, user_id: int) -> UserQuota:
+        """The user's quota, with today's usage read from the DB on first use."""
+        quota = self._get_user_quota(user_id)
+        if not quota.loaded:
+            # Usage hooks may fire while the row is read; the load keeps them
+            consumed_before = quota.consumed()
+            try:
+                stats = await self._load_usage(user_id)
+            except Exception as exc:
+                # Enforce what is known in memory; retry the load next time
+                logger.warning("quota_load_failed", user_id=user_id, error=str(exc))
+                return quota
+            if not stats:
+                # An empty row means the read failed, not "no usage today" (that row has zeros)
+                logger.warning("quota_load_failed", user_id=user_id, error="empty usage row")
+                return quota
+            if not quota.loaded:  # a concurrent request may have loaded it meanwhile
+                quota.load(stats, consumed_before)
+        return quota
 
     async def check_and_acquire(
         self,
@@ -143,7 +578,7 @@ class RateLimiter:
     ) -> tuple[bool, str]:
         """Check all limits and acquire slots if possible."""
         # 1. User quota
-        quota = self._get_user_quota(user_id)
+        quota = await self.load_user_quota(user_id)
         ok, reason = quota.check(estimated_tokens, estimated_cost)
         if not ok:
             logger.warning("quota_exceeded", user_id=user_id, reason=reason)
@@ -153,16 +588,75 @@ class RateLimiter:
         if not await self._global_bucket.acquire():
             return False, "Globalny limit zapytań — spróbuj za chwilę"
 
-        # 3. Model rate limit
-        bucket = self._model_buckets.get(model_name)
-        if bucket and not await bucket.acquire():
+        # 3. Model rate limit — short waits are queued by the API client, long ones refused
+        limit = self.model_limit(model_name)
+        if limit and limit.queue_delay() > self.max_model_wait:
             return False, f"Rate limit modelu {model_name} — spróbuj za chwilę"
 
         return True, ""
 
-    def record_usage(self, user_id: int, tokens: int, cost: float) -> None:
+    async def reserve(
+        self,
+        user_id: int,
+        model_name: str,
+        *,
+        prompt_tokens: int,
+        max_tokens: int,
+    ) -> tuple[Reservation | None, str]:
+        """Check all limits and hold the worst-case usage of one request.
+
+        The estimate assumes the whole *max_tokens* is generated.  Returns
+        ``(None, reason)`` when a limit would be exceeded.
+        """
+        tokens = prompt_tokens + max_tokens
+        cost = calculate_cost(prompt_tokens, max_tokens, 0)
+        ok, reason = await self.check_and_acquire(user_id, model_name, tokens, cost)
+        if not ok:
+            return None, reason
+        # No await since the check, so concurrent reservations cannot both pass it
+        self._get_user_quota(user_id).hold(tokens, cost)
+        return Reservation(user_id=user_id, model=model_name, tokens=tokens, cost_usd=cost), ""
+
+    def commit(self, reservation: Reservation, tokens: int | None = None, cost: float | None = None) -> None:
+        """Settle *reservation* once the request's actual usage is known.
+
+        Usage saved with :func:`db.save_message_pair_and_stats` already
+        reached the quota through the usage hook, so handlers commit after
+        persisting without amounts; pass *tokens*/*cost* for usage that is
+        not saved to ``usage_stats``.
+        """
+        if self._settle(reservation) and tokens is not None:
+            self.record_usage(reservation.user_id, tokens, cost or 0.0)
+
+    def commit_after_save(self, reservation: Reservation, saved: bool, tokens: int, cost: float) -> None:
+        """Settle *reservation* after persisting the exchange.
+
+        A *saved* exchange reached the quota through the usage hook; when the
+        save failed the spent *tokens*/*cost* are charged here instead.
+        """
+        if saved:
+            self.commit(reservation)
+        else:
+            self.commit(reservation, tokens, cost)
+
+    def release(self, reservation: Reservation | None) -> None:
+        """Hand back *reservation* unused (failed or cancelled request); idempotent."""
+        if reservation is not None:
+            self._settle(reservation)
+
+    def _settle(self, reservation: Reservation) -> bool:
+        if reservation.settled:
+            return False
+        reservation.settled = True
+        quota = self._user_quotas.get(reservation.user_id)
+        if quota is not None:
+            quota.unhold(reservation.tokens, reservation.cost_usd)
+        return True
+
+    def record_usage(self, user_id: int, tokens: int, cost: float, requests: int = 1) -> None:
+        """Add usage to the user's quota (registered as a :func:`db.add_usage_hook`)."""
         quota = self._get_user_quota(user_id)
-        quota.consume(tokens, cost)
+        quota.consume(tokens, cost, requests)
 
     def get_user_remaining(self, user_id: int) -> dict[str, Any]:
         return self._get_user_quota(user_id).remaining()
@@ -170,8 +664,8 @@ class RateLimiter:
     def status(self) -> dict[str, Any]:
         return {
             "global_available": self._global_bucket.available,
-            "models": {
-                name: bucket.available for name, bucket in self._model_buckets.items()
-            },
+            "global_waiting": self._global_bucket.waiting,
+            "models": {name: limit.status() for name, limit in self._model_limits.items()},
             "users_tracked": len(self._user_quotas),
+            "reservations": sum(q.reserved_requests for q in self._user_quotas.values()),
         }
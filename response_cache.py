@@ -0,0 +1,183 @@
+"""Exact-match cache of answers to deterministic commands.
+
+``/websearch``, ``/xsearch``, ``/collectionsearch`` and ``/fast`` are often
+repeated verbatim — by the same user or by different ones — within minutes.
+:class:`ResponseCache` stores the final answer under a key built from
+``(command, model, normalised prompt, tool set, context)`` and serves
+repeats without an API call:
+
+- an in-memory LRU answers hot keys without touching SQLite,
+- the ``response_cache`` table keeps entries across restarts and LRU
+  evictions; a DB hit is promoted back into memory,
+- every command has its own TTL (``RESPONSE_CACHE_TTL_<COMMAND>_S``,
+  ``0`` = not cached), so X search results go stale faster than
+  collection searches.
+
+*context* covers whatever else shaped the answer — for ``/fast`` the system
+prompt — so a cached answer is only reused for an identical request.
+``/fast`` is only cached for a first turn: with history in the prompt the key
+would never repeat.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import structlog
+
+from config import settings
+from db import delete_cached_responses, get_cached_response, put_cached_response
+
+logger = structlog.get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """One cached answer."""
+
+    command: str
+    model: str
+    content: str
+    created_at: float
+    expires_at: float
+
+    @property
+    def age(self) -> float:
+        return max(time.time() - self.created_at, 0.0)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive form of *prompt* used in cache keys."""
+    return " ".join(prompt.split()).casefold()
+
+
+def make_cache_key(
+    command: str,
+    model: str,
+    prompt: str,
+    tools: list[dict[str, Any]] | None = None,
+    context: Any = None,
+) -> str:
+    """Stable digest of everything that determines the answer."""
+    material = json.dumps(
+        [command, model, normalize_prompt(prompt), tools or [], context],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU in front of the SQLite ``response_cache`` table."""
+
+    def __init__(self, max_entries: int = 512, ttls: dict[str, float] | None = None) -> None:
+        self.max_entries = max_entries
+        self.ttls: dict[str, float] = dict(ttls or {})
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._stats: dict[str, int] = {"hits": 0, "db_hits": 0, "misses": 0, "stores": 0}
+
+    def ttl_for(self, command: str) -> float:
+        return self.ttls.get(command, 0.0)
+
+    def enabled_for(self, command: str) -> bool:
+        return settings.response_cache_enabled and self.ttl_for(command) > 0
+
+    async def get(self, command: str, key: str) -> CachedResponse | None:
+        """Return the live entry for *key*, or ``None``."""
+        if not self.enabled_for(command):
+            return None
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            del self._entries[key]
+
+        row = await get_cached_response(key)
+        if row is not None and row["expires_at"] > now:
+            entry = CachedResponse(
+                command=row["command"],
+                model=row["model"] or "",
+                content=row["content"],
+                created_at=row["created_at"],
+                expires_at=row["expires_at"],
+            )
+            self._remember(key, entry)
+            self._stats["db_hits"] += 1
+            return entry
+
+        self._stats["misses"] += 1
+        return None
+
+    async def put(self, command: str, key: str, content: str, model: str = "") -> None:
+        """Store *content* for *key* with the command's TTL."""
+        ttl = self.ttl_for(command)
+        if not self.enabled_for(command) or not content.strip():
+            return
+        now = time.time()
+        entry = CachedResponse(
+            command=command,
+            model=model,
+            content=content,
+            created_at=now,
+            expires_at=now + ttl,
+        )
+        self._remember(key, entry)
+        self._stats["stores"] += 1
+        await put_cached_response(key, command, model, content, now, entry.expires_at)
+
+    async def purge(self, command: str | None = None) -> int:
+        """Drop all entries (or those of *command*); return how many DB rows went."""
+        if command is None:
+            self._entries.clear()
+        else:
+            for key in [k for k, e in self._entries.items() if e.command == command]:
+                del self._entries[key]
+        removed = await delete_cached_responses(command)
+        logger.info("response_cache_purged", command=command or "*", removed=removed)
+        return removed
+
+    def _remember(self, key: str, entry: CachedResponse) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def status(self) -> dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["db_hits"] + self._stats["misses"]
+        hits = self._stats["hits"] + self._stats["db_hits"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            **self._stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache."""
+    global _cache  # noqa: PLW0603
+    if _cache is None:
+        _cache = ResponseCache(
+            max_entries=settings.response_cache_max_entries,
+            ttls={
+                "websearch": settings.response_cache_ttl_websearch_s,
+                "xsearch": settings.response_cache_ttl_xsearch_s,
+                "collectionsearch": settings.response_cache_ttl_collectionsearch_s,
+                "fast": settings.response_cache_ttl_fast_s,
+            },
+        )
+    return _cache
@@ -0,0 +1,169 @@
+"""Retry policy with full-jitter backoff, ``Retry-After`` and a deadline budget.
+
+Shared by the xAI clients, the ``ask_claude`` bridge and the upload scripts
+instead of each keeping its own fixed delay table.  A :class:`RetryPolicy`
+is immutable configuration; :meth:`RetryPolicy.start` returns a
+:class:`RetryState` for one logical request::
+
+    retry = policy.start()
+    while True:
+        try:
+            return await do_request()
+        except Exception as exc:
+            delay = retry.next_delay(exc)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+Delays use *full jitter* (``uniform(0, base * 2**attempt)``) so concurrent
+users that failed together do not retry in lockstep.  Server hints —
+``Retry-After`` or ``x-ratelimit-reset-*`` — take precedence over the
+computed backoff.  Retrying stops once the next attempt would start after
+the deadline.
+
+This module has no dependency on ``config`` so standalone scripts can use it.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+import httpx
+
+# Transient server-side failures.  529 is Anthropic's "overloaded".
+RETRYABLE_STATUSES: frozenset[int] = frozenset({408, 425, 429, 500, 502, 503, 504, 529})
+# Statuses where the server certainly did not act on the request
+_REJECTED_STATUSES: frozenset[int] = frozenset({408, 425, 429, 503, 529})
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS: dict[str, float] = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RetryableError(Exception):
+    """A failure reported inside a response body (e.g. an SSE ``error`` event)
+    that is safe to retry."""
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse ``"2"``, ``"1.5s"``, ``"250ms"`` or ``"6m0s"`` into seconds."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def retry_after_hint(response: httpx.Response) -> float | None:
+    """Return the server-requested wait in seconds, if the response has one."""
+    headers = response.headers
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            when = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            when = None
+        if when is not None:
+            return max(when.timestamp() - time.time(), 0.0)
+
+    # OpenAI-style rate-limit headers; only exhausted budgets are relevant
+    resets: list[float] = []
+    for kind in ("requests", "tokens"):
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        reset = headers.get(f"x-ratelimit-reset-{kind}")
+        if reset is None or (remaining is not None and remaining.strip() not in ("0", "")):
+            continue
+        seconds = parse_duration(reset)
+        if seconds is not None:
+            resets.append(seconds)
+    return max(resets) if resets else None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often and how long to retry one logical request.
+
+    *idempotent* requests may be retried after the server might already have
+    acted on them (5xx, read errors mid-response); non-idempotent ones
+    (uploads) only when the request was certainly not processed.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    deadline: float = 300.0
+    idempotent: bool = True
+    retry_statuses: frozenset[int] = RETRYABLE_STATUSES
+    rng: Callable[[float, float], float] = field(default=random.uniform, compare=False, repr=False)
+
+    def start(self) -> RetryState:
+        return RetryState(self)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before retry number *attempt* (0-based)."""
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return self.rng(0.0, cap)
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        if isinstance(exc, RetryableError):
+            return True
+        if isinstance(exc, httpx.HTTPStatusError):
+            status = exc.response.status_code
+            if status not in self.retry_statuses:
+                return False
+            return self.idempotent or status in _REJECTED_STATUSES
+        if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            # Nothing reached the server
+            return True
+        if isinstance(exc, httpx.TransportError):
+            return self.idempotent
+        return False
+
+    def delay_for(self, attempt: int, exc: BaseException) -> float:
+        """Delay before retry *attempt* after *exc*, honouring server hints."""
+        if isinstance(exc, httpx.HTTPStatusError):
+            hint = retry_after_hint(exc.response)
+            if hint is not None:
+                # Small jitter on top so clients released together spread out
+                return hint + self.rng(0.0, self.base_delay)
+            if exc.response.status_code == 429:
+                return max(self.backoff(attempt), self.base_delay)
+        return self.backoff(attempt)
+
+
+class RetryState:
+    """Attempt counter and deadline for one logical request."""
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        self.policy = policy
+        self.attempt = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def remaining(self) -> float:
+        return self.policy.deadline - (time.monotonic() - self.started_at)
+
+    def next_delay(self, exc: BaseException) -> float | None:
+        """Return the delay before the next attempt, or ``None`` to give up."""
+        if not self.policy.is_retryable(exc):
+            return None
+        if self.attempt + 1 >= self.policy.max_attempts:
+            return None
+        delay = self.policy.delay_for(self.attempt, exc)
+        if delay > self.remaining:
+            return None
+        self.attempt += 1
+        return delay
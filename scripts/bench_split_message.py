@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Benchmark message splitting on large answers.
+
+Compares the previous copy-the-tail ``split_message`` with the current
+index-based one, and measures ``split_html_message`` on the HTML produced by
+``markdown_to_telegram_html`` for the same input.
+
+Usage:
+    python scripts/bench_split_message.py
+    python scripts/bench_split_message.py --sizes 10000 100000 1000000 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import markdown_to_telegram_html, split_html_message, split_message  # noqa: E402
+
+
+def legacy_split_message(text: str, max_length: int = 4000) -> list[str]:
+    """``split_message`` as it was before the index-based rewrite."""
+    if len(text) <= max_length:
+        return [text]
+
+    parts: list[str] = []
+    remaining = text
+    while remaining:
+        if len(remaining) <= max_length:
+            parts.append(remaining)
+            break
+        chunk = remaining[:max_length]
+        if chunk.count("```") % 2 != 0:
+            last_open = chunk.rfind("```")
+            if last_open > 0:
+                chunk = chunk[:last_open]
+        split_pos = len(chunk)
+        for sep in ("\n\n", "\n", " "):
+            pos = chunk.rfind(sep)
+            if pos > 0:
+                split_pos = pos
+                break
+        parts.append(remaining[:split_pos])
+        remaining = remaining[split_pos:].lstrip("\n")
+    return parts if parts else [text]
+
+
+def make_answer(size: int, seed: int = 0) -> str:
+    """Build a Markdown answer resembling a long file analysis."""
+    rnd = random.Random(seed)
+    pieces: list[str] = []
+    total = 0
+    while total < size:
+        kind = rnd.random()
+        if kind < 0.15:
+            body = "\n".join(f"    value_{i} = compute({i}) < limit" for i in range(rnd.randint(3, 40)))
+            piece = f"```python\n{body}\n```\n\n"
+        elif kind < 0.3:
+            piece = f"- **Punkt {rnd.randint(1, 99)}**: `module.func()` & *uwaga*\n"
+        else:
+            words = " ".join(rnd.choice(["analiza", "pliku", "wynik", "kod", "funkcja", "dane"])
+                             for _ in range(rnd.randint(20, 120)))
+            piece = f"{words}.\n\n"
+        pieces.append(piece)
+        total += len(piece)
+    return "".join(pieces)[:size]
+
+
+def bench(func: Callable[[str], list[str]], text: str, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    parts: list[str] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parts = func(text)
+        best = min(best, time.perf_counter() - started)
+    return best, len(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark split_message implementations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'legacy ms':>10} {'split ms':>10} {'html ms':>10} {'parts':>6}")
+    for size in args.sizes:
+        text = make_answer(size)
+        html = markdown_to_telegram_html(text)
+        legacy_time, legacy_parts = bench(legacy_split_message, text, args.repeat)
+        new_time, new_parts = bench(split_message, text, args.repeat)
+        html_time, _ = bench(split_html_message, html, args.repeat)
+        if legacy_parts != new_parts:
+            print(f"  ! part count differs: {legacy_parts} vs {new_parts}")
+        print(
+            f"{size:>10} {legacy_time * 1000:>10.2f} {new_time * 1000:>10.2f} "
+            f"{html_time * 1000:>10.2f} {new_parts:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
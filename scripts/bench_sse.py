@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for SSE token-stream decoding.
+
+Builds a synthetic xAI Responses stream (``response.output_text.delta``
+events split into network-sized chunks) and measures events/s for:
+
+- ``legacy`` — line decoding + ``strip``/prefix check/slice + ``json.loads``
+  per line, as the clients did with ``aiter_lines()``,
+- ``sse+json`` — :class:`sse.SSEDecoder` with the stdlib fallback decoder,
+- ``sse+orjson`` — :class:`sse.SSEDecoder` with ``orjson`` (if installed).
+
+Usage:
+    python scripts/bench_sse.py
+    python scripts/bench_sse.py --events 200000 --chunk-size 1024 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sse import JsonLoader, SSEDecoder, stdlib_loads  # noqa: E402
+
+
+def make_stream(events: int, chunk_size: int) -> list[bytes]:
+    """Return a Responses-API-like SSE body split into *chunk_size* byte chunks."""
+    lines = []
+    for i in range(events):
+        payload = {"type": "response.output_text.delta", "item_id": "msg_1", "delta": f"tok{i % 97} "}
+        lines.append(
+            "event: response.output_text.delta\n"
+            f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        )
+    body = "".join(lines).encode()
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+def run_legacy(chunks: list[bytes]) -> int:
+    """Emulate ``aiter_lines()`` + per-line parsing used before ``sse.py``."""
+    count = 0
+    buffer = ""
+    for chunk in chunks:
+        text = buffer + chunk.decode("utf-8")
+        lines = text.splitlines(keepends=True)
+        buffer = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        for raw_line in lines:
+            line = raw_line.strip()
+            if not line or not line.startswith("data:"):
+                continue
+            data_str = line[5:].strip()
+            if data_str == "[DONE]":
+                return count
+            try:
+                json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            count += 1
+    return count
+
+
+def make_sse_runner(loads: JsonLoader) -> Callable[[list[bytes]], int]:
+    def run(chunks: list[bytes]) -> int:
+        decoder = SSEDecoder()
+        count = 0
+        for chunk in chunks:
+            for event in decoder.feed(chunk):
+                loads(event.data)
+                count += 1
+        return count
+
+    return run
+
+
+def bench(func: Callable[[list[bytes]], Any], chunks: list[bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(chunks)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SSE decoding throughput")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    chunks = make_stream(args.events, args.chunk_size)
+    runners: dict[str, Callable[[list[bytes]], Any]] = {
+        "legacy": run_legacy,
+        "sse+json": make_sse_runner(stdlib_loads),
+    }
+    try:
+        import orjson
+
+        runners["sse+orjson"] = make_sse_runner(orjson.loads)
+    except ImportError:
+        print("orjson not installed — skipping sse+orjson")
+
+    print(f"{args.events} events, {len(chunks)} chunks of {args.chunk_size} B")
+    for name, func in runners.items():
+        elapsed = bench(func, chunks, args.repeat)
+        print(f"{name:>12}: {args.events / elapsed:>12,.0f} events/s ({elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Benchmark ``TokenBucket.wait_and_acquire`` with many concurrent waiters.
+
+Starts N waiters at once on an empty bucket and compares:
+
+- ``legacy`` — the previous bucket: lock + ``asyncio.sleep(0.1)`` polling,
+- ``fifo`` — :class:`rate_limiter.TokenBucket` (waiter queue, exact timer).
+
+Reported per implementation: wall time until the last waiter is served, CPU
+time of the process, how many times the bucket state was checked, mean and
+max lateness of a grant versus its ideal FIFO time, and whether grants came
+in arrival order.
+
+Usage:
+    python scripts/bench_token_bucket.py
+    python scripts/bench_token_bucket.py --waiters 1000 --rate 2000 --capacity 20 --weights 1 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rate_limiter import TokenBucket  # noqa: E402
+
+
+@dataclass
+class LegacyTokenBucket:
+    """``TokenBucket`` as it was before the waiter queue."""
+
+    capacity: int
+    refill_rate: float
+    checks: int = 0
+    _tokens: float = field(init=False)
+    _last_refill: float = field(init=False)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+
+    async def acquire(self, tokens: float = 1) -> bool:
+        async with self._lock:
+            self.checks += 1
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.refill_rate)
+            self._last_refill = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    async def wait_and_acquire(self, tokens: float = 1, timeout: float = 30.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if await self.acquire(tokens):
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+
+class CountingTokenBucket(TokenBucket):
+    """``TokenBucket`` that counts state checks (refills) for comparison."""
+
+    checks: int = 0
+
+    def _refill(self) -> None:
+        self.checks += 1
+        super()._refill()
+
+
+async def run(bucket: Any, weights: list[float], timeout: float) -> dict[str, Any]:
+    granted: list[tuple[int, float]] = []
+    started = time.monotonic()
+
+    async def waiter(i: int, tokens: float) -> None:
+        if await bucket.wait_and_acquire(tokens, timeout=timeout):
+            granted.append((i, time.monotonic() - started))
+
+    cpu = time.process_time()
+    await asyncio.gather(*(waiter(i, w) for i, w in enumerate(weights)))
+    cpu = time.process_time() - cpu
+    wall = time.monotonic() - started
+
+    # Ideal FIFO schedule of an empty bucket: each grant when its cumulative weight has refilled
+    ideal: list[float] = []
+    total = 0.0
+    for w in weights:
+        total += w
+        ideal.append(total / bucket.refill_rate)
+    lateness = [at - ideal[i] for i, at in granted]
+    order = [i for i, _ in granted]
+    return {
+        "served": len(granted),
+        "wall": wall,
+        "cpu": cpu,
+        "checks": bucket.checks,
+        "late_mean": sum(lateness) / len(lateness) if lateness else 0.0,
+        "late_max": max(lateness, default=0.0),
+        "fifo": order == sorted(order),
+    }
+
+
+async def bench(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    weights = [float(rng.choice(args.weights)) for _ in range(args.waiters)]
+    # Enough time for every waiter even in the legacy bucket
+    timeout = sum(weights) / args.rate + 5.0
+    print(
+        f"{args.waiters} waiters, weights {args.weights}, capacity {args.capacity}, {args.rate:g} tokens/s "
+        f"(ideal drain {sum(weights) / args.rate:.2f} s)"
+    )
+    for name, factory in (("legacy", LegacyTokenBucket), ("fifo", CountingTokenBucket)):
+        bucket = factory(capacity=max(args.capacity, *args.weights), refill_rate=args.rate)
+        await bucket.acquire(bucket.capacity)  # start empty
+        result = await run(bucket, weights, timeout)
+        print(
+            f"{name:>7}: served {result['served']}/{args.waiters} in {result['wall']:.2f} s | "
+            f"cpu {result['cpu'] * 1000:.0f} ms | checks {result['checks']:,} | "
+            f"late mean {result['late_mean'] * 1000:.0f} ms max {result['late_max'] * 1000:.0f} ms | "
+            f"fifo {'yes' if result['fifo'] else 'no'}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark TokenBucket waiters")
+    parser.add_argument("--waiters", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="refill rate, tokens/s")
+    parser.add_argument("--capacity", type=int, default=10)
+    parser.add_argument("--weights", type=int, nargs="+", default=[1], help="token counts to draw from")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,13 +30,17 @@ import os
 import sys
 import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List
 
 try:
     import httpx
 except ImportError:
     sys.exit("Brak httpx.  Zainstaluj:  pip install httpx")
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from retry_policy import RetryPolicy  # noqa: E402
+
 # ---------------------------------------------------------------------------
 # Logging
 # ---------------------------------------------------------------------------
@@ -50,9 +54,8 @@ log = logging.getLogger("upload_collection")
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
-_MAX_RETRIES: int = 3
-_RETRY_DELAYS: tuple = (2.0, 5.0, 10.0)
-_RATE_LIMIT_DELAY: float = 5.0
+# Uploads are not idempotent: a 5xx/read error may already have created the document
+_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=30.0, deadline=120.0, idempotent=False)
 _UPLOAD_DELAY: float = 0.3  # seconds between uploads
 
 # Extensions of text files we upload (source code only)
@@ -106,35 +109,22 @@ class CollectionUploader:
             "title": name,
         }
 
-        last_error: Optional[Exception] = None
-        for attempt in range(_MAX_RETRIES):
+        retry = _RETRY_POLICY.start()
+        while True:
             try:
                 resp = self._client.post(url, json=payload)
-
-                if resp.status_code == 429:
-                    log.warning(
-                        "Rate limited (429) — czekam %.1fs (próba %d/%d)",
-                        _RATE_LIMIT_DELAY, attempt + 1, _MAX_RETRIES,
-                    )
-                    time.sleep(_RATE_LIMIT_DELAY)
-                    continue
-
                 resp.raise_for_status()
                 return resp.json()
 
             except Exception as exc:
-                last_error = exc
-                if attempt < _MAX_RETRIES - 1:
-                    delay = _RETRY_DELAYS[attempt]
-                    log.warning(
-                        "Błąd uploadu %s — retry za %.1fs (próba %d/%d): %s",
-                        name, delay, attempt + 1, _MAX_RETRIES, exc,
-                    )
-                    time.sleep(delay)
-
-        if last_error:
-            raise last_error
-        raise RuntimeError(f"Upload failed for {name} — all retries exhausted")
+                delay = retry.next_delay(exc)
+                if delay is None:
+                    raise
+                log.warning(
+                    "Błąd uploadu %s — retry za %.1fs (próba %d/%d): %s",
+                    name, delay, retry.attempt, _RETRY_POLICY.max_attempts, exc,
+                )
+                time.sleep(delay)
 
     def close(self) -> None:
         """Close the HTTP client."""
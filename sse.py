@@ -0,0 +1,180 @@
+"""Server-Sent Events decoder shared by the xAI clients.
+
+Works directly on the raw byte chunks from ``httpx.Response.aiter_bytes()``
+instead of ``aiter_lines()``: lines are split with ``bytes.split`` per chunk,
+field values stay ``bytes`` and are handed to the JSON decoder without a
+``str`` round-trip.  Framing follows the SSE spec — CR, LF and CRLF line ends,
+comments, multi-line ``data:`` fields, ``event:`` names, ``id:`` and
+``retry:`` — and an event is only dispatched on a blank line.
+
+The JSON decoder is pluggable; ``orjson`` (in requirements) is used when
+installed, with a stdlib fallback that skips ``json.loads``' bytes sniffing.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable
+
+import httpx
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+JsonLoader = Callable[[bytes], Any]
+
+_stdlib_decoder = json.JSONDecoder()
+
+
+def stdlib_loads(data: bytes) -> Any:
+    """Stdlib fallback: ``json.loads`` for UTF-8 bytes without its encoding sniffing."""
+    return _stdlib_decoder.decode(data.decode("utf-8"))
+
+
+try:
+    import orjson
+
+    json_loads: JsonLoader = orjson.loads
+except ImportError:  # pragma: no cover - depends on the environment
+    json_loads = stdlib_loads
+
+_BOM = b"\xef\xbb\xbf"
+_DONE = b"[DONE]"
+
+
+@dataclass(slots=True)
+class SSEEvent:
+    """A dispatched server-sent event; ``data`` holds the raw UTF-8 bytes."""
+
+    event: str
+    data: bytes
+    id: str | None = None
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+class SSEDecoder:
+    """Incremental SSE decoder: feed byte chunks, get complete events back."""
+
+    def __init__(self) -> None:
+        self._pending = b""
+        self._started = False
+        self._data: list[bytes] = []
+        self._event = ""
+        self._event_names: dict[bytes, str] = {}
+        self.last_event_id: str | None = None
+        self.retry: int | None = None
+
+    def feed(self, chunk: bytes) -> list[SSEEvent]:
+        """Decode *chunk* and return the events completed by it."""
+        data = self._pending + chunk if self._pending else chunk
+        if not self._started:
+            if len(data) < len(_BOM) and _BOM.startswith(data):
+                self._pending = data
+                return []
+            self._started = True
+            if data.startswith(_BOM):
+                data = data[len(_BOM):]
+
+        trailing_cr = False
+        if b"\r" in data:
+            # A CR at the very end may be the first half of a CRLF split across chunks
+            trailing_cr = data.endswith(b"\r")
+            if trailing_cr:
+                data = data[:-1]
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        lines = data.split(b"\n")
+        self._pending = lines.pop() + b"\r" if trailing_cr else lines.pop()
+
+        # Hot loop: ``data:`` / ``event:`` lines are handled inline with locals,
+        # everything else goes through _process_field.
+        events: list[SSEEvent] = []
+        data_lines = self._data
+        event_name = self._event
+        for line in lines:
+            if not line:
+                if data_lines:
+                    payload = data_lines[0] if len(data_lines) == 1 else b"\n".join(data_lines)
+                    events.append(SSEEvent(event_name or "message", payload, self.last_event_id))
+                    data_lines = []
+                event_name = ""
+            elif line.startswith(b"data:"):
+                data_lines.append(line[6:] if line[5:6] == b" " else line[5:])
+            elif line.startswith(b"event:"):
+                event_name = self._event_name(line[7:] if line[6:7] == b" " else line[6:])
+            elif line[0] != 0x3A:  # ":" starts a comment
+                self._data, self._event = data_lines, event_name
+                self._process_field(line)
+                data_lines, event_name = self._data, self._event
+        self._data, self._event = data_lines, event_name
+        return events
+
+    def _event_name(self, value: bytes) -> str:
+        # Streams reuse a handful of event names; decode each only once
+        name = self._event_names.get(value)
+        if name is None:
+            name = self._event_names[value] = value.decode("utf-8", errors="replace")
+        return name
+
+    def close(self) -> list[SSEEvent]:
+        """Finish the stream: a held-back trailing CR still ends its line."""
+        pending, self._pending = self._pending, b""
+        if pending.endswith(b"\r"):
+            return self.feed(pending[:-1] + b"\n")
+        return []
+
+    def _process_field(self, line: bytes) -> None:
+        colon = line.find(b":")
+        if colon == -1:
+            name, value = line, b""
+        else:
+            name, value = line[:colon], line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = self._event_name(value)
+        elif name == b"id":
+            if b"\0" not in value:
+                self.last_event_id = value.decode("utf-8", errors="replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+
+
+async def aiter_sse(response: httpx.Response) -> AsyncIterator[SSEEvent]:
+    """Yield events from a streaming response (an unterminated last event is dropped)."""
+    decoder = SSEDecoder()
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
+
+
+async def aiter_sse_json(
+    response: httpx.Response,
+    *,
+    loads: JsonLoader | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """Yield JSON object payloads until the OpenAI-style ``[DONE]`` sentinel.
+
+    Payloads that fail to decode or are not objects are logged and skipped.
+    """
+    decode = loads or json_loads
+    async for event in aiter_sse(response):
+        if event.data == _DONE:
+            return
+        try:
+            payload = decode(event.data)
+        except ValueError:
+            logger.warning("sse_json_decode_failed", sse_event=event.event)
+            continue
+        if isinstance(payload, dict):
+            yield payload
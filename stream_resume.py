@@ -0,0 +1,96 @@
+"""De-duplicate streamed output when a request is re-sent after a failure.
+
+Neither xAI endpoint can resume a half-finished generation, so a retried
+stream starts again from the first token.  :class:`ResumeGuard` sits between
+the SSE parser and the caller and remembers which ``content`` /
+``reasoning`` text was already delivered:
+
+- while the new attempt reproduces that text it is swallowed, and only the
+  continuation past the old end is emitted — deterministic answers resume
+  seamlessly,
+- as soon as it diverges, a ``restart`` event tells the consumer how many
+  characters of each kind to drop (``{"content": n, "reasoning": m}``),
+  followed by the new attempt's text so far.
+
+Delivered text is kept as a chunk list and joined only when a retry starts,
+so the happy path stays O(n).
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+_TEXT_EVENTS: tuple[str, ...] = ("content", "reasoning")
+
+Event = tuple[str, Any]
+
+
+class ResumeGuard:
+    """Track delivered text deltas and filter the replay of a retried stream."""
+
+    def __init__(self) -> None:
+        self._chunks: dict[str, list[str]] = {kind: [] for kind in _TEXT_EVENTS}
+        # Set while replaying: text delivered before the retry and how much of it
+        # the new attempt has reproduced so far
+        self._delivered: dict[str, str] | None = None
+        self._pos: dict[str, int] = {}
+        self.restarts = 0
+
+    @property
+    def has_output(self) -> bool:
+        return any(self._chunks[kind] for kind in _TEXT_EVENTS)
+
+    def retry(self) -> None:
+        """Call before re-sending the request after a failed attempt."""
+        if not self.has_output:
+            return
+        self._delivered = {kind: "".join(self._chunks[kind]) for kind in _TEXT_EVENTS}
+        self._pos = {kind: 0 for kind in _TEXT_EVENTS}
+
+    def feed(self, event: str, data: Any) -> list[Event]:
+        """Return the events to emit for one parsed ``(event, data)`` pair."""
+        if event not in _TEXT_EVENTS:
+            return [(event, data)]
+        text = str(data)
+        if self._delivered is None:
+            self._chunks[event].append(text)
+            return [(event, text)]
+
+        delivered = self._delivered[event]
+        pos = self._pos[event]
+        overlap = min(len(text), len(delivered) - pos)
+        if overlap > 0 and not delivered.startswith(text[:overlap], pos):
+            return self._restart(event, text)
+        self._pos[event] = pos + max(overlap, 0)
+        extra = text[max(overlap, 0):]
+        if extra:
+            self._chunks[event].append(extra)
+        if all(self._pos[k] >= len(self._delivered[k]) for k in _TEXT_EVENTS):
+            self._delivered = None
+        return [(event, extra)] if extra else []
+
+    def finish(self) -> list[Event]:
+        """Call when an attempt completes; a shorter replay becomes a restart."""
+        if self._delivered is None:
+            return []
+        return self._restart(None, "")
+
+    def _restart(self, event: str | None, text: str) -> list[Event]:
+        assert self._delivered is not None
+        # Drop everything emitted so far, including continuation text a kind
+        # produced after its own replay finished while the other kind was still
+        # replaying; that continuation is part of the new attempt's text.
+        emitted = {kind: "".join(self._chunks[kind]) for kind in _TEXT_EVENTS}
+        drop = {kind: len(emitted[kind]) for kind in _TEXT_EVENTS}
+        replayed: dict[str, str] = {}
+        for kind in _TEXT_EVENTS:
+            caught_up = self._pos[kind] >= len(self._delivered[kind])
+            replayed[kind] = emitted[kind] if caught_up else emitted[kind][: self._pos[kind]]
+        if event is not None:
+            replayed[event] += text
+        self._delivered = None
+        self.restarts += 1
+        self._chunks = {kind: [replayed[kind]] if replayed[kind] else [] for kind in _TEXT_EVENTS}
+        events: list[Event] = [("restart", drop)]
+        events.extend((kind, replayed[kind]) for kind in _TEXT_EVENTS if replayed[kind])
+        return events
@@ -0,0 +1,251 @@
+"""Shared streaming-response renderer for all Grok handlers.
+
+Every handler consumes the same ``(event_type, data)`` generator produced by
+``GrokClient.chat_stream`` / ``GrokResponsesClient.chat_stream``.  The
+:class:`StreamRenderer` owns the whole Telegram side of that loop:
+
+- accumulating ``content`` / ``reasoning`` deltas and tool usage,
+- showing partial tool output (``tool_progress``) under the tool status,
+- dropping text superseded by a retried request (``restart``),
+- preview edits of the placeholder message, paced and coalesced by
+  :class:`edit_scheduler.EditScheduler`,
+- truncation of the preview to Telegram's message size,
+- final formatting, splitting and sending of the answer,
+- persisting the exchange in the conversation history.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable
+
+import structlog
+from telegram import Message
+
+from db import calculate_cost, save_message_pair_and_stats
+from edit_scheduler import EditScheduler, get_edit_scheduler
+from utils import (
+    IncrementalMarkdownConverter,
+    escape_html,
+    markdown_to_telegram_html,
+    split_html_message,
+)
+
+logger = structlog.get_logger(__name__)
+
+PREVIEW_LIMIT: int = 3800
+TOOL_PROGRESS_TAIL: int = 600
+CONTINUATION_MARK: str = "\n\n<i>... (kontynuacja)</i>"
+
+
+@dataclass
+class StreamResult:
+    """Everything accumulated from a single streaming response."""
+
+    content: str = ""
+    reasoning: str = ""
+    usage: dict[str, Any] = field(default_factory=dict)
+    tools_used: list[str] = field(default_factory=list)
+    response_id: str = ""
+
+    @property
+    def tokens_in(self) -> int:
+        return int(self.usage.get("prompt_tokens", 0) or 0)
+
+    @property
+    def tokens_out(self) -> int:
+        return int(self.usage.get("completion_tokens", 0) or 0)
+
+    @property
+    def reasoning_tokens(self) -> int:
+        return int(self.usage.get("reasoning_tokens", 0) or 0)
+
+    @property
+    def cached_tokens(self) -> int:
+        return int(self.usage.get("cached_tokens", 0) or 0)
+
+    @property
+    def total_tokens(self) -> int:
+        """Tokens counted against the daily quota (input + output + reasoning)."""
+        return self.tokens_in + self.tokens_out + self.reasoning_tokens
+
+    @property
+    def cost(self) -> float:
+        return calculate_cost(
+            self.tokens_in, self.tokens_out, self.reasoning_tokens, self.cached_tokens
+        )
+
+
+def _tool_name(data: Any) -> str:
+    """Normalise ``tool_use`` (str) and ``tool_call`` (dict) payloads."""
+    if isinstance(data, dict):
+        return str(data.get("name") or "tool")
+    return str(data or "tool")
+
+
+class StreamRenderer:
+    """Render a Grok event stream into a Telegram message.
+
+    *sent* is the placeholder message that gets edited while streaming,
+    *reply_to* is the user's message used to send overflow parts.
+    """
+
+    def __init__(
+        self,
+        sent: Message,
+        reply_to: Message,
+        *,
+        name: str = "stream",
+        header: str = "",
+        reasoning_status: str | None = None,
+        tool_status: Callable[[str], str] | None = None,
+        preview_limit: int = PREVIEW_LIMIT,
+        scheduler: EditScheduler | None = None,
+    ) -> None:
+        self._sent = sent
+        self._reply_to = reply_to
+        self._name = name
+        self._header = header
+        self._reasoning_status = reasoning_status
+        self._tool_status = tool_status
+        self._preview_limit = preview_limit
+        self._scheduler = scheduler or get_edit_scheduler()
+        self._last_text = ""
+        self._converter = IncrementalMarkdownConverter()
+        self._frozen_preview: str | None = None
+        self._tool_output = ""
+        self.result = StreamResult()
+
+    # ------------------------------------------------------------------
+    # Streaming
+    # ------------------------------------------------------------------
+
+    async def consume(self, events: AsyncIterator[tuple[str, Any]]) -> StreamResult:
+        """Drain *events*, updating the preview message along the way.
+
+        API errors are propagated to the caller, which owns the error message.
+        """
+        result = self.result
+        async for event_type, data in events:
+            if event_type == "content":
+                delta = str(data)
+                result.content += delta
+                room = self._preview_limit - len(self._converter)
+                if room > 0:
+                    self._converter.feed(delta[:room])
+                await self._edit(self._render_preview())
+            elif event_type == "reasoning":
+                result.reasoning += str(data)
+                if self._reasoning_status:
+                    status = self._reasoning_status.format(chars=len(result.reasoning))
+                    await self._edit(f"{self._header}{status}")
+            elif event_type in ("tool_use", "tool_call"):
+                tool_name = _tool_name(data)
+                if tool_name not in result.tools_used:
+                    result.tools_used.append(tool_name)
+                self._tool_output = ""
+                if self._tool_status:
+                    await self._edit(f"{self._header}{self._tool_status(tool_name)}")
+            elif event_type == "tool_progress":
+                payload = data if isinstance(data, dict) else {}
+                self._tool_output += str(payload.get("delta", ""))
+                if self._tool_status:
+                    tail = self._tool_output[-TOOL_PROGRESS_TAIL:]
+                    status = self._tool_status(_tool_name(payload))
+                    await self._edit(f"{self._header}{status}\n\n<i>{escape_html(tail)}</i>")
+            elif event_type == "response":
+                result.response_id = str(data.get("id", "")) if isinstance(data, dict) else ""
+            elif event_type == "restart":
+                self._drop_tail(data if isinstance(data, dict) else {})
+            elif event_type == "done":
+                result.usage = data if isinstance(data, dict) else {}
+        return result
+
+    def _drop_tail(self, drop: dict[str, Any]) -> None:
+        """Remove the characters a retried request has regenerated differently."""
+        result = self.result
+        content_drop = int(drop.get("content", 0) or 0)
+        reasoning_drop = int(drop.get("reasoning", 0) or 0)
+        if content_drop:
+            result.content = result.content[: max(len(result.content) - content_drop, 0)]
+        if reasoning_drop:
+            result.reasoning = result.reasoning[: max(len(result.reasoning) - reasoning_drop, 0)]
+        logger.info("stream_restarted", handler=self._name, dropped=content_drop + reasoning_drop)
+        self._converter = IncrementalMarkdownConverter()
+        self._converter.feed(result.content[: self._preview_limit])
+        self._frozen_preview = None
+
+    def _render_preview(self) -> str:
+        # The converter only holds the first ``preview_limit`` characters and
+        # re-renders just its unstable tail; past the limit the preview is fixed.
+        if self._frozen_preview is not None:
+            return self._frozen_preview
+        preview = f"{self._header}{self._converter.render()}"
+        if len(self.result.content) > self._preview_limit:
+            self._frozen_preview = preview = preview + CONTINUATION_MARK
+        return preview
+
+    async def _edit(self, text: str) -> None:
+        if not text or text == self._last_text:
+            return
+        self._last_text = text
+        self._scheduler.submit(self._sent, text)
+
+    async def set_status(self, text: str) -> None:
+        """Replace the preview with a status line (e.g. ``✅ Final…``)."""
+        await self._edit(f"{self._header}{text}")
+
+    async def fail(self, text: str) -> None:
+        """Replace the preview with an error message, dropping pending edits."""
+        if not await self._scheduler.edit_now(self._sent, text):
+            logger.warning("stream_error_edit_failed", handler=self._name)
+
+    # ------------------------------------------------------------------
+    # Final answer
+    # ------------------------------------------------------------------
+
+    async def finish(self, footer: str, *, empty_text: str = "") -> None:
+        """Format the final answer with *footer*, split it and send it."""
+        body = markdown_to_telegram_html(self.result.content or empty_text)
+        final_text = f"{self._header}{body}\n\n<code>{escape_html(footer)}</code>"
+        parts = split_html_message(final_text, max_length=4000)
+
+        if not await self._scheduler.edit_now(self._sent, parts[0]):
+            logger.warning("stream_final_edit_failed", handler=self._name)
+        for part in parts[1:]:
+            try:
+                await self._reply_to.reply_text(part, parse_mode="HTML")
+            except Exception:
+                logger.exception("stream_send_part_failed", handler=self._name)
+
+    async def persist(
+        self,
+        user_id: int,
+        user_content: str,
+        model: str,
+        *,
+        assistant_content: str | None = None,
+        chained: bool = False,
+        cache_hit: bool = False,
+    ) -> bool:
+        """Save the user/assistant pair and today's usage stats; return whether it was saved.
+
+        *chained* turns (built by :mod:`context_builder`) move the user's
+        server-side response chain forward; any other turn ends it.  A
+        *cache_hit* is recorded as such rather than as a request.
+        """
+        result = self.result
+        return await save_message_pair_and_stats(
+            user_id,
+            user_content=user_content,
+            assistant_content=result.content if assistant_content is None else assistant_content,
+            reasoning_content=result.reasoning,
+            model=model,
+            tokens_in=result.tokens_in,
+            tokens_out=result.tokens_out,
+            reasoning_tokens=result.reasoning_tokens,
+            cost_usd=result.cost,
+            response_id=(result.response_id or None) if chained else None,
+            cached_tokens=result.cached_tokens,
+            cache_hit=cache_hit,
+        )
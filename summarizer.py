@@ -0,0 +1,227 @@
+"""Background rolling summaries of long conversations.
+
+Only as much recent history as fits the token budget is sent with a
+request, and degraded mode cuts it to 1–3 messages, so older turns used to
+be lost entirely.  :class:`ConversationSummarizer` compacts them instead:
+
+- after every saved exchange (:func:`db.add_pair_saved_hook`) it counts the
+  user's messages not yet summarised — from the database once, then in
+  memory — and, once at least ``SUMMARY_BATCH_MESSAGES`` of them are older
+  than the newest ``SUMMARY_KEEP_RECENT``, summarises in a background task;
+  only that run waits for the write-behind queue,
+- the previous summary plus those messages are condensed by the cheap
+  ``XAI_MODEL_FAST`` model into a new summary stored in
+  ``conversation_summaries`` together with the last covered message id,
+- :func:`context_builder.build_chat_context` sends the summary as a second
+  system message and skips history rows it already covers.
+
+At most one summary per user runs at a time; failures only cost a retry on
+the next exchange.  Tokens and cost are added to the user's usage stats
+without counting as a request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Any
+
+import structlog
+
+from config import settings
+from db import (
+    calculate_cost,
+    count_messages_after,
+    get_conversation_summary,
+    get_unsummarized_messages,
+    save_conversation_summary,
+    update_daily_stats,
+)
+
+logger = structlog.get_logger(__name__)
+
+# Long messages (pasted files) are clipped in the transcript given to the summariser
+_MESSAGE_CLIP_CHARS: int = 4_000
+
+_SUMMARY_SYSTEM_PROMPT: str = (
+    "Streszczasz wcześniejszą część rozmowy użytkownika z asystentem GigaGrok, "
+    "aby asystent mógł ją kontynuować bez pełnej historii.\n"
+    "Zachowaj: fakty o użytkowniku i jego projektach, podjęte decyzje, preferencje, "
+    "ustalenia techniczne (nazwy plików, funkcji, komendy, liczby), otwarte pytania.\n"
+    "Pomiń powitania i powtórzenia. Pisz zwięźle w punktach, w języku rozmowy. "
+    "Zwróć wyłącznie zaktualizowane streszczenie."
+)
+
+_ROLE_LABELS: dict[str, str] = {"user": "Użytkownik", "assistant": "Asystent"}
+
+
+def _transcript(messages: list[dict[str, Any]]) -> str:
+    lines: list[str] = []
+    for message in messages:
+        content = str(message["content"])
+        if len(content) > _MESSAGE_CLIP_CHARS:
+            content = content[:_MESSAGE_CLIP_CHARS] + " […]"
+        lines.append(f"{_ROLE_LABELS.get(message['role'], message['role'])}: {content}")
+    return "\n\n".join(lines)
+
+
+class ConversationSummarizer:
+    """Compacts older turns of each user into a stored rolling summary."""
+
+    def __init__(
+        self,
+        grok: Any,
+        *,
+        model: str,
+        keep_recent: int = 20,
+        batch_messages: int = 20,
+        max_tokens: int = 1000,
+        max_users: int = 10_000,
+    ) -> None:
+        self._grok = grok
+        self.model = model
+        self.keep_recent = keep_recent
+        self.batch_messages = max(2, batch_messages)
+        self.max_tokens = max_tokens
+        self._tasks: dict[int, asyncio.Task[bool]] = {}
+        # Messages per user not covered by the summary (missing = count in the DB);
+        # at most max_users are kept, the least recently active are recounted
+        self._backlog: OrderedDict[int, int] = OrderedDict()
+        self.max_users = max_users
+        self._stats: dict[str, int] = {"runs": 0, "summaries": 0, "failures": 0}
+
+    def _due(self, backlog: int) -> bool:
+        return backlog >= self.keep_recent + self.batch_messages
+
+    def _set_backlog(self, user_id: int, backlog: int) -> None:
+        self._backlog[user_id] = backlog
+        self._backlog.move_to_end(user_id)
+        while len(self._backlog) > self.max_users:
+            self._backlog.popitem(last=False)
+
+    def schedule(self, user_id: int) -> None:
+        """Start a background summary for *user_id* once a batch is due.
+
+        A saved exchange only bumps the in-memory count; the database is read
+        when the count is unknown (first exchange, after a summary attempt).
+        """
+        backlog = self._backlog.get(user_id)
+        if backlog is not None:
+            backlog += 2
+            self._set_backlog(user_id, backlog)
+            if not self._due(backlog):
+                return
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.get_running_loop().create_task(self._run(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda t, uid=user_id: self._forget(uid, t))
+
+    def _forget(self, user_id: int, task: asyncio.Task[bool]) -> None:
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    async def _run(self, user_id: int) -> bool:
+        try:
+            if user_id not in self._backlog:
+                # Committed rows only: the exchange that got us here may still be queued
+                previous = await get_conversation_summary(user_id)
+                backlog = await count_messages_after(user_id, previous.covered_until_id if previous else 0)
+                self._set_backlog(user_id, backlog)
+                if not self._due(backlog):
+                    return False
+            # Recount after this attempt, whatever it covers
+            self._backlog.pop(user_id, None)
+            return await self.summarize(user_id)
+        except Exception as exc:
+            self._stats["failures"] += 1
+            logger.warning("conversation_summary_failed", user_id=user_id, error=str(exc))
+            return False
+
+    async def summarize(self, user_id: int, *, force: bool = False) -> bool:
+        """Fold pending older messages into the summary; return whether it changed.
+
+        Without *force* nothing happens until a full batch has accumulated.
+        """
+        self._stats["runs"] += 1
+        previous = await get_conversation_summary(user_id)
+        # Summarise a few batches at once when catching up on an old history
+        messages = await get_unsummarized_messages(
+            user_id,
+            after_id=previous.covered_until_id if previous else 0,
+            keep_recent=self.keep_recent,
+            limit=self.batch_messages * 4,
+        )
+        if not messages or (len(messages) < self.batch_messages and not force):
+            return False
+
+        prompt = (
+            f"Dotychczasowe streszczenie:\n{previous.summary if previous else '(brak)'}\n\n"
+            f"Kolejne wiadomości:\n{_transcript(messages)}"
+        )
+        response = await self._grok.chat(
+            messages=[
+                {"role": "system", "content": _SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            model=self.model,
+            max_tokens=self.max_tokens,
+        )
+        summary = str(response.get("content") or "").strip()
+        if not summary:
+            raise ValueError("empty summary")
+
+        stored = await save_conversation_summary(user_id, summary, covered_until_id=int(messages[-1]["id"]))
+        usage = response.get("usage") or {}
+        tokens_in = int(usage.get("prompt_tokens", 0) or 0)
+        tokens_out = int(usage.get("completion_tokens", 0) or 0)
+        reasoning_tokens = int(usage.get("reasoning_tokens", 0) or 0)
+        cached_tokens = int(usage.get("cached_tokens", 0) or 0)
+        cost = calculate_cost(tokens_in, tokens_out, reasoning_tokens, cached_tokens)
+        await update_daily_stats(
+            user_id,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+            reasoning_tokens=reasoning_tokens,
+            cost_usd=cost,
+            cached_tokens=cached_tokens,
+            requests=0,
+        )
+        if not stored:
+            # History was cleared (or the write failed) while the model was summarising
+            logger.info("conversation_summary_discarded", user_id=user_id, messages=len(messages))
+            return False
+        self._stats["summaries"] += 1
+        logger.info(
+            "conversation_summarized",
+            user_id=user_id,
+            messages=len(messages),
+            covered_until_id=messages[-1]["id"],
+            summary_chars=len(summary),
+            cost=cost,
+        )
+        return True
+
+    async def close(self) -> None:
+        """Cancel running summaries (shutdown)."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._backlog.clear()
+
+    def status(self) -> dict[str, Any]:
+        return {"running": len(self._tasks), **self._stats}
+
+
+def create_summarizer(grok: Any) -> ConversationSummarizer:
+    """Summarizer configured from settings."""
+    return ConversationSummarizer(
+        grok,
+        model=settings.xai_model_fast,
+        keep_recent=settings.summary_keep_recent,
+        batch_messages=settings.summary_batch_messages,
+        max_tokens=settings.summary_max_tokens,
+    )
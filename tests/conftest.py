@@ -12,3 +12,25 @@ os.environ.setdefault("XAI_API_KEY", "test-key")
 os.environ.setdefault("TELEGRAM_BOT_TOKEN", "token")
 os.environ.setdefault("WEBHOOK_URL", "https://example.com")
 os.environ.setdefault("WEBHOOK_SECRET", "secret")
+
+import aiosqlite  # noqa: E402
+import pytest_asyncio  # noqa: E402
+
+import db as db_module  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def reset_db():
+    """Fresh in-memory SQLite database; opt in with ``pytestmark = pytest.mark.usefixtures("reset_db")``."""
+    conn = await aiosqlite.connect(":memory:")
+    conn.row_factory = aiosqlite.Row
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA foreign_keys=ON")
+    await conn.executescript(db_module._SCHEMA)
+    await conn.commit()
+    db_module._db = conn
+    db_module._reset_caches()
+    yield conn
+    await db_module.flush_writes()
+    await conn.close()
+    db_module._db = None
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from concurrency import ConcurrencyScheduler, FairSemaphore, current_user
+from rate_limiter import ModelRateLimit
+
+
+class TestFairSemaphore:
+    @pytest.mark.asyncio
+    async def test_waiters_are_served_round_robin_per_user(self) -> None:
+        sem = FairSemaphore(1)
+        await sem.acquire(0)
+        order: list[str] = []
+
+        async def request(user: int, tag: str) -> None:
+            await sem.acquire(user)
+            order.append(tag)
+            sem.release()
+
+        # User 1 queues three requests before user 2 queues one
+        tasks = [asyncio.create_task(request(1, f"a{i}")) for i in range(3)]
+        tasks.append(asyncio.create_task(request(2, "b0")))
+        await asyncio.sleep(0)
+        assert sem.waiting == 4
+        sem.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a0", "b0", "a1", "a2"]
+        assert sem.status()["queued"] == 4
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_leak_slot(self) -> None:
+        sem = FairSemaphore(1)
+        await sem.acquire()
+        waiter = asyncio.create_task(sem.acquire(1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert sem.waiting == 0
+        sem.release()
+        assert sem.active == 0
+
+
+class TestConcurrencyScheduler:
+    @pytest.mark.asyncio
+    async def test_pools_are_independent_per_endpoint_and_model(self) -> None:
+        scheduler = ConcurrencyScheduler(limit=1)  # one slot per pool
+        deep_started = asyncio.Event()
+        release_deep = asyncio.Event()
+
+        async def deep() -> None:
+            async with scheduler.slot("/responses", "reasoning"):
+                deep_started.set()
+                await release_deep.wait()
+
+        task = asyncio.create_task(deep())
+        await deep_started.wait()
+        # Cheap model and search are not blocked by the busy reasoning pool
+        async with scheduler.slot("/responses", "fast"):
+            pass
+        async with scheduler.slot("/documents/search"):
+            pass
+        status = {(p["endpoint"], p["model"]): p for p in scheduler.status()}
+        assert status[("/responses", "reasoning")]["active"] == 1
+        assert status[("/responses", "fast")]["waiting"] == 0
+        release_deep.set()
+        await task
+
+    @pytest.mark.asyncio
+    async def test_slot_uses_current_user(self) -> None:
+        scheduler = ConcurrencyScheduler(limit=1)
+        pool = scheduler.pool("/responses", "m")
+        await pool.acquire()
+        current_user.set(42)
+        waiter = asyncio.create_task(scheduler.slot("/responses", "m").__aenter__())
+        await asyncio.sleep(0)
+        assert list(pool._waiters) == [42]
+        pool.release()
+        await waiter
+        pool.release()
+
+    def test_configure_resizes_pools(self) -> None:
+        scheduler = ConcurrencyScheduler()
+        pool = scheduler.pool("/responses", "m")
+        assert pool.limit == 5
+        scheduler.configure(10, {"m": 2})
+        assert pool.limit == 2
+        assert scheduler.pool("/responses", "other").limit == 10
+
+    @pytest.mark.asyncio
+    async def test_slot_admits_through_model_rate_limit(self) -> None:
+        scheduler = ConcurrencyScheduler()
+        limit = ModelRateLimit(rpm=10, tpm=1_000, model="fast")
+        scheduler.set_model_limits(lambda model: limit if model == "fast" else None)
+
+        async with scheduler.slot("/responses", "fast", tokens=300) as admission:
+            admission.settle(500)
+        async with scheduler.slot("/responses", "other", tokens=300) as admission:
+            admission.settle(500)  # no limit registered -> no-op
+
+        assert limit.status()["requests_in_window"] == 1
+        assert limit.status()["tokens_in_window"] == 500
+
+    @pytest.mark.asyncio
+    async def test_cancelled_while_queued_takes_no_rate_limit_entry(self) -> None:
+        scheduler = ConcurrencyScheduler(limit=1)
+        limit = ModelRateLimit(rpm=10, tpm=1_000, model="fast")
+        scheduler.set_model_limits(lambda model: limit)
+        pool = scheduler.pool("/responses", "fast")
+        await pool.acquire()
+        waiter = asyncio.create_task(scheduler.slot("/responses", "fast", tokens=300).__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        pool.release()
+        assert limit.status()["requests_in_window"] == 0
+        assert limit.status()["tokens_in_window"] == 0
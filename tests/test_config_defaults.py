@@ -42,3 +42,19 @@ def test_model_defaults_can_be_overridden_by_env() -> None:
     config_module = _load_config_module()
     assert config_module.settings.xai_model_reasoning == "reasoning-override"
     assert config_module.settings.xai_model_fast == "fast-override"
+
+
+def test_allowed_users_parsed_once() -> None:
+    config_module = _load_config_module()
+    app_settings = config_module.Settings(allowed_user_ids="5, 6,x", admin_user_id=7)
+    assert app_settings.allowed_users == frozenset({5, 6, 7})
+    assert app_settings.allowed_users is app_settings.allowed_users
+    assert app_settings.is_allowed(6) and not app_settings.is_allowed(8)
+
+
+def test_history_cache_holds_at_least_max_history() -> None:
+    config_module = _load_config_module()
+    larger = config_module.Settings(max_history=100, history_cache_messages=64)
+    assert larger.history_cache_size == 100
+    assert config_module.Settings(max_history=20, history_cache_messages=64).history_cache_size == 64
+    assert config_module.Settings(max_history=100, history_cache_messages=0).history_cache_size == 0
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from typing import Any, AsyncGenerator
+
+import httpx
+import pytest
+
+from config import settings
+from context_builder import build_chat_context, default_system_prompt, fit_history, stream_chat
+from db import get_user_settings, save_message, save_message_pair_and_stats, set_response_chain
+from token_count import IMAGE_TOKENS, MESSAGE_OVERHEAD_TOKENS, message_tokens
+
+pytestmark = pytest.mark.usefixtures("reset_db")
+
+
+@pytest.fixture
+def stateful(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "xai_stateful_conversations", True)
+
+
+async def _seed_history(user_id: int) -> None:
+    await save_message(user_id, "user", "pierwsze pytanie")
+    await save_message(user_id, "assistant", "pierwsza odpowiedź")
+
+
+class _FakeGrok:
+    """Records chat_stream calls; fails the first call with *first_status* if set."""
+
+    def __init__(self, first_status: int | None = None) -> None:
+        self.calls: list[dict[str, Any]] = []
+        self._first_status = first_status
+
+    async def chat_stream(self, messages: list[dict[str, str]], **kwargs: Any) -> AsyncGenerator[tuple[str, Any], None]:
+        self.calls.append({"messages": messages, **kwargs})
+        if self._first_status is not None and len(self.calls) == 1:
+            request = httpx.Request("POST", "https://api.x.ai/v1/responses")
+            response = httpx.Response(self._first_status, request=request)
+            raise httpx.HTTPStatusError("rejected", request=request, response=response)
+        yield ("content", "ok")
+        yield ("done", {})
+
+
+def _msg(role: str, content: str, tokens: int) -> dict[str, Any]:
+    return {"role": role, "content": content, "tokens": tokens}
+
+
+class TestFitHistory:
+    def test_images_count_flat_not_by_base64_size(self) -> None:
+        message = {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 400_000}},
+                {"type": "text", "text": "abcdefgh"},
+            ],
+        }
+        assert message_tokens(message) == IMAGE_TOKENS + 2 + MESSAGE_OVERHEAD_TOKENS
+
+    def test_fills_newest_first_and_stops_at_first_overflow(self) -> None:
+        history = [
+            _msg("user", "stare", 10),
+            _msg("assistant", "ogromny plik", 50_000),
+            _msg("user", "q", 10),
+            _msg("assistant", "a", 10),
+        ]
+        # Messages carry 4 tokens of overhead each
+        assert [m["content"] for m in fit_history(history, 40)] == ["q", "a"]
+
+    def test_window_does_not_start_with_an_answer(self) -> None:
+        history = [_msg("user", "q1", 100), _msg("assistant", "a1", 10), _msg("user", "q2", 10)]
+        assert fit_history(history, 40) == [{"role": "user", "content": "q2"}]
+
+    def test_short_messages_use_the_whole_budget(self) -> None:
+        history = [_msg("user" if i % 2 == 0 else "assistant", str(i), 1) for i in range(60)]
+        assert len(fit_history(history, 10_000)) == 60
+
+
+class TestBuildChatContext:
+    @pytest.mark.asyncio
+    async def test_full_history_without_stateful_mode(self) -> None:
+        await _seed_history(1)
+        await set_response_chain(1, "resp_1")
+        context = await build_chat_context(1, "nowe pytanie")
+        assert context.previous_response_id is None
+        assert [m["role"] for m in context.messages] == ["system", "user", "assistant", "user"]
+
+    @pytest.mark.asyncio
+    async def test_prefix_is_stable_across_turns(self) -> None:
+        await _seed_history(1)
+        first = await build_chat_context(1, "pytanie 1")
+        await save_message(1, "user", "pytanie 1")
+        await save_message(1, "assistant", "odpowiedź 1")
+        second = await build_chat_context(1, "pytanie 2")
+        assert first.messages[0]["content"] == default_system_prompt()
+        # Everything before the new turn is an exact prefix of the next request
+        assert second.messages[: len(first.messages) - 1] == first.messages[:-1]
+
+    @pytest.mark.asyncio
+    async def test_history_is_limited_by_token_budget(self) -> None:
+        await save_message(1, "user", "x" * 40_000)  # ~10k tokens
+        await save_message(1, "assistant", "ok")
+        await save_message(1, "user", "krótkie pytanie")
+        await save_message(1, "assistant", "krótka odpowiedź")
+        context = await build_chat_context(1, "nowe", token_budget=5_000)
+        assert [m["content"] for m in context.messages[1:]] == ["krótkie pytanie", "krótka odpowiedź", "nowe"]
+        assert context.estimated_tokens <= 5_000
+
+        roomy = await build_chat_context(1, "nowe", token_budget=50_000)
+        assert len(roomy.messages) == 6
+
+    @pytest.mark.asyncio
+    async def test_first_turn_only_without_stored_history(self) -> None:
+        assert (await build_chat_context(1, "pytanie")).first_turn is True
+        await save_message(1, "user", "x" * 40_000)
+        await save_message(1, "assistant", "y" * 40_000)
+        # None of the history fits the budget, but the turn still continues a conversation
+        context = await build_chat_context(1, "pytanie", token_budget=5_000)
+        assert len(context.messages) == 2
+        assert context.first_turn is False
+
+    @pytest.mark.asyncio
+    async def test_chained_context_sends_only_new_turn(self, stateful: None) -> None:
+        await _seed_history(1)
+        await set_response_chain(1, "resp_1")
+        context = await build_chat_context(1, "nowe pytanie", system_addon="\nADDON")
+        assert context.previous_response_id == "resp_1"
+        assert [m["role"] for m in context.messages] == ["system", "user"]
+        assert context.messages[0]["content"].endswith("\nADDON")
+
+    @pytest.mark.asyncio
+    async def test_chained_estimate_includes_the_chain(self, stateful: None) -> None:
+        await save_message(1, "user", "x" * 40_000)
+        await save_message(1, "assistant", "ok")
+        await set_response_chain(1, "resp_1")
+        context = await build_chat_context(1, "nowe pytanie")
+        stored = message_tokens({"role": "user", "content": "x" * 40_000}) + message_tokens(
+            {"role": "assistant", "content": "ok"}
+        )
+        assert context.chain_tokens >= stored
+        assert context.estimated_tokens > context.chain_tokens
+
+        # Usage reported for the chained turn replaces the estimate
+        await save_message_pair_and_stats(
+            1, "nowe pytanie", "odpowiedź", tokens_in=12_000, tokens_out=500, response_id="resp_2"
+        )
+        context = await build_chat_context(1, "kolejne pytanie")
+        assert context.chain_tokens == 12_500
+        grok = _FakeGrok()
+        [e async for e in stream_chat(grok, context, model="m", max_tokens=10)]
+        assert grok.calls[0]["chain_tokens"] == 12_500
+
+    @pytest.mark.asyncio
+    async def test_expired_chain_replays_history(self, stateful: None, monkeypatch: pytest.MonkeyPatch) -> None:
+        await _seed_history(1)
+        await set_response_chain(1, "resp_1")
+        monkeypatch.setattr(settings, "xai_response_chain_ttl_hours", 0.0)
+        context = await build_chat_context(1, "nowe pytanie")
+        assert context.previous_response_id is None
+        assert len(context.messages) == 4
+
+    @pytest.mark.asyncio
+    async def test_chain_over_token_budget_is_dropped(self, stateful: None) -> None:
+        await _seed_history(1)
+        await save_message_pair_and_stats(
+            1, "pytanie", "odpowiedź", tokens_in=4_000, tokens_out=1_000, response_id="resp_1"
+        )
+        context = await build_chat_context(1, "nowe pytanie", token_budget=5_000)
+        assert context.previous_response_id == "resp_1"
+
+        context = await build_chat_context(1, "nowe pytanie", token_budget=4_999)
+        assert context.previous_response_id is None
+        assert len(context.messages) == 6
+        assert (await get_user_settings(1)).last_response_id is None
+
+
+class TestStreamChat:
+    @pytest.mark.asyncio
+    async def test_chained_request_is_stored(self, stateful: None) -> None:
+        await set_response_chain(1, "resp_1")
+        context = await build_chat_context(1, "pytanie")
+        grok = _FakeGrok()
+        events = [e async for e in stream_chat(grok, context, model="m", max_tokens=10)]
+        assert events == [("content", "ok"), ("done", {})]
+        assert grok.calls[0]["previous_response_id"] == "resp_1"
+        assert grok.calls[0]["store"] is True
+
+    @pytest.mark.asyncio
+    async def test_rejected_chain_falls_back_to_full_history(self, stateful: None) -> None:
+        await _seed_history(1)
+        await set_response_chain(1, "resp_gone")
+        context = await build_chat_context(1, "pytanie")
+        grok = _FakeGrok(first_status=404)
+        events = [e async for e in stream_chat(grok, context, model="m", max_tokens=10)]
+
+        assert events[0] == ("content", "ok")
+        assert len(grok.calls) == 2
+        retry = grok.calls[1]
+        assert "previous_response_id" not in retry
+        assert len(retry["messages"]) == 4
+        assert (await get_user_settings(1)).last_response_id is None
+
+    @pytest.mark.asyncio
+    async def test_other_errors_propagate(self, stateful: None) -> None:
+        await set_response_chain(1, "resp_1")
+        context = await build_chat_context(1, "pytanie")
+        grok = _FakeGrok(first_status=500)
+        with pytest.raises(httpx.HTTPStatusError):
+            [e async for e in stream_chat(grok, context, model="m", max_tokens=10)]
+        assert (await get_user_settings(1)).last_response_id == "resp_1"
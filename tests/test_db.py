@@ -2,41 +2,33 @@
 
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+
 import pytest
-import pytest_asyncio
 
 import aiosqlite
 
 import db as db_module
 from db import (
-    _SCHEMA,
     add_dynamic_user,
+    add_usage_hook,
     calculate_cost,
     clear_history,
     get_daily_stats,
     get_history,
     get_user_setting,
+    get_user_settings,
     is_dynamic_user_allowed,
     remove_dynamic_user,
+    remove_usage_hook,
     save_message,
+    save_message_pair_and_stats,
+    set_response_chain,
     set_user_setting,
     update_daily_stats,
 )
 
-
-@pytest_asyncio.fixture(autouse=True)
-async def reset_db():
-    """Set up a fresh in-memory SQLite database for each test."""
-    conn = await aiosqlite.connect(":memory:")
-    conn.row_factory = aiosqlite.Row
-    await conn.execute("PRAGMA journal_mode=WAL")
-    await conn.execute("PRAGMA foreign_keys=ON")
-    await conn.executescript(_SCHEMA)
-    await conn.commit()
-    db_module._db = conn
-    yield
-    await conn.close()
-    db_module._db = None
+pytestmark = pytest.mark.usefixtures("reset_db")
 
 
 # ---------------------------------------------------------------------------
@@ -55,6 +47,21 @@ class TestInitDb:
         row = await cursor.fetchone()
         assert row is not None
 
+    @pytest.mark.asyncio
+    async def test_missing_columns_are_added_to_old_databases(self) -> None:
+        conn = await aiosqlite.connect(":memory:")
+        try:
+            await conn.execute("CREATE TABLE user_settings (user_id INTEGER PRIMARY KEY, system_prompt TEXT)")
+            await conn.execute("CREATE TABLE usage_stats (user_id INTEGER, date TEXT)")
+            await conn.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY, content TEXT)")
+            await db_module._migrate_columns(conn)
+            await db_module._migrate_columns(conn)  # idempotent
+            cursor = await conn.execute("PRAGMA table_info(user_settings)")
+            columns = {row[1] for row in await cursor.fetchall()}
+        finally:
+            await conn.close()
+        assert {"last_response_id", "last_response_at"} <= columns
+
 
 # ---------------------------------------------------------------------------
 # save_message / get_history / clear_history
@@ -86,6 +93,129 @@ class TestHistory:
         # User 2 should still have history
         assert len(await get_history(user_id=2)) == 1
 
+    @pytest.mark.asyncio
+    async def test_history_cache_write_through(self) -> None:
+        await save_message(user_id=1, role="user", content="first")
+        assert len(await get_history(user_id=1)) == 1  # miss, fills the cache
+
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a")
+        status_before = db_module.get_history_cache_status()
+        history = await get_history(user_id=1, limit=2)
+        assert [m["content"] for m in history] == ["q", "a"]
+        assert db_module.get_history_cache_status()["hits"] == status_before["hits"] + 1
+
+        await clear_history(user_id=1)
+        assert await get_history(user_id=1) == []
+        assert db_module.get_history_cache_status()["misses"] == status_before["misses"]
+
+
+# ---------------------------------------------------------------------------
+# save_message_pair_and_stats (write-behind)
+# ---------------------------------------------------------------------------
+
+class TestWriteBehind:
+    @pytest.mark.asyncio
+    async def test_pairs_from_many_users_share_one_batch(self) -> None:
+        batches_before = db_module.get_write_queue_status()["batches"]
+        for user_id in (1, 2, 3):
+            await save_message_pair_and_stats(
+                user_id, user_content="q", assistant_content="a", tokens_in=10, cost_usd=0.01
+            )
+        assert db_module.get_write_queue_status()["pending"] == 3
+
+        stats = await get_daily_stats(user_id=2)  # reads flush the queue first
+        assert stats["total_requests"] == 1
+        assert stats["total_tokens_in"] == 10
+        assert db_module.get_write_queue_status()["batches"] == batches_before + 1
+        assert db_module.get_write_queue_status()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_token_counts_are_stored_per_row(self) -> None:
+        await save_message_pair_and_stats(1, user_content="a" * 400, assistant_content="b" * 40)
+        assert [m["tokens"] for m in await get_history(user_id=1)] == [100, 10]
+        # Served from the DB after the cache is dropped
+        db_module._reset_caches()
+        assert [m["tokens"] for m in await get_history(user_id=1)] == [100, 10]
+        cursor = await db_module._db.execute("SELECT token_count FROM conversations ORDER BY id")  # type: ignore[union-attr]
+        assert [row[0] for row in await cursor.fetchall()] == [100, 10]
+
+    @pytest.mark.asyncio
+    async def test_cached_tokens_are_aggregated(self) -> None:
+        for cached in (40, 60):
+            await save_message_pair_and_stats(
+                1, user_content="q", assistant_content="a", tokens_in=100, cached_tokens=cached
+            )
+        stats = await get_daily_stats(user_id=1)
+        assert stats["total_tokens_in"] == 200
+        assert stats["total_cached_tokens"] == 100
+
+    @pytest.mark.asyncio
+    async def test_sync_mode_commits_before_returning(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(db_module.settings, "db_write_behind_enabled", False)
+        assert await save_message_pair_and_stats(1, user_content="q", assistant_content="a") is True
+        assert db_module.get_write_queue_status()["pending"] == 0
+        cursor = await db_module._db.execute("SELECT COUNT(*) FROM conversations")  # type: ignore[union-attr]
+        assert (await cursor.fetchone())[0] == 2
+
+    @pytest.mark.asyncio
+    async def test_sync_mode_failure_skips_usage_hooks(
+        self, monkeypatch: pytest.MonkeyPatch, reset_db: aiosqlite.Connection
+    ) -> None:
+        monkeypatch.setattr(db_module.settings, "db_write_behind_enabled", False)
+        seen: list[int] = []
+
+        def hook(user_id: int, tokens: int, cost_usd: float, requests: int) -> None:
+            seen.append(tokens)
+
+        await reset_db.execute("ALTER TABLE usage_stats RENAME TO usage_stats_broken")
+        add_usage_hook(hook)
+        try:
+            saved = await save_message_pair_and_stats(1, user_content="q", assistant_content="a", tokens_in=10)
+        finally:
+            remove_usage_hook(hook)
+            await reset_db.execute("ALTER TABLE usage_stats_broken RENAME TO usage_stats")
+        assert saved is False
+        assert seen == []
+
+    @pytest.mark.asyncio
+    async def test_clear_history_removes_queued_messages(self) -> None:
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a")
+        assert await clear_history(user_id=1) == 2
+        assert await get_history(user_id=1) == []
+
+
+# ---------------------------------------------------------------------------
+# Reader pool
+# ---------------------------------------------------------------------------
+
+class TestReaderPool:
+    @pytest.mark.asyncio
+    async def test_reads_use_read_only_pool(
+        self, tmp_path, monkeypatch: pytest.MonkeyPatch  # type: ignore[no-untyped-def]
+    ) -> None:
+        monkeypatch.setattr(db_module, "_db", None)
+        monkeypatch.setattr(db_module.settings, "db_path", str(tmp_path / "pool.db"))
+        monkeypatch.setattr(db_module.settings, "db_reader_pool_size", 2)
+        await db_module.init_db()
+        try:
+            def reader_queries() -> int:
+                return sum(s["queries"] for s in db_module.get_db_pool_status() if s["name"] != "writer")
+
+            await save_message(user_id=1, role="user", content="hi")
+            db_module._history_cache.clear()
+            before = reader_queries()
+            assert [m["content"] for m in await get_history(user_id=1)] == ["hi"]
+            assert reader_queries() == before + 1
+
+            names = {s["name"] for s in db_module.get_db_pool_status()}
+            assert names == {"writer", "reader-0", "reader-1"}
+
+            async with db_module._reader() as reader:
+                with pytest.raises(aiosqlite.OperationalError):
+                    await reader.execute("DELETE FROM conversations")
+        finally:
+            await db_module.close_db()
+
 
 # ---------------------------------------------------------------------------
 # calculate_cost
@@ -101,6 +231,13 @@ class TestCalculateCost:
     def test_calculate_cost_zero(self) -> None:
         assert calculate_cost(0, 0, 0) == 0.0
 
+    def test_cached_input_is_discounted(self) -> None:
+        # 750k cached at 0.05 + 250k uncached at 0.20
+        cost = calculate_cost(tokens_in=1_000_000, tokens_out=0, reasoning_tokens=0, cached_tokens=750_000)
+        assert cost == pytest.approx(0.0875, abs=1e-6)
+        # Cached count can never exceed the prompt
+        assert calculate_cost(100, 0, 0, cached_tokens=1_000) == calculate_cost(100, 0, 0, cached_tokens=100)
+
 
 # ---------------------------------------------------------------------------
 # update_daily_stats / get_daily_stats
@@ -132,6 +269,28 @@ class TestDailyStats:
         assert stats["total_reasoning_tokens"] == 150
         assert stats["total_cost_usd"] == pytest.approx(0.03)
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("write_behind", [True, False])
+    async def test_cache_hits_are_not_counted_as_requests(
+        self, monkeypatch: pytest.MonkeyPatch, write_behind: bool
+    ) -> None:
+        monkeypatch.setattr(db_module.settings, "db_write_behind_enabled", write_behind)
+        seen: list[tuple[int, int, float, int]] = []
+
+        def hook(user_id: int, tokens: int, cost: float, requests: int) -> None:
+            seen.append((user_id, tokens, cost, requests))
+
+        add_usage_hook(hook)
+        try:
+            await save_message_pair_and_stats(1, "q", "a", tokens_in=10, cost_usd=0.01)
+            await save_message_pair_and_stats(1, "q", "a", cache_hit=True)
+        finally:
+            remove_usage_hook(hook)
+        stats = await get_daily_stats(user_id=1)
+        assert stats["total_requests"] == 1
+        assert stats["total_cache_hits"] == 1
+        assert seen == [(1, 10, 0.01, 1), (1, 0, 0.0, 0)]
+
 
 # ---------------------------------------------------------------------------
 # set_user_setting / get_user_setting
@@ -149,6 +308,20 @@ class TestUserSettings:
         result = await get_user_setting(user_id=99, key="reasoning_effort")
         assert result is None
 
+    @pytest.mark.asyncio
+    async def test_snapshot_cached_and_invalidated_on_set(self) -> None:
+        await set_user_setting(user_id=42, key="system_prompt", value="be brief")
+        snapshot = await get_user_settings(42)
+        assert snapshot.system_prompt == "be brief"
+        assert snapshot.reasoning_effort == "high"  # column default
+        assert await get_user_settings(42) is snapshot
+
+        await set_user_setting(user_id=42, key="voice_enabled", value="1")
+        updated = await get_user_settings(42)
+        assert updated is not snapshot
+        assert str(updated.voice_enabled) == "1"
+        assert updated.system_prompt == "be brief"
+
 
 # ---------------------------------------------------------------------------
 # dynamic_users
@@ -168,3 +341,120 @@ class TestDynamicUsers:
         removed = await remove_dynamic_user(100)
         assert removed == 1
         assert await is_dynamic_user_allowed(100) is False
+
+    @pytest.mark.asyncio
+    async def test_dynamic_users_served_from_memory_index(self) -> None:
+        assert await is_dynamic_user_allowed(200) is False  # loads the index
+        db = db_module._db
+        assert db is not None
+        await db.execute("INSERT INTO dynamic_users (user_id, added_by) VALUES (200, 1)")
+        await db.commit()
+        # Rows written behind the db API are not seen until the index is reloaded
+        assert await is_dynamic_user_allowed(200) is False
+        db_module._reset_caches()
+        assert await is_dynamic_user_allowed(200) is True
+
+    @pytest.mark.asyncio
+    async def test_revoke_during_index_load_is_not_lost(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        await add_dynamic_user(user_id=300, added_by=1)
+        db_module._reset_caches()
+        real_reader = db_module._reader
+
+        class _StaleCursor:
+            def __init__(self, rows: list) -> None:
+                self._rows = rows
+
+            async def fetchall(self) -> list:
+                return self._rows
+
+        class _RacingConn:
+            def __init__(self, conn: aiosqlite.Connection) -> None:
+                self._conn = conn
+
+            async def execute(self, sql: str, *args: object) -> _StaleCursor:
+                rows = await (await self._conn.execute(sql, *args)).fetchall()
+                # The revoke commits after the rows were read, before they are installed
+                assert await remove_dynamic_user(300) == 1
+                return _StaleCursor(rows)
+
+        @asynccontextmanager
+        async def racing_reader():
+            async with real_reader() as conn:
+                yield _RacingConn(conn)
+
+        monkeypatch.setattr(db_module, "_reader", racing_reader)
+        assert await is_dynamic_user_allowed(300) is False
+        monkeypatch.setattr(db_module, "_reader", real_reader)
+        assert await is_dynamic_user_allowed(300) is False
+
+
+# ---------------------------------------------------------------------------
+# Server-side response chain
+# ---------------------------------------------------------------------------
+
+class TestResponseChain:
+    @pytest.mark.asyncio
+    async def test_set_and_reset_chain(self) -> None:
+        await set_response_chain(1, "resp_1")
+        stored = await get_user_settings(1)
+        assert stored.last_response_id == "resp_1"
+        assert stored.last_response_at is not None
+
+        await set_response_chain(1, None)
+        stored = await get_user_settings(1)
+        assert stored.last_response_id is None
+        assert stored.last_response_at is None
+
+    @pytest.mark.asyncio
+    async def test_clear_history_drops_chain(self) -> None:
+        await set_response_chain(1, "resp_1")
+        await clear_history(user_id=1)
+        assert (await get_user_settings(1)).last_response_id is None
+
+    @pytest.mark.asyncio
+    async def test_system_prompt_change_drops_chain(self) -> None:
+        await set_response_chain(1, "resp_1")
+        await set_user_setting(1, "voice_enabled", "1")
+        assert (await get_user_settings(1)).last_response_id == "resp_1"
+        await set_user_setting(1, "system_prompt", "Bądź zwięzły.")
+        assert (await get_user_settings(1)).last_response_id is None
+
+    @pytest.mark.asyncio
+    async def test_persisted_turn_moves_chain(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(db_module.settings, "xai_stateful_conversations", True)
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a", response_id="resp_2")
+        assert (await get_user_settings(1)).last_response_id == "resp_2"
+        # A turn that was not part of the chain (e.g. /fast) breaks it
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a")
+        assert (await get_user_settings(1)).last_response_id is None
+
+    @pytest.mark.asyncio
+    async def test_chain_is_queued_with_the_pair(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(db_module.settings, "xai_stateful_conversations", True)
+        monkeypatch.setattr(db_module.settings, "db_write_behind_enabled", True)
+        db = db_module._db
+        assert db is not None
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a", response_id="resp_2")
+        # Visible at once, but nothing was committed outside the batch
+        assert (await get_user_settings(1)).last_response_id == "resp_2"
+        cursor = await db.execute("SELECT last_response_id FROM user_settings WHERE user_id = 1")
+        assert await cursor.fetchone() is None
+
+        await db_module._write_queue.flush()
+        cursor = await db.execute("SELECT last_response_id FROM user_settings WHERE user_id = 1")
+        assert (await cursor.fetchone())["last_response_id"] == "resp_2"
+
+    @pytest.mark.asyncio
+    async def test_queued_chain_does_not_survive_prompt_reset(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(db_module.settings, "xai_stateful_conversations", True)
+        monkeypatch.setattr(db_module.settings, "db_write_behind_enabled", True)
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a", response_id="resp_2")
+        await set_user_setting(1, "system_prompt", "Bądź zwięzły.")
+        await db_module.flush_writes()
+        db_module._reset_caches()
+        assert (await get_user_settings(1)).last_response_id is None
+
+    @pytest.mark.asyncio
+    async def test_chain_untouched_when_stateless(self) -> None:
+        await save_message_pair_and_stats(1, user_content="q", assistant_content="a", response_id="resp_2")
+        assert (await get_user_settings(1)).last_response_id is None
@@ -0,0 +1,111 @@
+"""Tests for edit_scheduler module."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+import pytest
+from telegram.error import RetryAfter
+
+from edit_scheduler import EditScheduler
+
+
+class _FakeMessage:
+    def __init__(self, chat_id: int = 1, message_id: int = 1, fail_with: Exception | None = None) -> None:
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.edits: list[str] = []
+        self._fail_with = fail_with
+
+    async def edit_text(self, text: str, **kwargs: Any) -> None:
+        if self._fail_with is not None:
+            exc, self._fail_with = self._fail_with, None
+            raise exc
+        self.edits.append(text)
+
+
+class TestEditScheduler:
+    @pytest.mark.asyncio
+    async def test_pending_edits_are_merged(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=10.0)
+        message = _FakeMessage()
+        scheduler.submit(message, "one")  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        scheduler.submit(message, "two")  # type: ignore[arg-type]
+        scheduler.submit(message, "three")  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        assert message.edits == ["one"]
+        assert scheduler.status()["merged"] == 1
+        await scheduler.stop()
+
+    @pytest.mark.asyncio
+    async def test_edit_now_drops_pending_preview(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=0.0)
+        message = _FakeMessage()
+        scheduler.submit(message, "preview")  # type: ignore[arg-type]
+        assert await scheduler.edit_now(message, "final") is True  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        assert message.edits[-1] == "final"
+        assert "preview" not in message.edits
+        await scheduler.stop()
+
+    @pytest.mark.asyncio
+    async def test_preview_rejected_during_edit_now_is_not_resent(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=0.0)
+        message = _FakeMessage(fail_with=RetryAfter(0))
+        gate = asyncio.Event()
+        edit_text = message.edit_text
+
+        async def slow_edit(text: str, **kwargs: Any) -> None:
+            if text == "preview":
+                await gate.wait()
+            await edit_text(text, **kwargs)
+
+        message.edit_text = slow_edit  # type: ignore[method-assign]
+        scheduler.submit(message, "preview")  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)  # preview is now in flight
+        final = asyncio.create_task(scheduler.edit_now(message, "final"))  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        gate.set()  # in-flight preview fails with RetryAfter
+        assert await final is True
+        await asyncio.sleep(0.05)
+        assert message.edits == ["final"]
+        assert scheduler.status()["pending"] == 0
+        await scheduler.stop()
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_chat_and_halves_rate(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=0.0, global_rate=20.0)
+        message = _FakeMessage(fail_with=RetryAfter(30))
+        scheduler.submit(message, "text")  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        status = scheduler.status()
+        assert status["retry_after"] == 1
+        assert status["global_rate"] == 10.0
+        assert status["pending"] == 1  # re-queued, waiting for the chat pause
+        assert message.edits == []
+        await scheduler.stop()
+
+    @pytest.mark.asyncio
+    async def test_chats_are_independent(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=10.0)
+        first, second = _FakeMessage(chat_id=1), _FakeMessage(chat_id=2)
+        scheduler.submit(first, "a")  # type: ignore[arg-type]
+        scheduler.submit(second, "b")  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        assert first.edits == ["a"]
+        assert second.edits == ["b"]
+        await scheduler.stop()
+
+    @pytest.mark.asyncio
+    async def test_idle_chats_are_forgotten(self) -> None:
+        scheduler = EditScheduler(per_chat_interval=0.02)
+        for chat_id in range(5):
+            scheduler.submit(_FakeMessage(chat_id=chat_id), "preview")  # type: ignore[arg-type]
+        assert await scheduler.edit_now(_FakeMessage(chat_id=9), "final") is True  # type: ignore[arg-type]
+        await asyncio.sleep(0.01)
+        assert scheduler.status()["chats_throttled"] == 6
+        await asyncio.sleep(0.05)
+        assert scheduler.status()["chats_throttled"] == 0
+        await scheduler.stop()
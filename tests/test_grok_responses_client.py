@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from grok_responses_client import GrokResponsesClient, _parse_usage
+from retry_policy import RetryPolicy
+
+
+def _sse(*events: dict) -> bytes:
+    return b"".join(
+        f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode() for event in events
+    )
+
+
+def _claude_stream(*texts: str) -> bytes:
+    deltas = [
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": t}}
+        for t in texts
+    ]
+    return _sse({"type": "message_start"}, *deltas, {"type": "message_stop"})
+
+
+class TestAskClaudeBridge:
+    @pytest.mark.asyncio
+    async def test_streams_deltas_over_persistent_client(self) -> None:
+        calls: list[dict] = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(json.loads(request.content))
+            return httpx.Response(200, content=_claude_stream("Hel", "lo"))
+
+        client = GrokResponsesClient(api_key="k", anthropic_api_key="a")
+        await client._anthropic.aclose()  # type: ignore[union-attr]
+        client._anthropic = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        deltas = [d async for d in client._stream_ask_claude("hi")]
+        assert deltas == ["Hel", "lo"]
+        assert await client._execute_ask_claude("again") == "Hello"
+        assert [c["stream"] for c in calls] == [True, True]
+        await client.close()
+        assert client._anthropic.is_closed
+
+    @pytest.mark.asyncio
+    async def test_without_key_reports_missing_configuration(self) -> None:
+        client = GrokResponsesClient(api_key="k")
+        assert client._anthropic is None
+        assert "not configured" in await client._execute_ask_claude("hi")
+        await client.close()
+
+
+def _function_call_round(*calls: tuple[str, str, str]) -> bytes:
+    events: list[dict] = []
+    for item_id, name, arguments in calls:
+        events.append({
+            "type": "response.output_item.added",
+            "item": {"type": "function_call", "id": item_id, "call_id": f"call_{item_id}", "name": name},
+        })
+        events.append({"type": "response.function_call_arguments.done", "item_id": item_id, "arguments": arguments})
+    events.append({"type": "response.done", "response": {"usage": {"input_tokens": 10, "output_tokens": 1}}})
+    return _sse(*events)
+
+
+def _answer_round(text: str) -> bytes:
+    return _sse(
+        {"type": "response.output_text.delta", "delta": text},
+        {"type": "response.done", "response": {"usage": {"input_tokens": 20, "output_tokens": 5}}},
+    )
+
+
+def _xai_client(rounds: list[bytes], bodies: list[dict], **kwargs) -> GrokResponsesClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(json.loads(request.content))
+        return httpx.Response(200, content=rounds[len(bodies) - 1])
+
+    return GrokResponsesClient(
+        api_key="k",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        **kwargs,
+    )
+
+
+class TestToolLoop:
+    @pytest.mark.asyncio
+    async def test_tool_calls_run_concurrently_and_share_one_followup(self) -> None:
+        bodies: list[dict] = []
+        client = _xai_client(
+            [
+                _function_call_round(
+                    ("a", "ask_claude", '{"prompt": "one"}'),
+                    ("b", "ask_claude", '{"prompt": "two"}'),
+                ),
+                _answer_round("final"),
+            ],
+            bodies,
+        )
+        running: list[str] = []
+        overlap: list[int] = []
+
+        async def fake_claude(prompt: str):
+            running.append(prompt)
+            await asyncio.sleep(0.01)
+            overlap.append(len(running))
+            yield f"answer {prompt}"
+
+        client._stream_ask_claude = fake_claude  # type: ignore[method-assign]
+        events = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+
+        assert max(overlap) == 2
+        assert len(bodies) == 2
+        followup = bodies[1]["input"]
+        assert [item.get("type") for item in followup[1:]] == [
+            "function_call", "function_call_output", "function_call", "function_call_output",
+        ]
+        assert followup[2] == {"type": "function_call_output", "call_id": "call_a", "output": "answer one"}
+        assert ("content", "final") in events
+        assert events[-1] == (
+            "done",
+            {"prompt_tokens": 30, "completion_tokens": 6, "reasoning_tokens": 0, "cached_tokens": 0},
+        )
+
+    @pytest.mark.asyncio
+    async def test_slow_tool_times_out(self) -> None:
+        bodies: list[dict] = []
+        client = _xai_client(
+            [_function_call_round(("a", "ask_claude", "{}")), _answer_round("ok")],
+            bodies,
+            tool_timeout=0.01,
+        )
+
+        async def slow_claude(prompt: str):
+            await asyncio.sleep(1)
+            yield "late"
+
+        client._stream_ask_claude = slow_claude  # type: ignore[method-assign]
+        _ = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+        assert "Timeout" in bodies[1]["input"][-1]["output"]
+
+    @pytest.mark.asyncio
+    async def test_stops_after_max_rounds(self) -> None:
+        bodies: list[dict] = []
+        call = _function_call_round(("a", "unknown_tool", "{}"))
+        client = _xai_client([call, call, call], bodies, max_tool_rounds=1)
+        events = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+        assert len(bodies) == 2
+        assert "Unknown tool" in bodies[1]["input"][-1]["output"]
+        assert events[-1][0] == "done"
+
+
+class TestRetries:
+    @pytest.mark.asyncio
+    async def test_rate_limit_retry_uses_retry_after(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        sleeps: list[float] = []
+
+        async def fake_sleep(delay: float) -> None:
+            sleeps.append(delay)
+
+        monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+        responses = [
+            httpx.Response(429, headers={"retry-after": "2"}, content=b"slow down"),
+            httpx.Response(200, content=_answer_round("ok")),
+        ]
+        client = GrokResponsesClient(
+            api_key="k",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(lambda r: responses.pop(0))),
+            retry_policy=RetryPolicy(base_delay=0.5, rng=lambda low, high: 0.0),
+        )
+        events = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+        assert sleeps == [2.0]
+        assert ("content", "ok") in events
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self) -> None:
+        calls: list[int] = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(1)
+            return httpx.Response(400, content=b"bad request")
+
+        client = GrokResponsesClient(
+            api_key="k", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+        with pytest.raises(httpx.HTTPStatusError):
+            _ = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+        assert len(calls) == 1
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """Yield *body* and then fail like a dropped connection."""
+
+    def __init__(self, body: bytes) -> None:
+        self._body = body
+
+    async def __aiter__(self):
+        yield self._body
+        raise httpx.ReadError("connection reset")
+
+
+class TestResume:
+    @pytest.mark.asyncio
+    async def test_mid_stream_failure_does_not_duplicate_output(self) -> None:
+        first = _sse(
+            {"type": "response.output_text.delta", "delta": "Hello "},
+            {"type": "response.output_text.delta", "delta": "wor"},
+        )
+        responses = [
+            httpx.Response(200, stream=_BrokenStream(first)),
+            httpx.Response(
+                200,
+                content=_sse(
+                    {"type": "response.output_text.delta", "delta": "Hello world"},
+                    {"type": "response.done", "response": {"usage": {"input_tokens": 3, "output_tokens": 2}}},
+                ),
+            ),
+        ]
+        client = GrokResponsesClient(
+            api_key="k",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(lambda r: responses.pop(0))),
+            retry_policy=RetryPolicy(rng=lambda low, high: 0.0),
+        )
+        events = [e async for e in client.chat_stream([{"role": "user", "content": "hi"}], "m")]
+        content = "".join(d for e, d in events if e == "content")
+        assert content == "Hello world"
+        assert not any(e == "restart" for e, _ in events)
+
+
+class TestUsage:
+    def test_cached_and_reasoning_details_are_parsed(self) -> None:
+        usage = _parse_usage({
+            "input_tokens": 1200,
+            "input_tokens_details": {"cached_tokens": 1024},
+            "output_tokens": 300,
+            "output_tokens_details": {"reasoning_tokens": 250},
+        })
+        assert usage == {
+            "prompt_tokens": 1200,
+            "completion_tokens": 300,
+            "reasoning_tokens": 250,
+            "cached_tokens": 1024,
+        }
+
+    def test_missing_usage_is_zero(self) -> None:
+        assert _parse_usage(None) == {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "reasoning_tokens": 0,
+            "cached_tokens": 0,
+        }
@@ -0,0 +1,46 @@
+"""Tests for the in-memory history cache."""
+
+from __future__ import annotations
+
+from history_cache import HistoryCache
+
+
+def _msg(content: str, role: str = "user") -> dict[str, str]:
+    return {"role": role, "content": content}
+
+
+class TestHistoryCache:
+    def test_miss_until_stored_then_slices_limit(self) -> None:
+        cache = HistoryCache(max_messages=4)
+        assert cache.get(1, 2) is None
+        token = cache.begin_load()
+        cache.store(1, [_msg("a"), _msg("b"), _msg("c")], fetched=4, token=token)
+        assert [m["content"] for m in cache.get(1, 2) or []] == ["b", "c"]
+        # Fewer rows than fetched means the buffer holds the whole history
+        assert len(cache.get(1, 10) or []) == 3
+
+    def test_ring_buffer_drops_oldest_and_becomes_incomplete(self) -> None:
+        cache = HistoryCache(max_messages=2)
+        cache.store(1, [], fetched=2, token=cache.begin_load())
+        cache.append(1, _msg("a"), _msg("b"), _msg("c"))
+        assert [m["content"] for m in cache.get(1, 2) or []] == ["b", "c"]
+        assert cache.get(1, 3) is None
+
+    def test_store_skipped_after_concurrent_write(self) -> None:
+        cache = HistoryCache()
+        token = cache.begin_load()
+        cache.append(1, _msg("new"))
+        cache.store(1, [_msg("stale")], fetched=64, token=token)
+        assert cache.get(1, 1) is None
+
+    def test_memory_cap_evicts_least_recently_used(self) -> None:
+        cache = HistoryCache(max_messages=10, max_bytes=1800)
+        for user_id in (1, 2, 3):
+            cache.store(user_id, [_msg("x" * 400)], fetched=10, token=cache.begin_load())
+        cache.get(1, 1)
+        cache.store(4, [_msg("x" * 400)], fetched=10, token=cache.begin_load())
+        status = cache.status()
+        assert status["bytes"] <= 1800
+        assert status["evictions"] >= 1
+        assert cache.get(1, 1) is not None
+        assert cache.get(2, 1) is None
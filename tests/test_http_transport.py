@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+import http_transport
+from grok_responses_client import GrokResponsesClient
+from http_transport import create_http_client, get_http_pool_status, prewarm
+
+
+async def _start_server() -> tuple[asyncio.AbstractServer, str, list[int]]:
+    """Tiny keep-alive HTTP/1.1 server; returns (server, base_url, accepted connections)."""
+    accepted: list[int] = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        accepted.append(1)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                body = b"" if head.startswith(b"HEAD") else b"ok"
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}", accepted
+
+
+@pytest.fixture(autouse=True)
+def _reset_registry():
+    http_transport._transports.clear()
+    yield
+    http_transport._transports.clear()
+
+
+class TestCreateHttpClient:
+    @pytest.mark.asyncio
+    async def test_connections_are_reused_and_counted(self) -> None:
+        server, base_url, accepted = await _start_server()
+        client = create_http_client("test", http2=False)
+        try:
+            for _ in range(3):
+                response = await client.get(f"{base_url}/ping")
+                assert response.text == "ok"
+        finally:
+            await client.aclose()
+            server.close()
+            await server.wait_closed()
+
+        (status,) = get_http_pool_status()
+        assert status["name"] == "test"
+        assert status["requests"] == 3
+        assert status["connections"] == 1
+        assert status["reused"] == 2
+        assert len(accepted) == 1
+
+    @pytest.mark.asyncio
+    async def test_prewarm_opens_connections_ahead_of_traffic(self) -> None:
+        server, base_url, accepted = await _start_server()
+        client = create_http_client("test", http2=False, max_keepalive_connections=4)
+        try:
+            assert await prewarm(client, base_url, connections=2) == 2
+            await asyncio.gather(client.get(base_url), client.get(base_url))
+        finally:
+            await client.aclose()
+            server.close()
+            await server.wait_closed()
+
+        status = get_http_pool_status()[0]
+        assert status["connections"] == 2
+        assert status["reused"] == 2
+
+    @pytest.mark.asyncio
+    async def test_prewarm_failure_is_not_fatal(self) -> None:
+        client = create_http_client("test", http2=False)
+        try:
+            assert await prewarm(client, "http://127.0.0.1:9/", timeout=1.0) == 0
+        finally:
+            await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_clients_with_the_same_name_keep_separate_stats(self) -> None:
+        server, base_url, _ = await _start_server()
+        first = create_http_client("xai", http2=False)
+        second = create_http_client("xai", http2=False)
+        try:
+            await first.get(base_url)
+            await first.get(base_url)
+            await second.get(base_url)
+        finally:
+            await first.aclose()
+            await second.aclose()
+            server.close()
+            await server.wait_closed()
+
+        assert sorted(status["requests"] for status in get_http_pool_status()) == [1, 2]
+
+    def test_http2_falls_back_without_h2(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(http_transport, "h2_available", lambda: False)
+        client = create_http_client("test", http2=True)
+        assert get_http_pool_status()[0]["http2"] is False
+        assert client.is_closed is False
+
+    @pytest.mark.asyncio
+    async def test_injected_client_is_not_closed_by_grok_client(self) -> None:
+        shared = create_http_client("xai")
+        grok = GrokResponsesClient(api_key="k", http_client=shared)
+        await grok.close()
+        assert not shared.is_closed
+        await shared.aclose()
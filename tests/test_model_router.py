@@ -43,6 +43,21 @@ def _make_config(
     )
 
 
+# ---------------------------------------------------------------------------
+# ModelPricing
+# ---------------------------------------------------------------------------
+
+class TestModelPricing:
+    def test_cached_input_rate(self) -> None:
+        pricing = ModelPricing(input=2.0, output=10.0, cached_input=0.5)
+        assert pricing.calculate(1_000_000, 0, cached_tokens=1_000_000) == pytest.approx(0.5)
+        assert pricing.calculate(1_000_000, 0, cached_tokens=500_000) == pytest.approx(1.25)
+
+    def test_no_discount_without_cached_rate(self) -> None:
+        pricing = ModelPricing(input=2.0, output=10.0)
+        assert pricing.calculate(1_000_000, 0, cached_tokens=1_000_000) == pytest.approx(2.0)
+
+
 # ---------------------------------------------------------------------------
 # classify_query
 # ---------------------------------------------------------------------------
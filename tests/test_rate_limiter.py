@@ -4,10 +4,25 @@ from __future__ import annotations
 
 import asyncio
 import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator
 
 import pytest
 
-from rate_limiter import RateLimiter, TokenBucket, UserQuota
+from config import settings
+from db import (
+    add_dynamic_user,
+    add_usage_hook,
+    remove_usage_hook,
+    save_message,
+    save_message_pair_and_stats,
+    set_response_chain,
+    update_daily_stats,
+)
+from edit_scheduler import get_edit_scheduler
+from handlers.conversation import think_command
+from rate_limiter import ModelRateLimit, RateLimiter, TokenBucket, UserQuota
+from token_count import message_tokens
 
 
 # ---------------------------------------------------------------------------
@@ -38,6 +53,75 @@ class TestTokenBucket:
         # Should have refilled some tokens
         assert await bucket.acquire(1) is True
 
+    @pytest.mark.asyncio
+    async def test_waiters_are_served_in_fifo_order(self) -> None:
+        bucket = TokenBucket(capacity=2, refill_rate=200.0)
+        assert await bucket.acquire(2) is True
+        order: list[int] = []
+
+        async def waiter(i: int, tokens: float) -> None:
+            assert await bucket.wait_and_acquire(tokens, timeout=2.0)
+            order.append(i)
+
+        # The heavy acquire at the head is not overtaken by the light ones
+        await asyncio.gather(waiter(0, 2), waiter(1, 1), waiter(2, 1), waiter(3, 2))
+        assert order == [0, 1, 2, 3]
+        assert bucket.waiting == 0
+
+    @pytest.mark.asyncio
+    async def test_acquire_does_not_jump_the_queue(self) -> None:
+        bucket = TokenBucket(capacity=1, refill_rate=20.0)
+        assert await bucket.acquire() is True
+        task = asyncio.create_task(bucket.wait_and_acquire(1, timeout=1.0))
+        await asyncio.sleep(0)
+        assert bucket.waiting == 1
+        assert await bucket.acquire() is False
+        assert await task is True
+
+    @pytest.mark.asyncio
+    async def test_wakes_at_computed_time_without_polling(self) -> None:
+        bucket = TokenBucket(capacity=10, refill_rate=50.0)
+        assert await bucket.acquire(10) is True
+        started = time.monotonic()
+        assert await bucket.wait_and_acquire(5, timeout=1.0) is True
+        assert 0.09 <= time.monotonic() - started < 0.2
+
+    @pytest.mark.asyncio
+    async def test_unreachable_requests_fail_fast(self) -> None:
+        bucket = TokenBucket(capacity=5, refill_rate=1.0)
+        assert await bucket.wait_and_acquire(6, timeout=10.0) is False
+        assert await bucket.acquire(5) is True
+        started = time.monotonic()
+        assert await bucket.wait_and_acquire(3, timeout=1.0) is False
+        assert time.monotonic() - started < 0.05
+        assert bucket.waiting == 0
+
+    @pytest.mark.asyncio
+    async def test_timeout_leaves_queue(self) -> None:
+        bucket = TokenBucket(capacity=1, refill_rate=10.0)
+        assert await bucket.acquire() is True
+        first = asyncio.create_task(bucket.wait_and_acquire(1, timeout=0.2))
+        await asyncio.sleep(0)
+        # Would have to wait ~0.2 s behind the first waiter
+        assert await bucket.wait_and_acquire(1, timeout=0.01) is False
+        assert await first is True
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_lets_next_one_through(self) -> None:
+        bucket = TokenBucket(capacity=4, refill_rate=20.0)
+        assert await bucket.acquire(4) is True
+        heavy = asyncio.create_task(bucket.wait_and_acquire(4, timeout=1.0))
+        light = asyncio.create_task(bucket.wait_and_acquire(1, timeout=1.0))
+        await asyncio.sleep(0)
+        heavy.cancel()
+        started = time.monotonic()
+        assert await light is True
+        # Served after ~1 token of refill, not after the cancelled 4
+        assert time.monotonic() - started < 0.15
+        with pytest.raises(asyncio.CancelledError):
+            await heavy
+        assert bucket.waiting == 0
+
 
 # ---------------------------------------------------------------------------
 # UserQuota
@@ -90,6 +174,7 @@ class TestUserQuota:
 # RateLimiter (integration)
 # ---------------------------------------------------------------------------
 
+@pytest.mark.usefixtures("reset_db")
 class TestRateLimiter:
     @pytest.mark.asyncio
     async def test_rate_limiter_check_and_acquire(self) -> None:
@@ -113,3 +198,415 @@ class TestRateLimiter:
         remaining = limiter.get_user_remaining(123)
         assert remaining["requests"] == 199
         assert remaining["tokens"] == 499_500
+
+    def test_caps_default_to_settings(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(settings, "daily_request_cap", 3)
+        monkeypatch.setattr(settings, "daily_cost_cap_usd", 0.5)
+        remaining = RateLimiter().get_user_remaining(1)
+        assert remaining["requests"] == 3
+        assert remaining["cost_usd"] == pytest.approx(0.5)
+
+    @pytest.mark.asyncio
+    async def test_quota_is_loaded_from_usage_stats(self) -> None:
+        await update_daily_stats(1, tokens_in=100, tokens_out=50, reasoning_tokens=10, cost_usd=0.5)
+        limiter = RateLimiter(daily_requests=200, daily_tokens=500_000, daily_cost_usd=5.0)
+        await limiter.load_user_quota(1)
+        assert limiter.get_user_remaining(1) == {"requests": 199, "tokens": 499_840, "cost_usd": 4.5}
+
+    @pytest.mark.asyncio
+    async def test_exhausted_budget_survives_restart(self) -> None:
+        await update_daily_stats(1, tokens_in=10, tokens_out=10, reasoning_tokens=0, cost_usd=5.0)
+        ok, reason = await RateLimiter(daily_cost_usd=5.0).check_and_acquire(1, "m", estimated_cost=0.01)
+        assert ok is False
+        assert "kosztów" in reason
+
+    @pytest.mark.asyncio
+    async def test_usage_is_loaded_once_per_user(self) -> None:
+        loads: list[int] = []
+
+        async def load_usage(user_id: int) -> dict[str, object]:
+            loads.append(user_id)
+            return {"total_requests": 5}
+
+        limiter = RateLimiter(daily_requests=200, load_usage=load_usage)
+        for _ in range(3):
+            assert (await limiter.check_and_acquire(1, "m"))[0] is True
+        assert loads == [1]
+        assert limiter.get_user_remaining(1)["requests"] == 195
+
+    @pytest.mark.asyncio
+    async def test_usage_hook_reconciles_saved_usage(self) -> None:
+        limiter = RateLimiter(daily_requests=200, daily_tokens=500_000, daily_cost_usd=5.0)
+        await limiter.load_user_quota(1)
+        add_usage_hook(limiter.record_usage)
+        try:
+            await save_message_pair_and_stats(
+                1, "pytanie", "odpowiedź", tokens_in=100, tokens_out=40, reasoning_tokens=10, cost_usd=0.25,
+            )
+            await update_daily_stats(1, tokens_in=20, tokens_out=0, reasoning_tokens=0, cost_usd=0.05, requests=0)
+        finally:
+            remove_usage_hook(limiter.record_usage)
+        remaining = limiter.get_user_remaining(1)
+        assert remaining["requests"] == 199
+        assert remaining["tokens"] == 500_000 - 170
+        assert remaining["cost_usd"] == pytest.approx(4.70)
+
+        # A fresh process reads the same numbers back from usage_stats
+        restarted = RateLimiter(daily_requests=200, daily_tokens=500_000, daily_cost_usd=5.0)
+        await restarted.load_user_quota(1)
+        assert restarted.get_user_remaining(1) == remaining
+
+    @pytest.mark.asyncio
+    async def test_usage_recorded_during_load_is_kept(self) -> None:
+        release = asyncio.Event()
+
+        async def load_usage(user_id: int) -> dict[str, object]:
+            snapshot = {"total_requests": 3, "total_tokens_in": 300, "total_cost_usd": 0.3}
+            await release.wait()  # the usage below lands after this snapshot was taken
+            return snapshot
+
+        limiter = RateLimiter(daily_requests=200, daily_tokens=10_000, daily_cost_usd=5.0, load_usage=load_usage)
+        loading = asyncio.create_task(limiter.load_user_quota(1))
+        await asyncio.sleep(0)
+        limiter.record_usage(1, 500, 0.5)  # usage hook of an exchange saved meanwhile
+        release.set()
+        await loading
+        remaining = limiter.get_user_remaining(1)
+        assert remaining["requests"] == 200 - 4
+        assert remaining["tokens"] == 10_000 - 800
+        assert remaining["cost_usd"] == pytest.approx(5.0 - 0.8)
+
+    @pytest.mark.asyncio
+    async def test_failed_load_keeps_quota_unloaded_and_retries(self) -> None:
+        calls: list[int] = []
+
+        async def load_usage(user_id: int) -> dict[str, object]:
+            calls.append(user_id)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return {"total_requests": 200}
+
+        limiter = RateLimiter(daily_requests=200, load_usage=load_usage)
+        quota = await limiter.load_user_quota(1)
+        assert quota.loaded is False
+        ok, reason = await limiter.check_and_acquire(1, "m")
+        assert ok is False  # second attempt loads the exhausted budget
+        assert calls == [1, 1]
+
+    @pytest.mark.asyncio
+    async def test_db_error_does_not_reset_daily_cap(self, reset_db: object) -> None:
+        await update_daily_stats(1, tokens_in=10, tokens_out=10, reasoning_tokens=0, cost_usd=5.0)
+        await reset_db.execute("ALTER TABLE usage_stats RENAME TO usage_stats_broken")  # type: ignore[attr-defined]
+        limiter = RateLimiter(daily_cost_usd=5.0)
+        assert (await limiter.load_user_quota(1)).loaded is False
+
+        await reset_db.execute("ALTER TABLE usage_stats_broken RENAME TO usage_stats")  # type: ignore[attr-defined]
+        ok, reason = await limiter.check_and_acquire(1, "m", estimated_cost=0.01)
+        assert ok is False
+        assert "kosztów" in reason
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_quotas_are_evicted(self) -> None:
+        loads: list[int] = []
+
+        async def load_usage(user_id: int) -> dict[str, object]:
+            loads.append(user_id)
+            return {"total_requests": 0}
+
+        limiter = RateLimiter(max_users=2, load_usage=load_usage)
+        await limiter.load_user_quota(1)
+        await limiter.load_user_quota(2)
+        await limiter.load_user_quota(1)
+        await limiter.load_user_quota(3)  # evicts 2
+        assert limiter.status()["users_tracked"] == 2
+        await limiter.load_user_quota(1)
+        await limiter.load_user_quota(2)
+        assert loads == [1, 2, 3, 2]
+
+
+# ---------------------------------------------------------------------------
+# Reservations
+# ---------------------------------------------------------------------------
+
+async def _no_usage(user_id: int) -> dict[str, object]:
+    return {"total_requests": 0}
+
+
+class TestReservations:
+    @pytest.mark.asyncio
+    async def test_parallel_requests_cannot_overrun_budget(self) -> None:
+        limiter = RateLimiter(daily_tokens=50_000, load_usage=_no_usage)
+        results = await asyncio.gather(
+            *(limiter.reserve(1, "m", prompt_tokens=1_000, max_tokens=16_000) for _ in range(20))
+        )
+        granted = [r for r, _ in results if r is not None]
+        assert len(granted) == 2
+        assert all("tokenów" in reason for r, reason in results if r is None)
+        assert limiter.status()["reservations"] == 2
+
+    @pytest.mark.asyncio
+    async def test_release_returns_budget_once(self) -> None:
+        limiter = RateLimiter(daily_requests=1, load_usage=_no_usage)
+        reservation, _ = await limiter.reserve(1, "m", prompt_tokens=10, max_tokens=100)
+        assert reservation is not None
+        denied, reason = await limiter.reserve(1, "m", prompt_tokens=10, max_tokens=100)
+        assert denied is None and "zapytań" in reason
+
+        limiter.release(reservation)
+        limiter.release(reservation)
+        assert limiter.get_user_remaining(1)["requests"] == 1
+        again, _ = await limiter.reserve(1, "m", prompt_tokens=10, max_tokens=100)
+        assert again is not None
+
+    @pytest.mark.asyncio
+    async def test_commit_settles_to_actual_usage(self) -> None:
+        limiter = RateLimiter(daily_tokens=100_000, daily_cost_usd=5.0, load_usage=_no_usage)
+        reservation, _ = await limiter.reserve(1, "m", prompt_tokens=1_000, max_tokens=16_000)
+        assert reservation is not None
+        assert limiter.get_user_remaining(1)["tokens"] == 83_000
+
+        limiter.commit(reservation, tokens=1_500, cost=0.01)
+        limiter.release(reservation)  # no-op after commit
+        remaining = limiter.get_user_remaining(1)
+        assert remaining["tokens"] == 98_500
+        assert remaining["requests"] == 199
+        assert remaining["cost_usd"] == pytest.approx(4.99)
+
+    @pytest.mark.asyncio
+    async def test_commit_without_amounts_relies_on_usage_hook(self) -> None:
+        limiter = RateLimiter(daily_tokens=100_000, load_usage=_no_usage)
+        reservation, _ = await limiter.reserve(1, "m", prompt_tokens=1_000, max_tokens=16_000)
+        assert reservation is not None
+        limiter.record_usage(1, 1_200, 0.001)  # what the usage hook does on persist
+        limiter.commit(reservation)
+        assert limiter.get_user_remaining(1)["tokens"] == 98_800
+
+    @pytest.mark.asyncio
+    async def test_failed_save_charges_spent_usage(self) -> None:
+        limiter = RateLimiter(daily_tokens=100_000, daily_cost_usd=5.0, load_usage=_no_usage)
+        reservation, _ = await limiter.reserve(1, "m", prompt_tokens=1_000, max_tokens=16_000)
+        assert reservation is not None
+        # The usage hook never ran, so the spend is charged with the commit
+        limiter.commit_after_save(reservation, False, 1_500, 0.01)
+        remaining = limiter.get_user_remaining(1)
+        assert remaining["tokens"] == 98_500
+        assert remaining["requests"] == 199
+        assert limiter.status()["reservations"] == 0
+
+    @pytest.mark.asyncio
+    async def test_quotas_with_reservations_are_not_evicted(self) -> None:
+        limiter = RateLimiter(max_users=1, load_usage=_no_usage)
+        reservation, _ = await limiter.reserve(1, "m", prompt_tokens=10, max_tokens=100)
+        await limiter.load_user_quota(2)
+        assert limiter.status()["users_tracked"] == 2
+        limiter.release(reservation)
+        await limiter.load_user_quota(3)
+        assert limiter.status()["users_tracked"] == 1
+
+
+class _FakeMessage:
+    chat_id = 1
+    message_id = 1
+
+    def __init__(self) -> None:
+        self.replies: list[str] = []
+
+    async def reply_text(self, text: str, **kwargs: Any) -> "_FakeMessage":
+        self.replies.append(text)
+        return _FakeMessage()
+
+    async def edit_text(self, text: str, **kwargs: Any) -> None:
+        pass
+
+
+class _SlowGrok:
+    """Streams one answer per call once *release* is set."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def chat_stream(self, messages: list[dict[str, Any]], **kwargs: Any) -> AsyncIterator[tuple[str, Any]]:
+        self.calls += 1
+        await self.release.wait()
+        yield ("content", "odpowiedź")
+        yield ("done", {"prompt_tokens": 500, "completion_tokens": 100})
+
+
+class TestHandlerReservations:
+    @pytest.mark.asyncio
+    async def test_concurrent_think_cannot_overrun_token_budget(
+        self, reset_db: object, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(settings, "max_output_tokens", 10_000)
+        await add_dynamic_user(1, added_by=0)
+        # Room for one worst-case /think, not two
+        limiter = RateLimiter(daily_tokens=15_000, load_usage=_no_usage)
+        grok = _SlowGrok()
+        context = SimpleNamespace(
+            args=["pytanie"],
+            application=SimpleNamespace(bot_data={"grok_client": grok, "rate_limiter": limiter}),
+        )
+        messages = [_FakeMessage() for _ in range(3)]
+        add_usage_hook(limiter.record_usage)
+        try:
+            tasks = [
+                asyncio.create_task(
+                    think_command(SimpleNamespace(effective_user=SimpleNamespace(id=1), message=m), context)  # type: ignore[arg-type]
+                )
+                for m in messages
+            ]
+            await asyncio.sleep(0.05)
+            assert limiter.status()["reservations"] == 1
+            grok.release.set()
+            await asyncio.gather(*tasks)
+        finally:
+            remove_usage_hook(limiter.record_usage)
+            await get_edit_scheduler().stop()
+
+        assert grok.calls == 1
+        refused = [m for m in messages if m.replies and m.replies[0].startswith("⏳")]
+        assert len(refused) == 2
+        assert all("tokenów" in m.replies[0] for m in refused)
+        assert limiter.status()["reservations"] == 0
+        assert limiter.get_user_remaining(1)["tokens"] == 15_000 - 600
+
+    @pytest.mark.asyncio
+    async def test_chained_reservation_covers_stored_history(
+        self, reset_db: object, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(settings, "xai_stateful_conversations", True)
+        monkeypatch.setattr(settings, "max_output_tokens", 1_000)
+        await add_dynamic_user(1, added_by=0)
+        history = [{"role": "user", "content": "x" * 40_000}, {"role": "assistant", "content": "ok"}]
+        for message in history:
+            await save_message(1, message["role"], message["content"])
+        await set_response_chain(1, "resp_1")
+        limiter = RateLimiter(daily_tokens=100_000, load_usage=_no_usage)
+        grok = _SlowGrok()
+        context = SimpleNamespace(
+            args=["pytanie"],
+            application=SimpleNamespace(bot_data={"grok_client": grok, "rate_limiter": limiter}),
+        )
+        task = asyncio.create_task(
+            think_command(SimpleNamespace(effective_user=SimpleNamespace(id=1), message=_FakeMessage()), context)  # type: ignore[arg-type]
+        )
+        try:
+            await asyncio.sleep(0.05)
+            reserved = 100_000 - limiter.get_user_remaining(1)["tokens"]
+            # Only the new turn is uploaded, but xAI bills the whole chain
+            assert reserved >= sum(message_tokens(m) for m in history) + 1_000
+        finally:
+            grok.release.set()
+            await task
+            await get_edit_scheduler().stop()
+
+
+# ---------------------------------------------------------------------------
+# ModelRateLimit (sliding window RPM + TPM)
+# ---------------------------------------------------------------------------
+
+async def _timed_admit(limit: ModelRateLimit, tokens: int = 0) -> float:
+    started = time.monotonic()
+    await limit.admit(tokens)
+    return time.monotonic() - started
+
+
+class TestModelRateLimit:
+    @pytest.mark.asyncio
+    async def test_requests_per_window(self) -> None:
+        limit = ModelRateLimit(rpm=2, window=0.2)
+        assert await _timed_admit(limit) < 0.05
+        assert await _timed_admit(limit) < 0.05
+        assert 0.15 <= await _timed_admit(limit) < 0.35
+
+    @pytest.mark.asyncio
+    async def test_tokens_per_window(self) -> None:
+        limit = ModelRateLimit(rpm=100, tpm=100, window=0.2)
+        assert await _timed_admit(limit, 60) < 0.05
+        assert limit.delay(40) == 0
+        assert limit.delay(60) > 0.1
+        assert 0.15 <= await _timed_admit(limit, 60) < 0.35
+
+    @pytest.mark.asyncio
+    async def test_settled_usage_replaces_estimate(self) -> None:
+        limit = ModelRateLimit(rpm=100, tpm=100, window=0.2)
+        admission = await limit.admit(10)
+        assert limit.delay(50) == 0
+        admission.settle(90)
+        assert limit.status()["tokens_in_window"] == 90
+        assert limit.delay(50) > 0.1
+
+    @pytest.mark.asyncio
+    async def test_provider_headers_pause_admission_until_reset(self) -> None:
+        limit = ModelRateLimit(rpm=100, tpm=1_000_000)
+        limit.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "150ms"})
+        assert 0.1 < limit.delay() <= 0.15
+        assert 0.1 <= await _timed_admit(limit) < 0.3
+
+        limit.observe({"x-ratelimit-remaining-tokens": "500", "x-ratelimit-reset-tokens": "10s"})
+        assert limit.delay(400) == 0
+        assert limit.delay(600) > 9
+
+    @pytest.mark.asyncio
+    async def test_waiters_are_admitted_in_order(self) -> None:
+        limit = ModelRateLimit(rpm=1, window=0.05)
+        order: list[int] = []
+
+        async def request(i: int) -> None:
+            await limit.admit()
+            order.append(i)
+
+        await asyncio.gather(*(request(i) for i in range(4)))
+        assert order == [0, 1, 2, 3]
+        assert limit.status()["delayed"] == 3
+
+    @pytest.mark.asyncio
+    async def test_unregistered_models_get_default_limits(self) -> None:
+        limiter = RateLimiter(model_rpm=10, model_tpm=1_000, load_usage=_no_usage)
+        limit = limiter.model_limit("grok-x")
+        assert limit is not None and (limit.rpm, limit.tpm) == (10, 1_000)
+        assert limiter.model_limit("grok-x") is limit
+        assert RateLimiter(load_usage=_no_usage).model_limit("grok-x") is None
+
+    @pytest.mark.asyncio
+    async def test_long_model_queue_is_refused_up_front(self) -> None:
+        limiter = RateLimiter(load_usage=_no_usage, max_model_wait=1.0)
+        limiter.add_model_limit("m", rpm=1)
+        await limiter.model_limit("m").admit()  # type: ignore[union-attr]
+        ok, reason = await limiter.check_and_acquire(1, "m")
+        assert ok is False
+        assert "Rate limit modelu" in reason
+
+    @pytest.mark.asyncio
+    async def test_queue_delay_counts_waiters_ahead(self) -> None:
+        limit = ModelRateLimit(rpm=1, window=0.2)
+        await limit.admit()
+        waiter = asyncio.create_task(limit.admit())
+        await asyncio.sleep(0)
+        assert limit.status()["waiting"] == 1
+        assert 0.1 < limit.delay() <= 0.2
+        assert 0.3 < limit.queue_delay() <= 0.4
+        await waiter
+        assert limit.status()["waiting"] == 0
+
+    @pytest.mark.asyncio
+    async def test_newcomer_is_refused_behind_queued_waiters(self) -> None:
+        limiter = RateLimiter(load_usage=_no_usage, max_model_wait=90.0)
+        limiter.add_model_limit("m", rpm=1)
+        limit = limiter.model_limit("m")
+        assert limit is not None
+        await limit.admit()
+        ok, _ = await limiter.check_and_acquire(1, "m")
+        assert ok is True  # alone it would wait one 60 s window
+        waiter = asyncio.create_task(limit.admit())
+        await asyncio.sleep(0)
+        try:
+            ok, reason = await limiter.check_and_acquire(2, "m")
+            assert ok is False
+            assert "Rate limit modelu" in reason
+        finally:
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        assert limit.status()["waiting"] == 0
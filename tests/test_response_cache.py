@@ -0,0 +1,84 @@
+"""Tests for the exact-match response cache."""
+
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from response_cache import ResponseCache, make_cache_key
+
+pytestmark = pytest.mark.usefixtures("reset_db")
+
+
+def _cache(**kwargs: object) -> ResponseCache:
+    return ResponseCache(ttls={"websearch": 60.0, "fast": 60.0}, **kwargs)  # type: ignore[arg-type]
+
+
+class TestCacheKey:
+    def test_prompt_is_normalised(self) -> None:
+        assert make_cache_key("websearch", "m", "  Pogoda   Warszawa ") == make_cache_key(
+            "websearch", "m", "pogoda warszawa"
+        )
+
+    def test_command_model_tools_and_context_are_part_of_key(self) -> None:
+        base = make_cache_key("websearch", "m", "q", [{"type": "web_search"}])
+        assert base != make_cache_key("xsearch", "m", "q", [{"type": "web_search"}])
+        assert base != make_cache_key("websearch", "other", "q", [{"type": "web_search"}])
+        assert base != make_cache_key("websearch", "m", "q", [{"type": "x_search"}])
+        assert base != make_cache_key("websearch", "m", "q", [{"type": "web_search"}], context="history")
+
+
+class TestResponseCache:
+    @pytest.mark.asyncio
+    async def test_miss_then_hit(self) -> None:
+        cache = _cache()
+        key = make_cache_key("websearch", "m", "q")
+        assert await cache.get("websearch", key) is None
+        await cache.put("websearch", key, "odpowiedź", "m")
+        hit = await cache.get("websearch", key)
+        assert hit is not None and hit.content == "odpowiedź"
+        assert cache.status()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_entries_survive_in_sqlite_after_lru_eviction(self) -> None:
+        cache = _cache(max_entries=1)
+        first, second = make_cache_key("fast", "m", "a"), make_cache_key("fast", "m", "b")
+        await cache.put("fast", first, "A")
+        await cache.put("fast", second, "B")  # evicts "a" from memory
+        hit = await cache.get("fast", first)
+        assert hit is not None and hit.content == "A"
+        assert cache.status()["db_hits"] == 1
+
+        # A fresh process (empty LRU) is served from the table
+        restarted = _cache()
+        assert (await restarted.get("fast", second)).content == "B"  # type: ignore[union-attr]
+
+    @pytest.mark.asyncio
+    async def test_expired_entries_are_not_served(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        cache = _cache()
+        key = make_cache_key("websearch", "m", "q")
+        await cache.put("websearch", key, "stare")
+        later = time.time() + 120
+        monkeypatch.setattr("response_cache.time.time", lambda: later)
+        assert await cache.get("websearch", key) is None
+
+    @pytest.mark.asyncio
+    async def test_commands_without_ttl_are_not_cached(self) -> None:
+        cache = _cache()
+        key = make_cache_key("xsearch", "m", "q")
+        await cache.put("xsearch", key, "x")
+        assert await cache.get("xsearch", key) is None
+        assert cache.status()["stores"] == 0
+
+    @pytest.mark.asyncio
+    async def test_purge_by_command(self) -> None:
+        cache = _cache()
+        web, fast = make_cache_key("websearch", "m", "q"), make_cache_key("fast", "m", "q")
+        await cache.put("websearch", web, "w")
+        await cache.put("fast", fast, "f")
+        assert await cache.purge("websearch") == 1
+        assert await cache.get("websearch", web) is None
+        assert await cache.get("fast", fast) is not None
+        assert await cache.purge() == 1
+        assert await cache.get("fast", fast) is None
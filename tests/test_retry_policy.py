@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import httpx
+import pytest
+
+from retry_policy import RetryableError, RetryPolicy, parse_duration, retry_after_hint
+
+
+def _status_error(status: int, headers: dict[str, str] | None = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.x.ai/v1/responses")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def _upper(low: float, high: float) -> float:
+    return high
+
+
+class TestParsing:
+    @pytest.mark.parametrize(
+        ("value", "expected"),
+        [("2", 2.0), ("1.5s", 1.5), ("250ms", 0.25), ("6m0s", 360.0), ("1h2m", 3720.0), ("soon", None)],
+    )
+    def test_parse_duration(self, value: str, expected: float | None) -> None:
+        assert parse_duration(value) == expected
+
+    def test_retry_after_header_wins(self) -> None:
+        response = httpx.Response(429, headers={"retry-after": "7", "x-ratelimit-reset-requests": "1s"})
+        assert retry_after_hint(response) == 7.0
+
+    def test_only_exhausted_ratelimit_budgets_count(self) -> None:
+        response = httpx.Response(
+            429,
+            headers={
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "2s",
+                "x-ratelimit-remaining-tokens": "5000",
+                "x-ratelimit-reset-tokens": "1m",
+            },
+        )
+        assert retry_after_hint(response) == 2.0
+
+    def test_no_hint(self) -> None:
+        assert retry_after_hint(httpx.Response(500)) is None
+
+
+class TestRetryPolicy:
+    def test_full_jitter_is_capped(self) -> None:
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, rng=_upper)
+        assert [policy.backoff(n) for n in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+    def test_classification(self) -> None:
+        policy = RetryPolicy()
+        assert policy.is_retryable(_status_error(503))
+        assert policy.is_retryable(_status_error(429))
+        assert not policy.is_retryable(_status_error(400))
+        assert not policy.is_retryable(_status_error(401))
+        assert policy.is_retryable(httpx.ReadTimeout("slow"))
+        assert policy.is_retryable(RetryableError("overloaded"))
+        assert not policy.is_retryable(ValueError("bad json"))
+
+    def test_non_idempotent_only_retries_unprocessed_requests(self) -> None:
+        policy = RetryPolicy(idempotent=False)
+        assert policy.is_retryable(_status_error(429))
+        assert policy.is_retryable(httpx.ConnectError("refused"))
+        assert not policy.is_retryable(_status_error(500))
+        assert not policy.is_retryable(httpx.ReadTimeout("slow"))
+
+    def test_retry_after_is_honoured(self) -> None:
+        policy = RetryPolicy(base_delay=0.5, rng=_upper)
+        retry = policy.start()
+        assert retry.next_delay(_status_error(429, {"retry-after": "3"})) == 3.5
+
+    def test_attempts_and_deadline_bound_retries(self) -> None:
+        retry = RetryPolicy(max_attempts=2, rng=_upper).start()
+        assert retry.next_delay(_status_error(500)) == 1.0
+        assert retry.next_delay(_status_error(500)) is None
+
+        retry = RetryPolicy(deadline=10.0, rng=_upper).start()
+        assert retry.next_delay(_status_error(429, {"retry-after": "60"})) is None
@@ -0,0 +1,69 @@
+"""Tests for the SSE decoder."""
+
+from __future__ import annotations
+
+import json
+
+import httpx
+import pytest
+
+from sse import SSEDecoder, aiter_sse_json, stdlib_loads
+
+
+def _decode_in_chunks(raw: bytes, size: int) -> list[tuple[str, bytes, str | None]]:
+    decoder = SSEDecoder()
+    events = []
+    for start in range(0, len(raw), size):
+        events.extend(decoder.feed(raw[start:start + size]))
+    events.extend(decoder.close())
+    return [(e.event, e.data, e.id) for e in events]
+
+
+class TestSSEDecoder:
+    def test_framing_independent_of_chunk_boundaries(self) -> None:
+        raw = (
+            b"\xef\xbb\xbf: keep-alive\r\n"
+            b"event: response.output_text.delta\r\n"
+            b"data: {\"delta\": \"a\"}\r\n\r\n"
+            b"data: line1\ndata:line2\nid: 7\n\n"
+            b"data\rdata: x\r\r"
+        )
+        expected = [
+            ("response.output_text.delta", b'{"delta": "a"}', None),
+            ("message", b"line1\nline2", "7"),
+            ("message", b"\nx", "7"),
+        ]
+        for size in (1, 2, 3, 7, len(raw)):
+            assert _decode_in_chunks(raw, size) == expected
+
+    def test_empty_data_and_unterminated_event_not_dispatched(self) -> None:
+        decoder = SSEDecoder()
+        assert decoder.feed(b"event: ping\n\n") == []
+        assert decoder.feed(b"data: partial\n") == []
+
+    def test_event_name_resets_after_dispatch(self) -> None:
+        events = SSEDecoder().feed(b"event: a\ndata: 1\n\ndata: 2\n\n")
+        assert [e.event for e in events] == ["a", "message"]
+
+    def test_retry_field(self) -> None:
+        decoder = SSEDecoder()
+        decoder.feed(b"retry: 1500\nretry: soon\n\n")
+        assert decoder.retry == 1500
+
+
+class TestAiterSseJson:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("loads", [json.loads, stdlib_loads])
+    async def test_yields_objects_until_done(self, loads: object) -> None:
+        body = (
+            b"data: {\"n\": 1}\n\n"
+            b"data: not json\n\n"
+            b"data: {\"n\": \"\xff\"}\n\n"
+            b"data: [1, 2]\n\n"
+            b"data: {\"n\": 2}\n\n"
+            b"data: [DONE]\n\n"
+            b"data: {\"n\": 3}\n\n"
+        )
+        response = httpx.Response(200, content=body)
+        payloads = [p async for p in aiter_sse_json(response, loads=loads)]  # type: ignore[arg-type]
+        assert payloads == [{"n": 1}, {"n": 2}]
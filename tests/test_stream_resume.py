@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from stream_resume import ResumeGuard
+
+
+def _feed(guard: ResumeGuard, *events: tuple[str, str]) -> list[tuple[str, object]]:
+    out: list[tuple[str, object]] = []
+    for event, data in events:
+        out.extend(guard.feed(event, data))
+    return out
+
+
+class TestResumeGuard:
+    def test_passes_through_without_retry(self) -> None:
+        guard = ResumeGuard()
+        assert _feed(guard, ("reasoning", "r"), ("content", "a"), ("tool_call", "x")) == [
+            ("reasoning", "r"), ("content", "a"), ("tool_call", "x"),
+        ]
+        assert guard.finish() == []
+
+    def test_identical_replay_only_emits_continuation(self) -> None:
+        guard = ResumeGuard()
+        _feed(guard, ("content", "Hello "), ("content", "wor"))
+        guard.retry()
+        out = _feed(guard, ("content", "Hel"), ("content", "lo w"), ("content", "orld"), ("content", "!"))
+        assert out == [("content", "ld"), ("content", "!")]
+        assert guard.finish() == []
+        assert guard.restarts == 0
+
+    def test_divergent_replay_emits_restart(self) -> None:
+        guard = ResumeGuard()
+        _feed(guard, ("reasoning", "think"), ("content", "Hello world"))
+        guard.retry()
+        out = _feed(guard, ("reasoning", "think"), ("content", "Hello"), ("content", " there"))
+        assert out == [
+            ("restart", {"content": 11, "reasoning": 5}),
+            ("content", "Hello there"),
+            ("reasoning", "think"),
+        ]
+        # After the restart the new text is the delivered baseline
+        assert _feed(guard, ("content", "!")) == [("content", "!")]
+
+    def test_restart_accounts_for_continuation_emitted_during_replay(self) -> None:
+        guard = ResumeGuard()
+        _feed(guard, ("reasoning", "think"), ("content", "Hello"))
+        guard.retry()
+        out = _feed(guard, ("content", "Hello world"), ("reasoning", "thank"))
+        assert out == [
+            ("content", " world"),
+            ("restart", {"content": 11, "reasoning": 5}),
+            ("content", "Hello world"),
+            ("reasoning", "thank"),
+        ]
+
+    def test_shorter_replay_restarts_on_finish(self) -> None:
+        guard = ResumeGuard()
+        _feed(guard, ("content", "abcdef"))
+        guard.retry()
+        assert _feed(guard, ("content", "abc")) == []
+        assert guard.finish() == [("restart", {"content": 6, "reasoning": 0}), ("content", "abc")]
+
+    def test_second_retry_compares_with_everything_delivered(self) -> None:
+        guard = ResumeGuard()
+        _feed(guard, ("content", "abc"))
+        guard.retry()
+        _feed(guard, ("content", "abcde"))
+        guard.retry()
+        assert _feed(guard, ("content", "abcdef")) == [("content", "f")]
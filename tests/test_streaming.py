@@ -0,0 +1,123 @@
+"""Tests for streaming module (StreamRenderer)."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator
+
+import pytest
+
+from edit_scheduler import EditScheduler
+from streaming import StreamRenderer
+
+
+class _FakeMessage:
+    chat_id = 1
+    message_id = 1
+
+    def __init__(self) -> None:
+        self.edits: list[str] = []
+        self.replies: list[str] = []
+
+    async def edit_text(self, text: str, **kwargs: Any) -> None:
+        self.edits.append(text)
+
+    async def reply_text(self, text: str, **kwargs: Any) -> None:
+        self.replies.append(text)
+
+
+async def _events(items: list[tuple[str, Any]]) -> AsyncIterator[tuple[str, Any]]:
+    for item in items:
+        yield item
+
+
+class TestStreamRenderer:
+    @pytest.mark.asyncio
+    async def test_consume_accumulates_events(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        renderer = StreamRenderer(sent, reply_to, scheduler=EditScheduler(per_chat_interval=0.0))  # type: ignore[arg-type]
+        result = await renderer.consume(
+            _events([
+                ("reasoning", "hmm"),
+                ("tool_call", {"name": "ask_claude"}),
+                ("tool_use", "web_search"),
+                ("content", "Hello "),
+                ("content", "world"),
+                ("done", {"prompt_tokens": 10, "completion_tokens": 5, "reasoning_tokens": 2}),
+            ])
+        )
+        assert result.content == "Hello world"
+        assert result.reasoning == "hmm"
+        assert result.tools_used == ["ask_claude", "web_search"]
+        assert (result.tokens_in, result.tokens_out, result.reasoning_tokens) == (10, 5, 2)
+
+    @pytest.mark.asyncio
+    async def test_every_preview_goes_to_the_scheduler(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        scheduler = EditScheduler(per_chat_interval=0.0)
+        renderer = StreamRenderer(sent, reply_to, scheduler=scheduler)  # type: ignore[arg-type]
+        await renderer.consume(_events([("content", "a"), ("content", "b"), ("content", "c")]))
+        # No renderer-side throttle: the scheduler decides what to coalesce
+        assert scheduler.status()["submitted"] == 3
+        await asyncio.sleep(0.01)
+        await scheduler.stop()
+        assert sent.edits[-1] == "abc"
+
+    @pytest.mark.asyncio
+    async def test_tool_progress_is_shown_under_tool_status(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        scheduler = EditScheduler(per_chat_interval=0.0)
+        renderer = StreamRenderer(
+            sent,
+            reply_to,
+            tool_status=lambda tool: f"using {tool}",
+            scheduler=scheduler,  # type: ignore[arg-type]
+        )
+        result = await renderer.consume(
+            _events([
+                ("tool_call", {"name": "ask_claude"}),
+                ("tool_progress", {"name": "ask_claude", "delta": "partial <b>"}),
+            ])
+        )
+        await asyncio.sleep(0.01)
+        await scheduler.stop()
+        assert result.content == ""
+        assert sent.edits[-1] == "using ask_claude\n\n<i>partial &lt;b&gt;</i>"
+
+    @pytest.mark.asyncio
+    async def test_restart_drops_superseded_text(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        renderer = StreamRenderer(sent, reply_to, scheduler=EditScheduler(per_chat_interval=0.0))  # type: ignore[arg-type]
+        result = await renderer.consume(
+            _events([
+                ("content", "Intro. "),
+                ("content", "Old answer"),
+                ("restart", {"content": 10, "reasoning": 0}),
+                ("content", "New answer"),
+            ])
+        )
+        assert result.content == "Intro. New answer"
+        assert renderer._render_preview() == "Intro. New answer"
+
+    @pytest.mark.asyncio
+    async def test_finish_splits_long_answer(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        renderer = StreamRenderer(sent, reply_to, scheduler=EditScheduler(per_chat_interval=0.0))  # type: ignore[arg-type]
+        await renderer.consume(_events([("content", "word " * 2000)]))
+        await renderer.finish("footer")
+        assert sent.edits
+        assert reply_to.replies
+        assert "footer" in reply_to.replies[-1]
+
+    @pytest.mark.asyncio
+    async def test_preview_is_truncated(self) -> None:
+        sent, reply_to = _FakeMessage(), _FakeMessage()
+        scheduler = EditScheduler(per_chat_interval=0.0)
+        renderer = StreamRenderer(
+            sent, reply_to, preview_limit=10, scheduler=scheduler  # type: ignore[arg-type]
+        )
+        await renderer.consume(_events([("content", "x" * 50)]))
+        await asyncio.sleep(0.01)
+        await scheduler.stop()
+        assert sent.edits[0].startswith("x" * 10)
+        assert "kontynuacja" in sent.edits[0]
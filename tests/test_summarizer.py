@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+import pytest
+
+from config import settings
+from context_builder import build_chat_context
+from db import (
+    add_pair_saved_hook,
+    clear_history,
+    flush_writes,
+    get_conversation_summary,
+    get_daily_stats,
+    get_write_queue_status,
+    remove_pair_saved_hook,
+    save_message,
+    save_message_pair_and_stats,
+)
+from summarizer import ConversationSummarizer
+
+pytestmark = pytest.mark.usefixtures("reset_db")
+
+
+class _FakeGrok:
+    """Returns a numbered summary and records the prompts it was given."""
+
+    def __init__(self) -> None:
+        self.calls: list[dict[str, Any]] = []
+
+    async def chat(self, messages: list[dict[str, str]], **kwargs: Any) -> dict[str, Any]:
+        self.calls.append({"messages": messages, **kwargs})
+        return {
+            "content": f"streszczenie {len(self.calls)}",
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20},
+        }
+
+
+async def _seed(user_id: int, pairs: int) -> None:
+    for i in range(pairs):
+        await save_message(user_id, "user", f"pytanie {i}")
+        await save_message(user_id, "assistant", f"odpowiedź {i}")
+
+
+def _summarizer(grok: _FakeGrok) -> ConversationSummarizer:
+    return ConversationSummarizer(grok, model="fast", keep_recent=4, batch_messages=4)
+
+
+class TestSummarize:
+    @pytest.mark.asyncio
+    async def test_waits_for_a_full_batch(self) -> None:
+        grok = _FakeGrok()
+        await _seed(1, 3)  # 6 messages, 4 kept verbatim -> 2 pending
+        assert await _summarizer(grok).summarize(1) is False
+        assert grok.calls == []
+        assert await get_conversation_summary(1) is None
+
+    @pytest.mark.asyncio
+    async def test_summarizes_older_messages_and_keeps_recent(self) -> None:
+        grok = _FakeGrok()
+        await _seed(1, 5)  # 10 messages -> 6 older than the 4 kept
+        assert await _summarizer(grok).summarize(1) is True
+
+        prompt = grok.calls[0]["messages"][1]["content"]
+        assert "pytanie 0" in prompt and "pytanie 2" in prompt
+        assert "pytanie 3" not in prompt
+        assert grok.calls[0]["model"] == "fast"
+
+        summary = await get_conversation_summary(1)
+        assert summary is not None and summary.summary == "streszczenie 1"
+        assert summary.covered_until_id == 6
+
+    @pytest.mark.asyncio
+    async def test_next_run_extends_previous_summary(self) -> None:
+        grok = _FakeGrok()
+        summarizer = _summarizer(grok)
+        await _seed(1, 5)
+        await summarizer.summarize(1)
+        await _seed(1, 2)
+        assert await summarizer.summarize(1) is True
+        prompt = grok.calls[1]["messages"][1]["content"]
+        assert "streszczenie 1" in prompt
+        assert "pytanie 0" not in prompt
+        assert (await get_conversation_summary(1)).covered_until_id == 10  # type: ignore[union-attr]
+
+    @pytest.mark.asyncio
+    async def test_usage_is_billed_without_a_request(self) -> None:
+        await _seed(1, 5)
+        await _summarizer(_FakeGrok()).summarize(1)
+        stats = await get_daily_stats(1)
+        assert stats["total_requests"] == 0
+        assert stats["total_tokens_in"] == 100
+        assert stats["total_cost_usd"] > 0
+
+    @pytest.mark.asyncio
+    async def test_clear_during_summary_discards_it(self) -> None:
+        grok = _FakeGrok()
+        release = asyncio.Event()
+        chat = grok.chat
+
+        async def slow_chat(messages: list[dict[str, str]], **kwargs: Any) -> dict[str, Any]:
+            await release.wait()
+            return await chat(messages, **kwargs)
+
+        grok.chat = slow_chat  # type: ignore[method-assign]
+        await _seed(1, 5)
+        task = asyncio.create_task(_summarizer(grok).summarize(1))
+        await asyncio.sleep(0.01)
+        await clear_history(1)  # /clear while the model is summarising
+        release.set()
+        assert await task is False
+        assert await get_conversation_summary(1) is None
+
+        await _seed(1, 1)
+        ctx = await build_chat_context(1, "nowe pytanie")
+        assert all("streszczenie" not in m["content"] for m in ctx.messages)
+        # The tokens were spent, so they are still billed
+        assert (await get_daily_stats(1))["total_tokens_in"] == 100
+
+    @pytest.mark.asyncio
+    async def test_clear_history_drops_summary(self) -> None:
+        await _seed(1, 5)
+        await _summarizer(_FakeGrok()).summarize(1)
+        await clear_history(1)
+        assert await get_conversation_summary(1) is None
+
+
+class TestScheduling:
+    @pytest.mark.asyncio
+    async def test_saved_pair_triggers_background_summary(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(settings, "db_write_behind_enabled", False)
+        grok = _FakeGrok()
+        summarizer = _summarizer(grok)
+        add_pair_saved_hook(summarizer.schedule)
+        try:
+            for i in range(5):
+                await save_message_pair_and_stats(1, f"pytanie {i}", f"odpowiedź {i}")
+            while summarizer.status()["running"]:
+                await asyncio.sleep(0)
+        finally:
+            remove_pair_saved_hook(summarizer.schedule)
+            await summarizer.close()
+        assert (await get_conversation_summary(1)) is not None
+        assert summarizer.status()["failures"] == 0
+
+    @pytest.mark.asyncio
+    async def test_hook_does_not_flush_write_behind_per_exchange(self) -> None:
+        async def save_exchanges(summarizer: ConversationSummarizer | None) -> int:
+            if summarizer is not None:
+                add_pair_saved_hook(summarizer.schedule)
+            before = get_write_queue_status()["batches"]
+            try:
+                for i in range(50):
+                    await save_message_pair_and_stats(1, f"pytanie {i}", f"odpowiedź {i}")
+                    await asyncio.sleep(0.01)
+                await flush_writes()
+            finally:
+                if summarizer is not None:
+                    remove_pair_saved_hook(summarizer.schedule)
+                    await summarizer.close()
+            return get_write_queue_status()["batches"] - before
+
+        without_hook = await save_exchanges(None)
+        summarizer = ConversationSummarizer(_FakeGrok(), model="fast", keep_recent=20, batch_messages=20)
+        with_hook = await save_exchanges(summarizer)
+        # Only the runs that actually summarise flush the queue early
+        assert summarizer.status()["summaries"] >= 1
+        assert with_hook <= without_hook + summarizer.status()["runs"]
+        assert with_hook < 10
+
+
+    @pytest.mark.asyncio
+    async def test_backlog_keeps_only_recent_users(self) -> None:
+        summarizer = ConversationSummarizer(_FakeGrok(), model="fast", keep_recent=4, batch_messages=4, max_users=2)
+        try:
+            for user_id in (1, 2, 3):
+                await save_message_pair_and_stats(user_id, "pytanie", "odpowiedź")
+                summarizer.schedule(user_id)
+                while summarizer.status()["running"]:
+                    await asyncio.sleep(0)
+            assert list(summarizer._backlog) == [2, 3]
+        finally:
+            await summarizer.close()
+
+
+class TestContextWithSummary:
+    @pytest.mark.asyncio
+    async def test_summary_replaces_covered_history(self) -> None:
+        await _seed(1, 5)
+        await _summarizer(_FakeGrok()).summarize(1)
+
+        ctx = await build_chat_context(1, "nowe pytanie")
+        assert ctx.messages[1]["role"] == "system"
+        assert "streszczenie 1" in ctx.messages[1]["content"]
+        contents = [m["content"] for m in ctx.messages[2:]]
+        assert contents == ["pytanie 3", "odpowiedź 3", "pytanie 4", "odpowiedź 4", "nowe pytanie"]
+
+    @pytest.mark.asyncio
+    async def test_disabled_summaries_replay_history(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        await _seed(1, 5)
+        await _summarizer(_FakeGrok()).summarize(1)
+        monkeypatch.setattr(settings, "summary_enabled", False)
+        ctx = await build_chat_context(1, "nowe pytanie")
+        assert [m["role"] for m in ctx.messages[:2]] == ["system", "user"]
+        assert len(ctx.messages) == 12
@@ -0,0 +1,108 @@
+"""Tests for update_processor module."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+from concurrency import current_user
+from update_processor import PerUserUpdateProcessor, bind_current_user
+
+
+def _update(user_id: int, update_id: int = 1) -> Update:
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(timezone.utc),
+        chat=Chat(user_id, Chat.PRIVATE),
+        from_user=User(user_id, "test", False),
+        text="hi",
+    )
+    return Update(update_id, message=message)
+
+
+class TestPerUserUpdateProcessor:
+    @pytest.mark.asyncio
+    async def test_same_user_updates_run_in_order(self) -> None:
+        processor = PerUserUpdateProcessor(8)
+        gate = asyncio.Event()
+        log: list[str] = []
+
+        async def handler(name: str, wait: bool) -> None:
+            log.append(f"{name} start")
+            if wait:
+                await gate.wait()
+            log.append(f"{name} end")
+
+        first = asyncio.create_task(processor.process_update(_update(1, 1), handler("a", True)))
+        second = asyncio.create_task(processor.process_update(_update(1, 2), handler("b", False)))
+        await asyncio.sleep(0.01)
+        assert log == ["a start"]
+        gate.set()
+        await asyncio.gather(first, second)
+        assert log == ["a start", "a end", "b start", "b end"]
+        assert processor.status()["queued_behind_user"] == 1
+        assert processor.status()["active_users"] == 0
+
+    @pytest.mark.asyncio
+    async def test_flooding_user_does_not_hold_other_users_slots(self) -> None:
+        processor = PerUserUpdateProcessor(2)
+        gate = asyncio.Event()
+        served = asyncio.Event()
+
+        async def blocked() -> None:
+            await gate.wait()
+
+        async def other() -> None:
+            served.set()
+
+        flood = [
+            asyncio.create_task(processor.process_update(_update(1, i), blocked()))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        await processor.process_update(_update(2, 10), other())
+        assert served.is_set()
+        gate.set()
+        await asyncio.gather(*flood)
+        assert processor.status()["processed"] == 6
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit_applies_across_users(self) -> None:
+        processor = PerUserUpdateProcessor(1)
+        gate = asyncio.Event()
+        started: list[int] = []
+
+        async def handler(user_id: int) -> None:
+            started.append(user_id)
+            await gate.wait()
+
+        tasks = [
+            asyncio.create_task(processor.process_update(_update(uid, uid), handler(uid)))
+            for uid in (1, 2)
+        ]
+        await asyncio.sleep(0.01)
+        assert started == [1]
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert started == [1, 2]
+
+    def test_rejects_non_positive_limit(self) -> None:
+        with pytest.raises(ValueError):
+            PerUserUpdateProcessor(0)
+
+
+class TestBindCurrentUser:
+    @pytest.mark.asyncio
+    async def test_later_handlers_see_the_sender(self) -> None:
+        async def process(update: Update) -> int | None:
+            # PTB awaits blocking handlers of all groups in the update's task
+            await bind_current_user(update, None)  # type: ignore[arg-type]
+            return current_user.get()
+
+        assert await process(_update(7)) == 7
+        # An update without a sender is not attributed to the previous one
+        current_user.set(7)
+        assert await process(Update(2)) is None
@@ -3,10 +3,12 @@
 from __future__ import annotations
 
 from utils import (
+    IncrementalMarkdownConverter,
     escape_html,
     format_footer,
     format_number,
     markdown_to_telegram_html,
+    split_html_message,
     split_message,
 )
 
@@ -45,6 +47,42 @@ class TestMarkdownToTelegramHtml:
         assert '<a href="https://example.com">click</a>' in result
 
 
+# ---------------------------------------------------------------------------
+# IncrementalMarkdownConverter
+# ---------------------------------------------------------------------------
+
+_STREAM_SAMPLES = [
+    "Intro **bold** line\nand *italic*\n\n```python\nx = 1 < 2\n```\nafter `code` [link](https://x.ai)\n",
+    "Half *italic\nacross lines* then **bold**\n",
+    "[label\nsplit](https://example.com) & <tag>\n```\nunclosed fence\nstill code",
+    "plain text without newline",
+]
+
+
+class TestIncrementalMarkdownConverter:
+    def test_matches_batch_for_every_prefix(self) -> None:
+        for sample in _STREAM_SAMPLES:
+            converter = IncrementalMarkdownConverter()
+            for i, char in enumerate(sample, start=1):
+                converter.feed(char)
+                assert converter.render() == markdown_to_telegram_html(sample[:i])
+
+    def test_matches_batch_with_coarse_deltas(self) -> None:
+        sample = "".join(_STREAM_SAMPLES)
+        converter = IncrementalMarkdownConverter()
+        for start in range(0, len(sample), 7):
+            converter.feed(sample[start:start + 7])
+            converter.render()
+        assert converter.render() == markdown_to_telegram_html(sample)
+        assert len(converter) == len(sample)
+
+    def test_closed_prefix_is_not_rerendered(self) -> None:
+        converter = IncrementalMarkdownConverter()
+        converter.feed("**done** line\n" * 50 + "tail *open")
+        converter.render()
+        assert converter._tail == "tail *open"
+
+
 # ---------------------------------------------------------------------------
 # split_message
 # ---------------------------------------------------------------------------
@@ -72,6 +110,47 @@ class TestSplitMessage:
         found = any("```python" in part and "```" in part[part.index("```python") + 3:] for part in parts)
         assert found, "Code block was split across parts"
 
+    def test_split_message_strips_leading_newlines(self) -> None:
+        parts = split_message("a" * 8 + "\n\n\n" + "b" * 8, max_length=10)
+        assert parts == ["a" * 8, "b" * 8]
+
+
+# ---------------------------------------------------------------------------
+# split_html_message
+# ---------------------------------------------------------------------------
+
+class TestSplitHtmlMessage:
+    def test_short_html_unchanged(self) -> None:
+        assert split_html_message("<b>hi</b>") == ["<b>hi</b>"]
+
+    def test_reopens_tags_across_parts(self) -> None:
+        html = "<b>" + "słowo " * 40 + "</b>"
+        parts = split_html_message(html, max_length=60)
+        assert len(parts) > 1
+        for part in parts:
+            assert len(part) <= 60
+            assert part.startswith("<b>") and part.endswith("</b>")
+
+    def test_never_cuts_entities(self) -> None:
+        html = "&lt;&amp;&gt; " * 50
+        for part in split_html_message(html, max_length=40):
+            assert part.count("&") == part.count(";")
+
+    def test_keeps_code_block_whole_when_it_fits(self) -> None:
+        code = markdown_to_telegram_html("```\n" + "x = 1\n" * 10 + "```")
+        html = "intro " * 10 + "\n\n" + code
+        parts = split_html_message(html, max_length=len(code) + 10)
+        assert code in parts
+
+    def test_splits_oversized_code_block_at_line_ends(self) -> None:
+        html = "<pre><code>" + "line = 1\n" * 30 + "</code></pre>"
+        parts = split_html_message(html, max_length=80)
+        assert len(parts) > 1
+        for part in parts:
+            assert part.startswith("<pre><code>")
+            assert part.endswith("</code></pre>")
+            assert "line = 1" in part
+
 
 # ---------------------------------------------------------------------------
 # format_number
@@ -110,3 +189,8 @@ class TestFormatFooter:
         assert "2.0K" in result
         assert "$0.0123" in result
         assert "1.5s" in result
+        assert "cache" not in result
+
+    def test_format_footer_marks_cached_answer(self) -> None:
+        result = format_footer("grok-test", 0, 0, 0, 0.0, 0.1, cached=True)
+        assert result.endswith("♻️ z cache")
@@ -0,0 +1,83 @@
+"""Tests for the write-behind queue."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from write_behind import WriteBehindQueue
+
+
+class TestWriteBehindQueue:
+    @pytest.mark.asyncio
+    async def test_flushes_after_interval_in_one_batch(self) -> None:
+        batches: list[list[int]] = []
+
+        async def flush(batch: list[int]) -> None:
+            batches.append(batch)
+
+        queue: WriteBehindQueue[int] = WriteBehindQueue(flush, interval=0.02, max_items=100)
+        for item in range(5):
+            queue.put(item)
+        await asyncio.sleep(0.06)
+        assert batches == [[0, 1, 2, 3, 4]]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_flushes_early_when_full(self) -> None:
+        batches: list[list[int]] = []
+
+        async def flush(batch: list[int]) -> None:
+            batches.append(batch)
+
+        queue: WriteBehindQueue[int] = WriteBehindQueue(flush, interval=10.0, max_items=3)
+        for item in range(3):
+            queue.put(item)
+        await asyncio.sleep(0.01)
+        assert batches == [[0, 1, 2]]
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_flush_waits_for_batch_in_flight(self) -> None:
+        committed: list[int] = []
+        gate = asyncio.Event()
+
+        async def flush(batch: list[int]) -> None:
+            await gate.wait()
+            committed.extend(batch)
+
+        queue: WriteBehindQueue[int] = WriteBehindQueue(flush, interval=10.0)
+        queue.put(1)
+        first = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0.01)
+        # The batch has been swapped out but is not committed yet
+        assert queue.pending == 1
+        second = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        gate.set()
+        await second
+        assert committed == [1]
+        assert queue.pending == 0
+        await first
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_retried_then_dropped(self) -> None:
+        dropped: list[list[int]] = []
+
+        async def flush(batch: list[int]) -> None:
+            raise RuntimeError("disk full")
+
+        queue: WriteBehindQueue[int] = WriteBehindQueue(
+            flush, interval=10.0, max_attempts=2, on_drop=dropped.append
+        )
+        queue.put(1)
+        await queue.flush()
+        assert queue.pending == 1
+        await queue.flush()
+        assert queue.pending == 0
+        assert dropped == [[1]]
+        assert queue.status()["failures"] == 2
+        await queue.close()
@@ -0,0 +1,66 @@
+"""Cheap token estimates used to budget conversation context.
+
+No tokenizer ships for the Grok models, so counts are estimated from the
+UTF-8 size: about four bytes per token for English prose, which also makes
+Polish diacritics (two bytes each) and non-Latin scripts count heavier as
+they do in BPE vocabularies.  The estimate only has to be stable and
+roughly proportional — it decides how much history fits a budget, billing
+still uses the usage reported by the API.
+
+The per-message count is stored in ``conversations.token_count`` when a
+message is saved, so budgeting a long history never re-measures it.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+BYTES_PER_TOKEN: int = 4
+# Role marker and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS: int = 4
+# Flat estimate per attached image; its base64 payload is not text the model reads
+IMAGE_TOKENS: int = 1_800
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimated token count of *text*."""
+    if not text:
+        return 0
+    return -(-len(text.encode("utf-8")) // BYTES_PER_TOKEN)
+
+
+def message_tokens(message: dict[str, Any]) -> int:
+    """Estimated tokens of one chat message, using its stored count if present."""
+    stored = message.get("tokens")
+    if stored is None:
+        content = message.get("content", "")
+        if isinstance(content, list):  # multimodal parts
+            stored = sum(
+                estimate_tokens(str(part.get("text", ""))) if part.get("type") in ("text", "input_text")
+                else IMAGE_TOKENS
+                for part in content
+                if isinstance(part, dict)
+            )
+        else:
+            stored = estimate_tokens(content if isinstance(content, str) else str(content))
+    return int(stored) + MESSAGE_OVERHEAD_TOKENS
+
+
+def input_tokens(items: Any) -> int:
+    """Estimated input tokens of a request: chat messages or Responses input items."""
+    if isinstance(items, str):
+        return estimate_tokens(items)
+    total = 0
+    for item in items or ():
+        if not isinstance(item, dict):
+            continue
+        if "content" in item:
+            total += message_tokens(item)
+        else:  # function_call / function_call_output items
+            total += estimate_tokens(str(item.get("output") or item.get("arguments") or ""))
+    return total
+
+
+def usage_tokens(usage: dict[str, Any]) -> int:
+    """Billed tokens of a normalised usage dict (input + output + reasoning)."""
+    return sum(int(usage.get(key, 0) or 0) for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens"))
@@ -0,0 +1,99 @@
+"""Per-update plumbing: users in parallel, each user's updates in order.
+
+With ``concurrent_updates(n)`` python-telegram-bot's ``SimpleUpdateProcessor``
+runs any *n* updates at once, so two quick messages from the same user race
+on the conversation history and the ``previous_response_id`` chain.
+:class:`PerUserUpdateProcessor` queues every update on a per-user lock first
+(FIFO, in arrival order) and only then takes one of the ``max_concurrent``
+slots — a user flooding the bot waits on their own lock instead of holding
+slots other users need.  It is only used when ``TELEGRAM_CONCURRENT_UPDATES``
+is above 1; by default updates are handled one at a time.
+
+:func:`bind_current_user` runs before all handlers and keys the update's API
+calls by its sender for fair queuing (:data:`concurrency.current_user`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable
+
+import structlog
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, ContextTypes
+
+from concurrency import current_user
+
+logger = structlog.get_logger(__name__)
+
+# The base class semaphore is taken before the per-user lock; keep it
+# non-limiting and enforce max_concurrent after the lock instead.
+_UNBOUNDED: int = 2**31 - 1
+
+
+def _update_key(update: object) -> int | None:
+    """Serialization key: the sender, else the chat (None = not serialized)."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+async def bind_current_user(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Group -1 handler: attribute the update's API calls to its sender."""
+    user = update.effective_user if isinstance(update, Update) else None
+    current_user.set(user.id if user is not None else None)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently across users and sequentially per user."""
+
+    def __init__(self, max_concurrent: int) -> None:
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be a positive integer")
+        super().__init__(_UNBOUNDED)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.BoundedSemaphore(max_concurrent)
+        # key -> (lock, updates holding or waiting for it); dropped when idle
+        self._users: dict[int, tuple[asyncio.Lock, int]] = {}
+        self._stats: dict[str, int] = {"processed": 0, "queued_behind_user": 0}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            self._stats["processed"] += 1
+            return
+
+        lock, users = self._users.get(key, (asyncio.Lock(), 0))
+        if lock.locked():
+            self._stats["queued_behind_user"] += 1
+        self._users[key] = (lock, users + 1)
+        try:
+            async with lock, self._slots:
+                await coroutine
+            self._stats["processed"] += 1
+        finally:
+            lock, users = self._users[key]
+            if users <= 1:
+                del self._users[key]
+            else:
+                self._users[key] = (lock, users - 1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def status(self) -> dict[str, Any]:
+        """Return processor metrics for diagnostics."""
+        return {
+            **self._stats,
+            "max_concurrent": self.max_concurrent,
+            "active_users": len(self._users),
+        }
@@ -34,12 +34,8 @@ _ITALIC_RE = re.compile(r"(?<!\*)\*([^\*]+)\*(?!\*)")
 _LINK_RE = re.compile(r"\[([^\]]+)\]\((https?://[^\)]+)\)")
 
 
-def markdown_to_telegram_html(text: str) -> str:
-    """Convert common Markdown to Telegram-safe HTML.
-
-    Handles code blocks, inline code, bold, italic, and links.
-    All content is HTML-escaped to prevent broken tags in Telegram.
-    """
+def _markdown_with_placeholders(text: str) -> tuple[str, list[str], list[str]]:
+    """Run conversion steps 1–4, leaving code as ``\x00`` placeholders."""
     # 1. Extract code blocks first to protect their contents
     code_blocks: list[str] = []
 
@@ -69,15 +65,96 @@ def markdown_to_telegram_html(text: str) -> str:
     result = _ITALIC_RE.sub(r"<i>\1</i>", result)
     result = _LINK_RE.sub(r'<a href="\2">\1</a>', result)
 
-    # 5. Restore code blocks and inline codes
+    return result, code_blocks, inline_codes
+
+
+def _restore_placeholders(result: str, code_blocks: list[str], inline_codes: list[str]) -> str:
+    """Step 5: put converted code blocks and inline codes back."""
     for idx, block in enumerate(code_blocks):
         result = result.replace(f"\x00CODEBLOCK{idx}\x00", block)
     for idx, code in enumerate(inline_codes):
         result = result.replace(f"\x00INLINE{idx}\x00", code)
-
     return result
 
 
+def markdown_to_telegram_html(text: str) -> str:
+    """Convert common Markdown to Telegram-safe HTML.
+
+    Handles code blocks, inline code, bold, italic, and links.
+    All content is HTML-escaped to prevent broken tags in Telegram.
+    """
+    return _restore_placeholders(*_markdown_with_placeholders(text))
+
+
+def _is_closed_chunk(converted: str) -> bool:
+    """Return True if no Markdown construct can continue past this chunk.
+
+    *converted* is the placeholder form of a chunk ending with ``\n``.  Any
+    leftover backtick or asterisk may still pair with text that has not
+    arrived yet (code, inline code and italics can span lines), as may an
+    unclosed ``[text`` or ``](url``.  Bold never spans a newline.
+    """
+    if "`" in converted or "*" in converted:
+        return False
+    bracket = converted.rfind("[")
+    if bracket != -1 and converted.find("]", bracket) == -1:
+        return False
+    target = converted.rfind("](")
+    if target != -1 and converted.find(")", target) == -1:
+        return False
+    return True
+
+
+class IncrementalMarkdownConverter:
+    """Streaming counterpart of :func:`markdown_to_telegram_html`.
+
+    Deltas are appended with :meth:`feed`.  Whenever the text up to a newline
+    is *closed* (see :func:`_is_closed_chunk`) it is converted once and cached;
+    only the unstable tail — an open code fence, unfinished emphasis or link —
+    is re-rendered by :meth:`render`.  Because a closed prefix converts
+    independently of what follows, the output is identical to the batch
+    function applied to the whole text.
+    """
+
+    def __init__(self) -> None:
+        self._stable_html = ""
+        self._stable_len = 0
+        self._tail = ""
+
+    def __len__(self) -> int:
+        return self._stable_len + len(self._tail)
+
+    def feed(self, delta: str) -> None:
+        """Append a streamed text delta."""
+        self._tail += delta
+
+    def _try_commit(self, cut: int) -> bool:
+        chunk = self._tail[:cut]
+        converted, code_blocks, inline_codes = _markdown_with_placeholders(chunk)
+        if not _is_closed_chunk(converted):
+            return False
+        self._stable_html += _restore_placeholders(converted, code_blocks, inline_codes)
+        self._stable_len += cut
+        self._tail = self._tail[cut:]
+        return True
+
+    def _commit(self) -> None:
+        cut = self._tail.rfind("\n") + 1
+        if cut <= 0 or self._try_commit(cut):
+            return
+        # An open code fence keeps the tail unstable — at least freeze what precedes it.
+        fence = self._tail.rfind("```", 0, cut)
+        if fence > 0:
+            cut = self._tail.rfind("\n", 0, fence) + 1
+            if cut > 0:
+                self._try_commit(cut)
+
+    def render(self) -> str:
+        """Return Telegram HTML for everything fed so far."""
+        self._commit()
+        return self._stable_html + markdown_to_telegram_html(self._tail)
+
+
 # ---------------------------------------------------------------------------
 # Message splitting
 # ---------------------------------------------------------------------------
@@ -89,56 +166,150 @@ def split_message(text: str, max_length: int = 4000) -> list[str]:
 
     Splitting priority: double‑newline → newline → space.
     Code blocks (````` … `````) are never cut in the middle.
+    Works on indices into *text* — only the emitted parts are copied.
     """
     if len(text) <= max_length:
         return [text]
 
     parts: list[str] = []
-    remaining = text
+    start = 0
+    length = len(text)
 
-    while remaining:
-        if len(remaining) <= max_length:
-            parts.append(remaining)
+    while start < length:
+        end = start + max_length
+        if end >= length:
+            parts.append(text[start:])
             break
 
-        chunk = remaining[:max_length]
-
         # Don't split inside a code block
-        open_ticks = chunk.count("```")
-        if open_ticks % 2 != 0:
+        if text.count("```", start, end) % 2 != 0:
             # We're inside a code block — find its start and cut before it
-            last_open = chunk.rfind("```")
-            if last_open > 0:
-                chunk = chunk[:last_open]
+            last_open = text.rfind("```", start, end)
+            if last_open > start:
+                end = last_open
 
         # Try to split at a natural boundary
-        split_pos = _find_split_pos(chunk)
-        chunk = remaining[:split_pos]
-        remaining = remaining[split_pos:].lstrip("\n")
-        parts.append(chunk)
+        split_pos = _find_split_pos(text, start, end)
+        parts.append(text[start:split_pos])
+        start = split_pos
+        while start < length and text[start] == "\n":
+            start += 1
 
     return parts if parts else [text]
 
 
-def _find_split_pos(chunk: str) -> int:
-    """Return the best split position inside *chunk*."""
-    # 1. Double newline
-    pos = chunk.rfind("\n\n")
-    if pos > 0:
-        return pos
+def _find_split_pos(text: str, start: int, end: int) -> int:
+    """Return the best split position inside ``text[start:end]``."""
+    # 1. Double newline, 2. single newline, 3. space
+    for sep in ("\n\n", "\n", " "):
+        pos = text.rfind(sep, start, end)
+        if pos > start:
+            return pos
 
-    # 2. Single newline
-    pos = chunk.rfind("\n")
-    if pos > 0:
-        return pos
+    # 4. Hard cut
+    return end
 
-    # 3. Space
-    pos = chunk.rfind(" ")
-    if pos > 0:
-        return pos
 
-    # 4. Hard cut
-    return len(chunk)
+_HTML_TOKEN_RE = re.compile(r"<[^<>]*>|&#?\w+;|\n\n|\n|[^<&\n]+|[<&]")
+_HTML_TAG_NAME_RE = re.compile(r"</?([a-zA-Z][a-zA-Z0-9]*)")
+
+# Cut-point priorities for split_html_message (lower wins)
+_CUT_PRIORITY = {"\n\n": 0, "\n": 1, " ": 2}
+_CUT_IN_PRE = 3
+
+_TagStack = tuple[tuple[str, str], ...]
+
+
+def _closing_tags(stack: _TagStack) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def split_html_message(html: str, max_length: int = 4000) -> list[str]:
+    """Split Telegram HTML (see :func:`markdown_to_telegram_html`) into parts.
+
+    Single pass over a tag/entity/whitespace tokenizer with the same priority
+    as :func:`split_message`.  Tags and entities are never cut; ``<pre>``
+    blocks are cut (at a line end) only when they do not fit in a part on
+    their own.  Tags open at a cut are closed at the end of the part and
+    reopened at the start of the next one.
+    """
+    if len(html) <= max_length:
+        return [html]
+
+    parts: list[str] = []
+    stack: list[tuple[str, str]] = []
+    closing_len = 0
+    pre_depth = 0
+    start = 0
+    prefix = ""
+    # Latest fitting cut point per priority: (position, open tags at that position)
+    best: dict[int, tuple[int, _TagStack]] = {}
+
+    for match in _HTML_TOKEN_RE.finditer(html):
+        token = match.group()
+        token_start, token_end = match.span()
+        name_match = _HTML_TAG_NAME_RE.match(token) if token[0] == "<" and len(token) > 1 else None
+        opening = name_match is not None and token[1] != "/"
+        # Length change of the closing tags reserved for this part
+        extra = 0
+        if name_match is not None:
+            extra = len(name_match.group(1)) + 3 if opening else -len(token)
+
+        while len(prefix) + (token_end - start) + closing_len + extra > max_length:
+            room = max(1, max_length - len(prefix) - closing_len)
+            inner_space = -1
+            if not (0 in best or 1 in best) and not pre_depth and token[0] not in "<&\n":
+                inner_space = html.rfind(" ", max(token_start, start + 1), start + room)
+            if inner_space > start:
+                cut, snapshot, skip_newlines = inner_space, tuple(stack), False
+            elif best:
+                priority = min(best)
+                cut, snapshot = best[priority]
+                skip_newlines = priority != _CUT_IN_PRE
+            elif token_start > start:
+                cut, snapshot, skip_newlines = token_start, tuple(stack), pre_depth == 0
+            else:
+                # A single word longer than a whole part — hard cut inside it
+                cut, snapshot, skip_newlines = start + room, tuple(stack), False
+
+            parts.append(prefix + html[start:cut] + _closing_tags(snapshot))
+            prefix = "".join(tag for _, tag in snapshot)
+            start = cut
+            if skip_newlines:
+                while start < token_start and html[start] == "\n":
+                    start += 1
+            best = {p: c for p, c in best.items() if c[0] > start}
+
+        if name_match is not None:
+            name = name_match.group(1).lower()
+            if opening:
+                if name == "pre" and not stack and token_start > start:
+                    best[_CUT_PRIORITY["\n"]] = (token_start, ())
+                stack.append((name, token))
+                closing_len += len(name) + 3
+                pre_depth += name == "pre"
+            else:
+                for idx in range(len(stack) - 1, -1, -1):
+                    if stack[idx][0] == name:
+                        for closed, _ in stack[idx:]:
+                            closing_len -= len(closed) + 3
+                            pre_depth -= closed == "pre"
+                        del stack[idx:]
+                        break
+        elif token[0] == "\n":
+            if pre_depth:
+                best[_CUT_IN_PRE] = (token_end, tuple(stack))
+            elif token_start > start:
+                best[_CUT_PRIORITY[token]] = (token_start, tuple(stack))
+        elif not pre_depth:
+            space = token_start + token.rfind(" ")
+            if space >= token_start and space > start:
+                best[_CUT_PRIORITY[" "]] = (space, tuple(stack))
+
+    tail = prefix + html[start:]
+    if tail:
+        parts.append(tail)
+    return parts if parts else [html]
 
 
 # ---------------------------------------------------------------------------
@@ -151,8 +322,13 @@ def format_footer(
     reasoning_tokens: int,
     cost_usd: float,
     elapsed_seconds: float,
+    *,
+    cached: bool = False,
 ) -> str:
-    """Return a compact one‑line footer for a bot response."""
+    """Return a compact one‑line footer for a bot response.
+
+    *cached* marks an answer served from the response cache.
+    """
     return (
         f"⚙️ {model} | "
         f"📥 {format_number(tokens_in)} "
@@ -160,6 +336,7 @@ def format_footer(
         f"🧠 {format_number(reasoning_tokens)} | "
         f"💰 ${cost_usd:.4f} | "
         f"⏱ {elapsed_seconds:.1f}s"
+        + (" | ♻️ z cache" if cached else "")
     )
 
 
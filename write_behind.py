@@ -0,0 +1,170 @@
+"""Async write-behind queue that batches database writes into one transaction.
+
+Handlers enqueue records and return immediately; a background task flushes
+everything queued so far through a single ``flush_batch`` coroutine once the
+oldest record is ``interval`` seconds old or ``max_items`` records are
+waiting.  Under bursty load this turns one commit (and WAL fsync) per
+message into one per batch.
+
+A failed batch is retried on the next flush up to ``max_attempts`` times and
+then handed to ``on_drop`` so callers can invalidate derived state.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class WriteBehindQueue(Generic[T]):
+    """Time/size-triggered batching queue with explicit flush and drain."""
+
+    def __init__(
+        self,
+        flush_batch: Callable[[list[T]], Awaitable[None]],
+        *,
+        interval: float = 0.25,
+        max_items: int = 100,
+        max_attempts: int = 3,
+        on_drop: Callable[[list[T]], None] | None = None,
+    ) -> None:
+        self._flush_batch = flush_batch
+        self._interval = interval
+        self._max_items = max_items
+        self._max_attempts = max_attempts
+        self._on_drop = on_drop
+
+        self._items: list[T] = []
+        # Rows of the batch currently being written by flush_batch
+        self._in_flight = 0
+        self._attempts = 0
+        self._oldest_at = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._flush_lock: asyncio.Lock | None = None
+        self._worker: asyncio.Task[None] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self._stats: dict[str, int] = {
+            "enqueued": 0,
+            "batches": 0,
+            "rows": 0,
+            "failures": 0,
+            "dropped": 0,
+        }
+
+    @property
+    def pending(self) -> int:
+        """Rows not yet committed: queued plus the batch being written."""
+        return len(self._items) + self._in_flight
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def put(self, item: T) -> None:
+        """Queue *item* for the next batch."""
+        self._ensure_worker()
+        if not self._items:
+            self._oldest_at = time.monotonic()
+        self._items.append(item)
+        self._stats["enqueued"] += 1
+        assert self._wakeup is not None
+        self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Write everything queued so far and wait for a batch already in flight.
+
+        No-op when nothing is pending.  A batch swapped out by a concurrent
+        flush is awaited via the flush lock, so on return every row put before
+        the call has been committed (or handed back for retry).
+        """
+        if not self.pending:
+            return
+        self._bind_loop()
+        assert self._flush_lock is not None
+        async with self._flush_lock:
+            batch, self._items = self._items, []
+            if not batch:
+                return
+            self._in_flight = len(batch)
+            try:
+                await self._flush_batch(batch)
+            except Exception:
+                self._stats["failures"] += 1
+                self._attempts += 1
+                if self._attempts >= self._max_attempts:
+                    self._attempts = 0
+                    self._stats["dropped"] += len(batch)
+                    logger.exception("write_behind_batch_dropped", rows=len(batch))
+                    if self._on_drop is not None:
+                        self._on_drop(batch)
+                else:
+                    logger.exception("write_behind_flush_failed", rows=len(batch))
+                    # Keep order: the failed batch goes back in front of newer items
+                    self._items = batch + self._items
+                    self._oldest_at = time.monotonic()
+                return
+            finally:
+                self._in_flight = 0
+            self._attempts = 0
+            self._stats["batches"] += 1
+            self._stats["rows"] += len(batch)
+
+    async def close(self) -> None:
+        """Stop the worker and drain the queue (call at shutdown)."""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+        for _ in range(self._max_attempts):
+            if not self._items:
+                break
+            await self.flush()
+
+    def status(self) -> dict[str, Any]:
+        """Return queue metrics for diagnostics."""
+        return {**self._stats, "pending": len(self._items), "in_flight": self._in_flight}
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # New event loop (e.g. restart or tests): loop-bound primitives are recreated
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._worker = None
+
+    def _ensure_worker(self) -> None:
+        self._bind_loop()
+        if self._worker is None or self._worker.done():
+            assert self._loop is not None
+            self._worker = self._loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        wakeup = self._wakeup
+        while True:
+            if not self._items:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            delay = self._oldest_at + self._interval - time.monotonic()
+            if len(self._items) < self._max_items and delay > 0:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.flush()